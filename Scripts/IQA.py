@@ -1,6 +1,5 @@
 import cv2
 import numpy as np
-from PIL import Image
 import os
 import torch
 import logging
@@ -10,18 +9,34 @@ import easyocr
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Assessment modes: 'full' always runs OCR on the whole image, 'tiered' stops after the
+# cheap checks when one of them fails and estimates OCR confidence on a sample
+ASSESSMENT_MODES = ('full', 'tiered')
+
 class ImageQualityAssessor:
     def __init__(self, min_resolution=(640, 480),
                  blur_threshold=40,
                  brightness_range=(0.2, 1.1),
                  ocr_languages=['en'], # Language(s) for EasyOCR
-                 ocr_min_confidence=0.6): # Minimum average confidence to pass
+                 ocr_min_confidence=0.6, # Minimum average confidence to pass
+                 ocr_sample='tiles', # Tiered mode: 'tiles' (text-dense crops) or 'downscale'
+                 ocr_max_side=1280, # Tiered mode: longest side for 'downscale'
+                 ocr_tile_size=640, # Tiered mode: tile size in pixels for 'tiles'
+                 ocr_tiles=4, # Tiered mode: number of tiles to read
+                 ocr_escalation_margin=0.05): # Tiered mode: rerun full OCR when this close to the threshold
 
         logger.info("Initializing ImageQualityAssessor...")
         self.min_resolution = min_resolution
         self.blur_threshold = blur_threshold
         self.brightness_range = brightness_range
         self.ocr_min_confidence = ocr_min_confidence
+        if ocr_sample not in ('tiles', 'downscale'):
+            raise ValueError("ocr_sample must be 'tiles' or 'downscale'")
+        self.ocr_sample = ocr_sample
+        self.ocr_max_side = ocr_max_side
+        self.ocr_tile_size = ocr_tile_size
+        self.ocr_tiles = ocr_tiles
+        self.ocr_escalation_margin = ocr_escalation_margin
 
         # Initialize EasyOCR Reader
         # Use GPU if available, otherwise CPU
@@ -38,13 +53,19 @@ class ImageQualityAssessor:
 
     def _run_ocr(self, image_data):
         """Run EasyOCR and return analysis."""
+        return self._run_ocr_on([image_data])
+
+    def _run_ocr_on(self, images):
+        """Run EasyOCR on one or more images and return the analysis over all detected texts."""
         try:
-            if image_data is None:
+            if any(image is None for image in images):
                  logger.error("OCR Step: Received None as image data.")
                  return {"error": "Received None as image data", "average_confidence": 0.0}
 
-            logger.info(f"OCR Step: Processing image data with shape: {image_data.shape}")
-            ocr_results = self.reader.readtext(image_data, detail=1)
+            ocr_results = []
+            for image in images:
+                logger.info(f"OCR Step: Processing image data with shape: {image.shape}")
+                ocr_results.extend(self.reader.readtext(image, detail=1))
 
             total_confidence = 0
             detected_texts = []
@@ -67,9 +88,95 @@ class ImageQualityAssessor:
             logger.exception(f"Error during OCR processing with direct data: {str(e)}")
             return {"error": str(e), "average_confidence": 0.0}
 
-    def assess_image(self, image_data):
-        """Assess an image using traditional checks and OCR quality based on image data."""
-        logger.info("Assessing image data...")
+    def _ocr_quality(self, ocr_analysis):
+        """Turn an OCR analysis into the ocr_quality check."""
+        if "error" in ocr_analysis:
+            logger.error(f"OCR failed: {ocr_analysis['error']}")
+            return {
+                "pass": False,
+                "message": f"OCR processing failed: {ocr_analysis['error']}",
+                "average_confidence": 0.0
+            }
+
+        avg_conf = ocr_analysis["average_confidence"]
+        conf_pass = avg_conf >= self.ocr_min_confidence
+        ocr_pass = conf_pass
+
+        message = f"OCR Quality: Avg Conf {avg_conf:.2f} ({'OK' if conf_pass else 'LOW'})"
+        if not ocr_pass:
+            message = f"Confidence too low ({avg_conf:.2f})"
+
+        return {
+            "pass": ocr_pass,
+            "average_confidence": avg_conf,
+            "min_confidence_required": self.ocr_min_confidence,
+            "message": message
+        }
+
+    def _downscaled(self, img):
+        """The image with its longer side reduced to ocr_max_side (unchanged if already smaller)."""
+        h, w = img.shape[:2]
+        scale = self.ocr_max_side / max(h, w)
+        if scale >= 1:
+            return img
+        return cv2.resize(img, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv2.INTER_AREA)
+
+    def _text_dense_tiles(self, img):
+        """
+        Crop the `ocr_tiles` tiles (at full resolution) with the most edge pixels,
+        which on a document page are the ones with the most text.
+        """
+        h, w = img.shape[:2]
+        size = self.ocr_tile_size
+        if h <= size and w <= size:
+            return [img]
+
+        # Edge density per tile on a small copy; 8 px per tile is enough to rank them
+        rows, cols = -(-h // size), -(-w // size)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (cols * 8, rows * 8), interpolation=cv2.INTER_AREA)
+        edges = cv2.Canny(small, 50, 150)
+        density = edges.reshape(rows, 8, cols, 8).mean(axis=(1, 3))
+
+        best = np.argsort(density, axis=None)[::-1][:self.ocr_tiles]
+        tiles = []
+        for index in best:
+            r, c = divmod(int(index), cols)
+            # Keep edge tiles full size by shifting them inside the image
+            y = min(r * size, max(h - size, 0))
+            x = min(c * size, max(w - size, 0))
+            tiles.append(img[y:y + size, x:x + size])
+        return tiles
+
+    def _sampled_ocr_quality(self, img):
+        """OCR confidence estimated on a downscaled copy or on text-dense tiles."""
+        if self.ocr_sample == 'downscale':
+            samples = [self._downscaled(img)]
+        else:
+            samples = self._text_dense_tiles(img)
+        quality = self._ocr_quality(self._run_ocr_on(samples))
+        quality["sample"] = {"method": self.ocr_sample, "images": len(samples)}
+        return quality
+
+    def assess_image(self, image_data, mode='full'):
+        """
+        Assess an image using traditional checks and OCR quality based on image data.
+
+        Args:
+            image_data (numpy.ndarray): BGR image
+            mode (str): 'full' runs every check and OCR on the whole image. 'tiered'
+                skips OCR when a cheap check (resolution, blur, brightness) already
+                fails, and otherwise estimates the OCR confidence on a sample of the
+                image (see `ocr_sample`), rerunning full OCR only when the sampled
+                confidence is within `ocr_escalation_margin` of the threshold
+
+        Returns:
+            dict: One entry per check, the overall 'pass' and 'tier', the step that
+                decided the verdict: 'basic' (cheap checks), 'ocr_sample' or 'ocr_full'
+        """
+        logger.info(f"Assessing image data ({mode} mode)...")
+        if mode not in ASSESSMENT_MODES:
+            raise ValueError(f"mode must be one of {', '.join(ASSESSMENT_MODES)}")
         try:
             # We already have image_data (NumPy array), no need to read from path
             if image_data is None:
@@ -80,50 +187,39 @@ class ImageQualityAssessor:
             cv_img = image_data
             logger.info(f"Image data received. Shape: {cv_img.shape}")
 
-            # Convert to PIL image for checks requiring it
-            try:
-                # OpenCV uses BGR, PIL uses RGB
-                pil_img = Image.fromarray(cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB))
-                logger.info(f"Converted to PIL Image. Size: {pil_img.size}")
-            except Exception as pil_e:
-                logger.error(f"Could not convert image data to PIL: {pil_e}")
-                return {"status": "error", "message": f"Could not convert image data to PIL: {pil_e}"}
-
             # Run traditional quality checks
             logger.info("Running traditional quality checks...")
             results = {
-                "resolution_check": self._check_resolution(pil_img), # Uses PIL
+                "resolution_check": self._check_resolution(cv_img),
                 "blur_check": self._check_blur(cv_img), # Uses OpenCV
                 "brightness_check": self._check_brightness(cv_img), # Uses OpenCV
             }
 
-            # Run OCR-based quality assessment
-            logger.info("Running OCR-based quality assessment...")
-            # Pass image_data (NumPy array) directly
-            ocr_analysis = self._run_ocr(image_data)
-
-            if "error" in ocr_analysis:
-                 logger.error(f"OCR failed: {ocr_analysis['error']}")
-                 results["ocr_quality"] = {
-                     "pass": False,
-                     "message": f"OCR processing failed: {ocr_analysis['error']}",
-                     "average_confidence": 0.0
-                 }
-            else:
-                avg_conf = ocr_analysis["average_confidence"]
-                conf_pass = avg_conf >= self.ocr_min_confidence
-                ocr_pass = conf_pass
-
-                message = f"OCR Quality: Avg Conf {avg_conf:.2f} ({'OK' if conf_pass else 'LOW'})"
-                if not ocr_pass:
-                    message = f"Confidence too low ({avg_conf:.2f})"
-
+            if mode == 'tiered' and not all(check["pass"] for check in results.values()):
+                # The verdict is already FAIL, OCR would not change it
+                logger.info("Cheap checks failed, skipping OCR")
                 results["ocr_quality"] = {
-                    "pass": ocr_pass,
-                    "average_confidence": avg_conf,
+                    "pass": False,
+                    "skipped": True,
                     "min_confidence_required": self.ocr_min_confidence,
-                    "message": message
+                    "message": "OCR not run: basic checks failed"
                 }
+                results["tier"] = "basic"
+            elif mode == 'tiered':
+                logger.info("Running sampled OCR-based quality assessment...")
+                results["ocr_quality"] = self._sampled_ocr_quality(cv_img)
+                results["tier"] = "ocr_sample"
+                avg_conf = results["ocr_quality"].get("average_confidence", 0.0)
+                if abs(avg_conf - self.ocr_min_confidence) < self.ocr_escalation_margin:
+                    logger.info(f"Sampled confidence {avg_conf:.2f} is borderline, running full OCR...")
+                    results["ocr_quality"] = self._ocr_quality(self._run_ocr(cv_img))
+                    results["tier"] = "ocr_full"
+            else:
+                # Run OCR-based quality assessment
+                logger.info("Running OCR-based quality assessment...")
+                # Pass image_data (NumPy array) directly
+                results["ocr_quality"] = self._ocr_quality(self._run_ocr(cv_img))
+                results["tier"] = "ocr_full"
 
             # Overall verdict
             results["pass"] = all(check["pass"] for check_name, check in results.items()
@@ -137,8 +233,11 @@ class ImageQualityAssessor:
             return {"status": "error", "message": f"Assessment failed: {str(e)}"}
     
     def _check_resolution(self, img):
-        """Check if image resolution meets minimum requirements."""
-        width, height = img.size
+        """Check if image resolution meets minimum requirements (PIL image or NumPy array)."""
+        if isinstance(img, np.ndarray):
+            height, width = img.shape[:2]
+        else:
+            width, height = img.size
         min_width, min_height = self.min_resolution
         
         # Fix: Check if both dimensions are at least the minimum
@@ -1,6 +1,124 @@
 import os
-from paddleocr import PPStructure, draw_structure_result, save_structure_res
+import cv2
+from paddleocr import draw_structure_result, save_structure_res
 from PIL import Image
+from Scripts.instrumentation import span
+from Scripts.json_utils import to_builtin_types
+from Scripts.model_registry import registry, STRUCTURE_MODEL
+from Scripts.preprocess_pool import get_pool, to_shared_memory, from_shared_memory
+from Scripts.tiled_ocr import tile_grid, merge_tile_regions, DEFAULT_TILE_SIZE, DEFAULT_TILE_OVERLAP
+
+def _result_regions(result):
+    """Drop the cropped 'img' arrays from a PP-Structure result and convert it to plain types."""
+    return [to_builtin_types({k: v for k, v in region.items() if k != 'img'}) for region in result]
+
+def run_structure(image):
+    """
+    Run PP-Structure on an image path or BGR array and return the regions in memory.
+    
+    The regions are returned without their cropped 'img' arrays, i.e. in the same
+    structure save_structure_res writes to res_0.txt.
+    """
+    with registry.get(STRUCTURE_MODEL) as table_engine, span('ocr.pp_structure'):
+        result = table_engine(image)
+    return _result_regions(result), result
+
+def run_structure_batch(images):
+    """
+    Run PP-Structure on several images while holding the model once.
+    
+    PP-Structure takes one page per call; its text recognizer already batches the
+    text lines of a page (rec_batch_num), so the pages are fed back to back.
+    
+    Returns:
+        list: (regions, result) tuples in the same order as images
+    """
+    outputs = []
+    with registry.get(STRUCTURE_MODEL) as table_engine:
+        for image in images:
+            with span('ocr.pp_structure'):
+                result = table_engine(image)
+            outputs.append((_result_regions(result), result))
+    return outputs
+
+def _structure_tile_in_worker(descriptor):
+    """Run PP-Structure on one tile in a pool worker (each worker loads its own model)."""
+    tile = from_shared_memory(descriptor)
+    regions, _ = run_structure(tile)
+    return regions
+
+def run_structure_tiled(image, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_TILE_OVERLAP, workers=0):
+    """
+    Run PP-Structure on overlapping tiles of a large page and merge the results.
+    
+    Each inference only sees a tile_size x tile_size crop, which bounds the memory
+    of a single call on very large scans. Regions read twice in an overlap are
+    de-duplicated and text lines cut by a seam are stitched (see merge_tile_regions).
+    
+    Args:
+        image (str or numpy.ndarray): Image path or BGR array
+        tile_size (int): Tile side in pixels
+        overlap (int): Overlap between neighbouring tiles in pixels; should be
+            larger than the text height so every line is whole in at least one tile
+        workers (int): Run the tiles on this many worker processes, each with its
+            own PP-Structure model; 0 runs them one after another on the shared model
+    
+    Returns:
+        tuple: (regions, result) like run_structure, with the regions in page coordinates
+    """
+    if isinstance(image, str):
+        image = cv2.imread(image)
+        if image is None:
+            raise ValueError("Could not read image for tiled OCR")
+    height, width = image.shape[:2]
+    tiles = tile_grid(width, height, tile_size, overlap)
+    crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles]
+
+    with span('ocr.pp_structure_tiled'):
+        if workers:
+            pool = get_pool(workers, name='ocr')
+            descriptors = [to_shared_memory(crop) for crop in crops]
+            futures = [pool.submit(_structure_tile_in_worker, descriptor) for descriptor in descriptors]
+            try:
+                tile_regions = [future.result() for future in futures]
+            finally:
+                # Blocks of tiles whose worker failed before reading them
+                for descriptor, future in zip(descriptors, futures):
+                    if future.exception() is not None:
+                        try:
+                            from_shared_memory(descriptor)
+                        except FileNotFoundError:
+                            pass
+        else:
+            tile_regions = [regions for regions, _ in run_structure_batch(crops)]
+
+        with span('ocr.merge_tiles'):
+            regions = merge_tile_regions(list(zip(tiles, tile_regions)), width, height)
+
+    # save_structure_output expects the region crops, as in a PP-Structure result
+    result = []
+    for region in regions:
+        x1, y1, x2, y2 = (int(v) for v in region['bbox'])
+        result.append(dict(region, img=image[max(y1, 0):y2, max(x1, 0):x2]))
+    return regions, result
+
+def save_structure_output(result, image, image_path, output_dir=None):
+    """Write res_0.json and the structure visualization for a PP-Structure result."""
+    if output_dir is None:
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output_dir = os.path.join(project_root, 'output', 'ai-model')
+    base_name = os.path.basename(image_path).split('.')[0]
+    result_output_dir = os.path.join(output_dir, base_name)
+    os.makedirs(result_output_dir, exist_ok=True)
+
+    save_structure_res(result, output_dir, base_name)
+    rename_txt_to_json(result_output_dir)
+
+    if not isinstance(image, Image.Image):
+        image = Image.open(image_path) if image is None else Image.fromarray(image[:, :, ::-1])
+    im_show = draw_structure_result(image.convert('RGB'), result, font_path='/System/Library/Fonts/Times.ttc')
+    Image.fromarray(im_show).save(os.path.join(result_output_dir, f"{base_name}_structure.png"))
+    return os.path.join(result_output_dir, 'res_0.json')
 
 def ai_processing(image_path):
     """
@@ -20,34 +138,14 @@ def ai_processing(image_path):
         output_dir = os.path.join(project_root, 'output', 'ai-model')
         os.makedirs(output_dir, exist_ok=True)
         
-        # Get base name for output files
-        base_name = os.path.basename(image_path).split('.')[0]
-        
-        # Define output paths
-        result_output_dir = os.path.join(output_dir, base_name)
-        visualization_path = os.path.join(result_output_dir, f"{base_name}_structure.png")
-        json_path = os.path.join(result_output_dir, 'res_0.json')
-        
         print(f"Running AI model processing on {image_path}")
-        print(f"Output directory: {result_output_dir}")
-        
-        # Initialize model
-        table_engine = PPStructure(show_log=False)
+        print(f"Output directory: {output_dir}")
         
-        # Process the image
-        result = table_engine(image_path)
+        # Process the image with the shared, already loaded model
+        _, result = run_structure(image_path)
 
-        save_structure_res(result, output_dir, os.path.basename(image_path).split('.')[0])
-
-        # Convert .txt file to .json file
-        rename_txt_to_json(output_dir)
-        
-        # Draw the structure result and save the visualization
-        image = Image.open(image_path).convert('RGB')
-        font_path = '/System/Library/Fonts/Times.ttc'
-        im_show = draw_structure_result(image, result, font_path=font_path)
-        im_show = Image.fromarray(im_show)
-        im_show.save(visualization_path)
+        # Save res_0.json and the structure visualization
+        json_path = save_structure_output(result, None, image_path, output_dir)
         
         print(f"AI model processing completed. Results saved to: {output_dir}")
         
@@ -0,0 +1,471 @@
+"""
+Micro-benchmarks for the processing pipeline.
+
+Usage:
+    python -m Scripts.benchmarks overlap --rows 40 --cols 10
+    python -m Scripts.benchmarks db_save --items 2000
+    python -m Scripts.benchmarks search --items 1000000
+    python -m Scripts.benchmarks corners --megapixels 12 24 48
+    python -m Scripts.benchmarks preprocess --megapixels 12
+    python -m Scripts.benchmarks preprocess_many --pages 16
+    python -m Scripts.benchmarks deskew --megapixels 12
+    python -m Scripts.benchmarks cell_ocr --images scan1.jpg scan2.jpg [--references edited1.json edited2.json]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Allow running as a plain script from the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _timed(func, *args, repeat=3, **kwargs):
+    """Run func `repeat` times and return (best time in seconds, last result)."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def synthetic_page(rows, cols, cell_w=120, cell_h=40, seed=0):
+    """Build a grid of cell boxes and one or two jittered text boxes per cell."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    cells = []
+    text_regions = []
+    for r in range(rows):
+        for c in range(cols):
+            x1, y1 = c * cell_w, r * cell_h
+            cells.append({'coordinate': [x1, y1, x1 + cell_w, y1 + cell_h], 'score': 0.9})
+            for _ in range(rng.integers(1, 3)):
+                tx1 = x1 + rng.uniform(-20, cell_w * 0.6)
+                ty1 = y1 + rng.uniform(-5, cell_h * 0.5)
+                tw, th = rng.uniform(20, cell_w * 1.5), rng.uniform(10, cell_h * 0.6)
+                text_regions.append([[tx1, ty1], [tx1 + tw, ty1], [tx1 + tw, ty1 + th], [tx1, ty1 + th]])
+    return cells, text_regions
+
+
+def bench_overlap(args):
+    import numpy as np
+    from Scripts.merge_split import cell_to_polygon, text_region_to_polygon, get_overlap_percentage
+    from Scripts.box_overlap import region_to_box, box_overlap_matrix
+
+    cells, text_regions = synthetic_page(args.rows, args.cols)
+    cell_polys = [cell_to_polygon(c) for c in cells]
+    text_polys = [text_region_to_polygon(t) for t in text_regions]
+    print(f"{len(cells)} cells x {len(text_regions)} text items = {len(cells) * len(text_regions)} pairs")
+
+    def shapely_path():
+        return np.array([[get_overlap_percentage(t, c) for c in cell_polys] for t in text_polys])
+
+    def vectorized_path():
+        text_boxes = [region_to_box(t) for t in text_regions]
+        return box_overlap_matrix(text_boxes, [c.bounds for c in cell_polys])
+
+    shapely_time, expected = _timed(shapely_path, repeat=args.repeat)
+    numpy_time, actual = _timed(vectorized_path, repeat=args.repeat)
+
+    print(f"Shapely get_overlap_percentage: {shapely_time * 1000:.1f} ms")
+    print(f"NumPy box_overlap_matrix:       {numpy_time * 1000:.1f} ms")
+    print(f"Speed-up: {shapely_time / numpy_time:.1f}x, max abs difference: {np.abs(expected - actual).max():.2e}")
+
+
+def synthetic_document(items):
+    """Merged JSON with `items` text items, split between cells and unassigned text."""
+    cells = [{'cell_id': i, 'text': f'cell text {i}', 'confidence': 0.9, 'edited': i % 7 == 0}
+             for i in range(items * 3 // 4)]
+    unassigned = [{'text_id': i, 'text': f'loose text {i}', 'confidence': 0.8}
+                  for i in range(items - len(cells))]
+    return {'cells_with_text': cells, 'unassigned_text': unassigned}
+
+
+def _save_document_per_row(db_path, json_data):
+    """The previous save path: a fresh connection and one INSERT per text item."""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    document_id = f'bench-{time.perf_counter_ns()}'
+    cursor.execute(
+        'INSERT INTO ocr_document (id, document_name, filename, created_at, image_path, original_image_path) VALUES (?, ?, ?, ?, ?, ?)',
+        (document_id, 'bench', 'bench.jpg', '', '', '')
+    )
+    for cell in json_data['cells_with_text']:
+        cursor.execute(
+            'INSERT INTO ocr_text_item (document_id, text, confidence, is_handwritten, text_region, edited) VALUES (?, ?, ?, ?, ?, ?)',
+            (document_id, cell['text'], cell.get('confidence', 0.0), 0,
+             json.dumps({"cell_id": cell['cell_id']}), 1 if cell.get('edited') else 0)
+        )
+    for text in json_data['unassigned_text']:
+        cursor.execute(
+            'INSERT INTO ocr_text_item (document_id, text, confidence, is_handwritten, text_region, edited) VALUES (?, ?, ?, ?, ?, ?)',
+            (document_id, text['text'], text.get('confidence', 0.0), 0,
+             json.dumps({"text_id": text['text_id']}), 1 if text.get('edited') else 0)
+        )
+    conn.commit()
+    conn.close()
+
+
+def bench_db_save(args):
+    from server.database import Database
+
+    json_data = synthetic_document(args.items)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The old path ran on a rollback-journal database
+        old_path = os.path.join(tmp_dir, 'per_row.db')
+        Database(old_path).close_connection()
+        conn = sqlite3.connect(old_path)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.close()
+        old_time, _ = _timed(_save_document_per_row, old_path, json_data, repeat=args.repeat)
+
+        db = Database(os.path.join(tmp_dir, 'pooled.db'))
+        new_time, _ = _timed(db.save_document, 'bench', 'bench.jpg', '', '', json_data, repeat=args.repeat)
+        db.close_connection()
+
+    print(f"save_document with {args.items} text items")
+    print(f"Per-row INSERTs, new connection: {old_time * 1000:.1f} ms")
+    print(f"Pooled WAL connection, executemany: {new_time * 1000:.1f} ms")
+    print(f"Speed-up: {old_time / new_time:.1f}x")
+
+
+SEARCH_WORDS = ('faktura', 'invoice', 'total', 'moms', 'beløb', 'dato', 'kunde', 'ordre',
+                'levering', 'betaling', 'konto', 'side', 'antal', 'pris', 'rabat', 'note')
+
+
+def _fill_text_items(db, items, per_document=500, seed=0):
+    """Insert `items` text items of random words through Database.save_document."""
+    import random
+    rng = random.Random(seed)
+    for start in range(0, items, per_document):
+        count = min(per_document, items - start)
+        unassigned = [{'text_id': i, 'text': ' '.join(rng.choices(SEARCH_WORDS, k=5)) + f' INV-{start + i}'}
+                      for i in range(count)]
+        db.save_document(f'bench-{start}', 'bench.jpg', '', '', {'cells_with_text': [], 'unassigned_text': unassigned})
+
+
+def bench_search(args):
+    from server.database import Database
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, 'search.db'))
+        start = time.perf_counter()
+        _fill_text_items(db, args.items)
+        print(f"Inserted {args.items} text items in {time.perf_counter() - start:.1f} s (index kept in sync)")
+
+        conn = db.get_connection()
+        needle = f'INV-{args.items // 2}'
+        scan_time, scan_rows = _timed(
+            lambda: conn.execute('SELECT id FROM ocr_text_item WHERE text LIKE ?', (f'%{needle}%',)).fetchall(),
+            repeat=args.repeat)
+        fts_time, fts_page = _timed(db.search, needle, repeat=args.repeat)
+        common_time, _ = _timed(db.search, 'faktura total', repeat=args.repeat)
+        prefix_time, _ = _timed(db.search, 'lev*', repeat=args.repeat)
+
+        start = time.perf_counter()
+        db.rebuild_search_index()
+        rebuild_time = time.perf_counter() - start
+        db.close_connection()
+
+    print(f"LIKE scan for {needle}:        {scan_time * 1000:.1f} ms ({len(scan_rows)} rows)")
+    print(f"FTS5 search for {needle}:      {fts_time * 1000:.1f} ms ({len(fts_page['results'])} rows)")
+    print(f"FTS5 common terms, top 20:    {common_time * 1000:.1f} ms")
+    print(f"FTS5 prefix query, top 20:    {prefix_time * 1000:.1f} ms")
+    print(f"Index rebuild:                {rebuild_time:.1f} s")
+
+
+def synthetic_photo(megapixels, seed=0):
+    """
+    A phone-photo-like image: a page with text lines, warped in perspective onto a
+    noisy darker background. Returns (image, true page corners ordered tl, tr, br, bl).
+    """
+    import cv2
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+
+    page_h, page_w = height * 3 // 4, int(height * 3 // 4 / 1.414)
+    page = np.full((page_h, page_w, 3), 235, dtype=np.uint8)
+    line_h = max(page_h // 60, 4)
+    for y in range(line_h * 4, page_h - line_h * 4, line_h * 2):
+        x2 = int(page_w * rng.uniform(0.5, 0.9))
+        cv2.rectangle(page, (page_w // 10, y), (x2, y + line_h // 2), (40, 40, 40), -1)
+
+    margin_x, margin_y = width * 0.15, height * 0.08
+    jitter = height * 0.04
+    corners = np.float32([
+        [margin_x + rng.uniform(0, jitter), margin_y + rng.uniform(0, jitter)],
+        [width - margin_x - rng.uniform(0, jitter), margin_y + rng.uniform(0, jitter)],
+        [width - margin_x - rng.uniform(0, jitter), height - margin_y - rng.uniform(0, jitter)],
+        [margin_x + rng.uniform(0, jitter), height - margin_y - rng.uniform(0, jitter)]
+    ])
+    src = np.float32([[0, 0], [page_w - 1, 0], [page_w - 1, page_h - 1], [0, page_h - 1]])
+    M = cv2.getPerspectiveTransform(src, corners)
+
+    image = rng.integers(50, 90, size=(height, width, 3), dtype=np.uint8)
+    cv2.warpPerspective(page, M, (width, height), dst=image, borderMode=cv2.BORDER_TRANSPARENT)
+    return image, corners
+
+
+def bench_corners(args):
+    import numpy as np
+    from Scripts.image_preprocess import find_document_corners, dewarp_image, order_points
+
+    for megapixels in args.megapixels:
+        image, truth = synthetic_photo(megapixels)
+        print(f"{image.shape[1]}x{image.shape[0]} ({megapixels} MP)")
+        for label, max_side in (('full resolution', 0), (f'max side {args.max_side}', args.max_side)):
+            corner_time, corners = _timed(find_document_corners, image, 0.3, max_side, repeat=args.repeat)
+            dewarp_time, _ = _timed(dewarp_image, image, 0.3, max_side, repeat=args.repeat)
+            if corners is None:
+                error = 'no document found'
+            else:
+                distances = np.linalg.norm(order_points(np.float32(corners)) - truth, axis=1)
+                error = f'max corner error {distances.max():.1f} px'
+            print(f"  {label:<18} corners {corner_time * 1000:7.1f} ms, dewarp {dewarp_time * 1000:7.1f} ms, {error}")
+
+
+def bench_preprocess(args):
+    import cv2
+    import numpy as np
+    from Scripts.image_preprocess import dewarp_image, clahe_enhance, gamma_correction, Preprocessor
+
+    image, _ = synthetic_photo(args.megapixels)
+    dewarped = dewarp_image(image)
+    print(f"{image.shape[1]}x{image.shape[0]} input, {dewarped.shape[1]}x{dewarped.shape[0]} after dewarp")
+
+    preprocessor = Preprocessor(gamma=1.2)
+
+    def step_functions(img):
+        return gamma_correction(clahe_enhance(img), gamma=1.2)
+
+    def cached_preprocessor(img):
+        result = preprocessor.enhance(img)
+        return cv2.LUT(result, preprocessor.gamma_lut, dst=result)
+
+    def step_pipeline(img):
+        return step_functions(dewarp_image(img))
+
+    old_time, expected = _timed(step_functions, dewarped, repeat=args.repeat)
+    new_time, actual = _timed(cached_preprocessor, dewarped, repeat=args.repeat)
+    print(f"clahe_enhance + gamma_correction: {old_time * 1000:.1f} ms")
+    print(f"Preprocessor (cached, reused):    {new_time * 1000:.1f} ms")
+    print(f"Speed-up: {old_time / new_time:.1f}x, identical output: {np.array_equal(expected, actual)}")
+
+    old_time, expected = _timed(step_pipeline, image, repeat=args.repeat)
+    new_time, actual = _timed(preprocessor.process, image, repeat=args.repeat)
+    print(f"Dewarp + CLAHE + gamma: {old_time * 1000:.1f} ms -> {new_time * 1000:.1f} ms, "
+          f"identical output: {np.array_equal(expected, actual)}")
+
+
+def bench_preprocess_many(args):
+    import cv2
+    from Scripts.image_preprocess import preprocess_image
+    from Scripts.preprocess_pool import preprocess_many, get_pool
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(args.pages):
+            image, _ = synthetic_photo(args.megapixels, seed=i)
+            paths.append(os.path.join(tmp_dir, f'page_{i}.jpg'))
+            cv2.imwrite(paths[-1], image)
+        outputs = [os.path.join(tmp_dir, 'out', f'page_{i}.jpg') for i in range(args.pages)]
+
+        def serial():
+            return [preprocess_image(p, o) for p, o in zip(paths, outputs)]
+
+        serial_time, _ = _timed(serial, repeat=args.repeat)
+        print(f"{args.pages} pages of {args.megapixels} MP, {os.cpu_count()} CPUs")
+        print(f"Serial preprocess_image: {serial_time:.2f} s")
+
+        workers = 1
+        while workers <= (args.max_workers or os.cpu_count() or 1):
+            # Start the workers before timing (spawn + imports)
+            get_pool(workers).submit(os.getpid).result()
+            pool_time, _ = _timed(preprocess_many, paths, outputs, workers=workers, repeat=args.repeat)
+            print(f"preprocess_many, {workers} workers: {pool_time:.2f} s ({serial_time / pool_time:.1f}x)")
+            workers *= 2
+
+
+def _min_area_rect_angle(image):
+    """The previous deskew estimate: minAreaRect over every foreground pixel at full size."""
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    coords = np.column_stack(np.where(thresh > 0))
+    angle = cv2.minAreaRect(coords)[-1]
+    return -(90 + angle) if angle < -45 else -angle
+
+
+def bench_deskew(args):
+    import cv2
+    from Scripts.image_preprocess import dewarp_image, estimate_skew_angle, rotate_image
+
+    page = dewarp_image(synthetic_photo(args.megapixels)[0])
+    print(f"{page.shape[1]}x{page.shape[0]} page")
+    for true_angle in args.angles:
+        # Skew the page by -true_angle, so true_angle is the correction
+        skewed = rotate_image(page, -true_angle)
+        old_time, old_angle = _timed(_min_area_rect_angle, skewed, repeat=args.repeat)
+        new_time, new_angle = _timed(estimate_skew_angle, skewed, args.max_side, repeat=args.repeat)
+        print(f"  skew {true_angle:+5.1f}: minAreaRect {old_angle:+7.2f} in {old_time * 1000:6.1f} ms, "
+              f"projection profile {new_angle:+6.2f} in {new_time * 1000:6.1f} ms")
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _box_iou(a, b):
+    ix = max(min(a[2], b[2]) - max(a[0], b[0]), 0)
+    iy = max(min(a[3], b[3]) - max(a[1], b[1]), 0)
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def cell_error_rate(document, reference):
+    """
+    Character error rate of the cell texts of `document` against `reference`.
+
+    Cells are matched by box (IoU >= 0.5) so the two documents may come from
+    different detection runs; reference cells without a match count as fully wrong.
+    """
+    cells = [(c['coordinates'], c['text']) for c in document.get('cells_with_text', [])]
+    errors = characters = 0
+    for ref in reference.get('cells_with_text', []):
+        best = max(cells, key=lambda c: _box_iou(c[0], ref['coordinates']), default=None)
+        text = best[1] if best is not None and _box_iou(best[0], ref['coordinates']) >= 0.5 else ''
+        errors += edit_distance(text, ref['text'])
+        characters += len(ref['text'])
+    return errors / characters if characters else 0.0
+
+
+def bench_cell_ocr(args):
+    import cv2
+    from Scripts.image_preprocess import preprocess_image
+    from Scripts.cell_processing import detect_cells
+    from Scripts.ai_processing import run_structure
+    from Scripts.cell_ocr import recognize_cells
+    from Scripts.merge_split import merge_cell_and_text, cell_text_document
+
+    if args.references and len(args.references) != len(args.images):
+        sys.exit("--references needs one merged JSON per image")
+
+    totals = {'structure': 0.0, 'cells': 0.0}
+    errors = {'structure': [], 'cells': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, 'merged.json')
+        for index, path in enumerate(args.images):
+            image = preprocess_image(path, os.path.join(tmp_dir, os.path.basename(path)))
+            cell_data, _ = detect_cells(image)
+
+            def structure_path():
+                regions, _ = run_structure(image)
+                return merge_cell_and_text(cell_data, {'results': regions}, output_path)
+
+            def cells_path():
+                return cell_text_document(cell_data, recognize_cells(image, cell_data), output_path)
+
+            # One untimed run of each so model loading is not measured
+            structure_path()
+            cells_path()
+            structure_time, structure_doc = _timed(structure_path, repeat=args.repeat)
+            cells_time, cells_doc = _timed(cells_path, repeat=args.repeat)
+            totals['structure'] += structure_time
+            totals['cells'] += cells_time
+
+            line = (f"{os.path.basename(path)}: {len(cell_data.get('boxes', []))} cells, "
+                    f"PP-Structure + merge/split {structure_time * 1000:.0f} ms, "
+                    f"cell-guided {cells_time * 1000:.0f} ms")
+            if args.references:
+                with open(args.references[index], 'r', encoding='utf-8') as f:
+                    reference = json.load(f)
+                for mode, document in (('structure', structure_doc), ('cells', cells_doc)):
+                    errors[mode].append(cell_error_rate(document, reference))
+                line += f", CER {errors['structure'][-1]:.3f} vs {errors['cells'][-1]:.3f}"
+            else:
+                # Without a reference, how far cell-guided OCR is from the current path
+                line += f", cell text difference {cell_error_rate(cells_doc, structure_doc):.3f}"
+            print(line)
+
+    pages = len(args.images)
+    for mode, label in (('structure', 'PP-Structure + merge/split'), ('cells', 'Cell-guided OCR')):
+        summary = f"{label:<27} {pages / totals[mode]:.2f} pages/s"
+        if errors[mode]:
+            summary += f", mean CER {sum(errors[mode]) / len(errors[mode]):.3f}"
+        print(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the processing pipeline")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    overlap = subparsers.add_parser('overlap', help="Text/cell overlap: Shapely vs vectorized NumPy")
+    overlap.add_argument('--rows', type=int, default=40)
+    overlap.add_argument('--cols', type=int, default=10)
+    overlap.add_argument('--repeat', type=int, default=3)
+    overlap.set_defaults(func=bench_overlap)
+
+    db_save = subparsers.add_parser('db_save', help="Database.save_document latency")
+    db_save.add_argument('--items', type=int, default=2000)
+    db_save.add_argument('--repeat', type=int, default=5)
+    db_save.set_defaults(func=bench_db_save)
+
+    search = subparsers.add_parser('search', help="Full-text search vs LIKE scan over saved text")
+    search.add_argument('--items', type=int, default=1000000)
+    search.add_argument('--repeat', type=int, default=3)
+    search.set_defaults(func=bench_search)
+
+    corners = subparsers.add_parser('corners', help="Document corner detection: full resolution vs downscaled")
+    corners.add_argument('--megapixels', type=float, nargs='+', default=[12, 24, 48])
+    corners.add_argument('--max-side', type=int, default=1600)
+    corners.add_argument('--repeat', type=int, default=3)
+    corners.set_defaults(func=bench_corners)
+
+    preprocess = subparsers.add_parser('preprocess', help="CLAHE + gamma: step functions vs Preprocessor")
+    preprocess.add_argument('--megapixels', type=float, default=12)
+    preprocess.add_argument('--repeat', type=int, default=5)
+    preprocess.set_defaults(func=bench_preprocess)
+
+    many = subparsers.add_parser('preprocess_many', help="Serial preprocessing vs the process pool")
+    many.add_argument('--pages', type=int, default=16)
+    many.add_argument('--megapixels', type=float, default=12)
+    many.add_argument('--max-workers', type=int, default=None)
+    many.add_argument('--repeat', type=int, default=1)
+    many.set_defaults(func=bench_preprocess_many)
+
+    deskew = subparsers.add_parser('deskew', help="Skew angle: full-size minAreaRect vs projection profile")
+    deskew.add_argument('--megapixels', type=float, default=12)
+    deskew.add_argument('--angles', type=float, nargs='+', default=[-4.0, -1.5, 0.0, 0.7, 3.0])
+    deskew.add_argument('--max-side', type=int, default=1000)
+    deskew.add_argument('--repeat', type=int, default=3)
+    deskew.set_defaults(func=bench_deskew)
+
+    cell_ocr = subparsers.add_parser('cell_ocr', help="PP-Structure + merge/split vs cell-guided OCR")
+    cell_ocr.add_argument('--images', nargs='+', required=True)
+    cell_ocr.add_argument('--references', nargs='+',
+                          help="Corrected merged JSON per image (e.g. after /save_edits) to score accuracy")
+    cell_ocr.add_argument('--repeat', type=int, default=3)
+    cell_ocr.set_defaults(func=bench_cell_ocr)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def region_to_box(text_region):
+    """
+    Return (x1, y1, x2, y2) if a text region is an axis-aligned rectangle, otherwise None.
+
+    Accepts the same region formats as `text_region_to_polygon`: two corner points or
+    a list of polygon points. Quads that are rotated, skewed or degenerate (zero area)
+    return None so the caller can fall back to an exact Shapely intersection.
+    """
+    try:
+        points = [(float(p[0]), float(p[1])) for p in text_region]
+    except (TypeError, ValueError, IndexError):
+        return None
+
+    if len(points) == 2:
+        (x1, y1), (x2, y2) = points
+    elif len(points) == 4:
+        # Every edge must be horizontal or vertical, otherwise it is not a rectangle
+        for k in range(4):
+            (ax, ay), (bx, by) = points[k], points[(k + 1) % 4]
+            if (ax != bx) == (ay != by):
+                return None
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        x1, x2, y1, y2 = min(xs), max(xs), min(ys), max(ys)
+    else:
+        return None
+
+    x1, x2 = min(x1, x2), max(x1, x2)
+    y1, y2 = min(y1, y2), max(y1, y2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2, y2)
+
+
+def box_overlap_matrix(text_boxes, cell_boxes, chunk_size=1024):
+    """
+    Percentage of each text box that lies inside each cell box, for axis-aligned boxes.
+
+    Equivalent to `get_overlap_percentage` for every (text, cell) pair, computed in one
+    vectorized pass instead of one Shapely intersection per pair.
+
+    Args:
+        text_boxes (array-like): (N, 4) array of [x1, y1, x2, y2] text boxes
+        cell_boxes (array-like): (M, 4) array of [x1, y1, x2, y2] cell boxes
+        chunk_size (int): Number of text rows processed at a time to bound memory
+
+    Returns:
+        np.ndarray: (N, M) float64 matrix of intersection area / text area
+    """
+    text_boxes = np.asarray(text_boxes, dtype=np.float64).reshape(-1, 4)
+    cell_boxes = np.asarray(cell_boxes, dtype=np.float64).reshape(-1, 4)
+    overlaps = np.zeros((len(text_boxes), len(cell_boxes)), dtype=np.float64)
+    if len(text_boxes) == 0 or len(cell_boxes) == 0:
+        return overlaps
+
+    cx1, cy1, cx2, cy2 = (cell_boxes[:, k][None, :] for k in range(4))
+    for start in range(0, len(text_boxes), chunk_size):
+        chunk = text_boxes[start:start + chunk_size]
+        tx1, ty1, tx2, ty2 = (chunk[:, k][:, None] for k in range(4))
+
+        inter_w = np.clip(np.minimum(tx2, cx2) - np.maximum(tx1, cx1), 0.0, None)
+        inter_h = np.clip(np.minimum(ty2, cy2) - np.maximum(ty1, cy1), 0.0, None)
+        text_area = (tx2 - tx1) * (ty2 - ty1)
+        overlaps[start:start + chunk_size] = (inter_w * inter_h) / text_area
+
+    return overlaps
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+from Scripts.instrumentation import span
+from Scripts.model_registry import registry, TEXT_RECOGNITION_MODEL
+
+# Recognized text below this confidence is dropped (PP-Structure's drop_score)
+MIN_CONFIDENCE = 0.5
+
+# Pixels added around each cell box before cropping
+CROP_PADDING = 2
+
+# Rows with ink across more than this share of the crop are ruling lines, not text
+RULE_LINE_COVERAGE = 0.9
+
+
+def _rect(x1, y1, x2, y2):
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+def _cell_crop(image, coordinate, padding=CROP_PADDING):
+    """Crop a cell box (plus padding) from the page; returns (crop, box) or (None, None)."""
+    h, w = image.shape[:2]
+    x1, y1, x2, y2 = coordinate
+    x1, y1 = max(int(np.floor(x1)) - padding, 0), max(int(np.floor(y1)) - padding, 0)
+    x2, y2 = min(int(np.ceil(x2)) + padding, w), min(int(np.ceil(y2)) + padding, h)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None, None
+    return image[y1:y2, x1:x2], (x1, y1, x2, y2)
+
+
+def count_text_lines(crop, min_line_height=3):
+    """
+    Number of text lines in a cell crop, from the horizontal ink profile.
+
+    Rows are inked when they hold dark (Otsu) pixels; full-width rows are table
+    rules and are ignored. Runs of inked rows at least `min_line_height` tall count
+    as lines.
+    """
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    coverage = ink.sum(axis=1) / max(ink.shape[1], 1)
+    inked = (coverage > 0.01) & (coverage < RULE_LINE_COVERAGE)
+
+    lines = 0
+    run = 0
+    for row in inked:
+        if row:
+            run += 1
+        else:
+            lines += run >= min_line_height
+            run = 0
+    return lines + (run >= min_line_height)
+
+
+def recognize_cells(image, cell_data, min_confidence=MIN_CONFIDENCE):
+    """
+    Read the text of each detected cell from its crop, without page layout analysis.
+
+    Single-line cells (most of a table) go through the text recognizer in batches.
+    Cells with several lines also need text detection, so they run the full
+    detection + recognition pass on their crop.
+
+    Args:
+        image (numpy.ndarray): BGR page the cells were detected on
+        cell_data (dict): Cell detection result (same structure as _res.json)
+        min_confidence (float): Drop recognized text below this confidence
+
+    Returns:
+        list: One list of {'text', 'confidence', 'text_region'} lines (page
+            coordinates, top to bottom) per box in cell_data['boxes']
+    """
+    cells = cell_data.get('boxes', [])
+    crops = [_cell_crop(image, cell['coordinate']) for cell in cells]
+    single, multi = [], []
+    for i, (crop, _) in enumerate(crops):
+        if crop is None:
+            continue
+        lines = count_text_lines(crop)
+        if lines == 1:
+            single.append(i)
+        elif lines > 1:
+            multi.append(i)
+    # Cells without any ink are left empty without calling the model
+
+    cell_texts = [[] for _ in cells]
+    with registry.get(TEXT_RECOGNITION_MODEL) as ocr:
+        if single:
+            with span('ocr.cell_recognition'):
+                # The recognizer sorts the crops by aspect ratio and batches them (rec_batch_num)
+                rec_res, _ = ocr.text_recognizer([crops[i][0] for i in single])
+            for i, (text, confidence) in zip(single, rec_res):
+                if text.strip() and confidence >= min_confidence:
+                    cell_texts[i].append({'text': text, 'confidence': float(confidence),
+                                          'text_region': _rect(*crops[i][1])})
+
+        for i in multi:
+            crop, (x1, y1, _, _) = crops[i]
+            with span('ocr.cell_detection_recognition'):
+                lines = ocr.ocr(crop, cls=False)[0] or []
+            for points, (text, confidence) in lines:
+                if text.strip() and confidence >= min_confidence:
+                    cell_texts[i].append({
+                        'text': text,
+                        'confidence': float(confidence),
+                        'text_region': [[float(x) + x1, float(y) + y1] for x, y in points]
+                    })
+            cell_texts[i].sort(key=lambda line: min(y for _, y in line['text_region']))
+    return cell_texts
@@ -1,5 +1,67 @@
-from paddlex import create_model
 import os
+from Scripts.instrumentation import span
+from Scripts.json_utils import to_builtin_types
+from Scripts.model_registry import registry, CELL_DETECTION_MODEL
+
+def cell_result_to_dict(res, input_path=None):
+    """
+    Convert a PaddleX detection result into the same structure save_to_json writes
+    ({'input_path': ..., 'boxes': [{'coordinate': [x1, y1, x2, y2], 'score': ...}, ...]}).
+    """
+    data = res.json if hasattr(res, 'json') else dict(res)
+    if isinstance(data, dict) and 'res' in data and 'boxes' not in data:
+        data = data['res']
+    data = {k: v for k, v in dict(data).items() if k != 'input_img'}
+    data = to_builtin_types(data)
+    if input_path:
+        data['input_path'] = input_path
+    return data
+
+def detect_cells(image, input_path=None, threshold=0.3):
+    """
+    Run cell detection and return the result in memory, without writing any files
+    
+    Args:
+        image: Path to the input image or a BGR image array
+        input_path (str): Path recorded as 'input_path' in the result (defaults to image if a path)
+        threshold (float): Detection score threshold
+        
+    Returns:
+        tuple: (cell_data, res) - the _res.json compatible dict and the raw PaddleX result
+    """
+    if input_path is None and isinstance(image, str):
+        input_path = image
+    with registry.get(CELL_DETECTION_MODEL) as model, span('cell_detection.predict'):
+        output = list(model.predict(image, threshold=threshold, batch_size=1))
+    if not output:
+        return {'input_path': input_path, 'boxes': []}, None
+    return cell_result_to_dict(output[0], input_path), output[0]
+
+def detect_cells_batch(images, input_paths, threshold=0.3, batch_size=4):
+    """
+    Run cell detection on several images with real model batches
+    
+    Args:
+        images (list): Image paths or BGR image arrays
+        input_paths (list): Path recorded as 'input_path' for each image
+        threshold (float): Detection score threshold
+        batch_size (int): Number of images per model forward pass
+        
+    Returns:
+        list: (cell_data, res) tuples in the same order as images
+    """
+    if not images:
+        return []
+    with registry.get(CELL_DETECTION_MODEL) as model, span('cell_detection.predict_batch'):
+        output = list(model.predict(list(images), threshold=threshold, batch_size=batch_size))
+    return [(cell_result_to_dict(res, path), res) for res, path in zip(output, input_paths)]
+
+def save_cell_detection(res, output_dir="output"):
+    """Write the JSON and visualization of a detection result to output/cell detection."""
+    cell_detection_dir = os.path.join(output_dir, "cell detection")
+    os.makedirs(cell_detection_dir, exist_ok=True)
+    res.save_to_img(save_path=cell_detection_dir)
+    res.save_to_json(save_path=cell_detection_dir)
 
 def run_cell_detection(input_path, output_dir="output"):
     """
@@ -30,8 +92,8 @@ def run_cell_detection(input_path, output_dir="output"):
     # Load model and run prediction
     try:
         print(f"Running cell detection on {input_path}")
-        model = create_model(model_name="RT-DETR-L_wired_table_cell_det")
-        output = model.predict(input_path, threshold=0.3, batch_size=1)
+        with registry.get(CELL_DETECTION_MODEL) as model:
+            output = list(model.predict(input_path, threshold=0.3, batch_size=1))
 
         for i, res in enumerate(output):
             res.print()  # Print the structured prediction output
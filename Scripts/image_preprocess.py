@@ -2,32 +2,63 @@ import cv2
 import numpy as np
 import argparse
 import os
+import threading
+from functools import lru_cache
+from Scripts.instrumentation import span, record_image
 
+# Corner detection runs on a pyramid-downscaled copy whose longer side is at most this
+# many pixels; the perspective warp still uses the full-resolution image. 0 disables it.
+DEFAULT_ANALYSIS_MAX_SIDE = 1600
 
 #Deskew – Corrects small rotations in the image
-def deskew_image(image):
-    """Deskew the image if it has a minor rotation."""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    # Threshold to find text regions
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-    # Get coordinates of all non-zero pixels
-    coords = np.column_stack(np.where(thresh > 0))
-    rect = cv2.minAreaRect(coords)
-    angle = rect[-1]
-    
-    # Correct angle so it's between -45 and +45
-    if angle < -45:
-        angle = -(90 + angle)
-    else:
-        angle = -angle
+def _profile_sharpness(binary, angle):
+    """How sharply the row sums of `binary` change after rotating it by `angle` degrees."""
+    h, w = binary.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    rotated = cv2.warpAffine(binary, M, (w, h), flags=cv2.INTER_NEAREST)
+    profile = cv2.reduce(rotated, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F).ravel()
+    return float(np.sum(np.diff(profile) ** 2))
+
+def estimate_skew_angle(image, max_side=1000, max_angle=10.0, coarse_step=1.0, fine_step=0.1):
+    """
+    Estimate the rotation (degrees, for cv2.getRotationMatrix2D) that makes text lines horizontal.
+    
+    Projection profile method on a pyramid-downscaled binary copy: text lines give the
+    sharpest row-sum profile when they are level. Angles are searched in `coarse_step`
+    steps within +-`max_angle`, then in `fine_step` steps around the best one.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gray, _ = pyramid_downscale(gray, max_side)
+    # Dark text as foreground
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    
+    coarse = np.arange(-max_angle, max_angle + coarse_step / 2, coarse_step)
+    best = max(coarse, key=lambda a: _profile_sharpness(binary, a))
+    fine = np.arange(best - coarse_step, best + coarse_step + fine_step / 2, fine_step)
+    best = max(fine, key=lambda a: _profile_sharpness(binary, a))
+    return round(float(best), 2) + 0.0  # no -0.0
 
+def rotate_image(image, angle):
+    """Rotate around the centre, keeping the size and replicating the border."""
     (h, w) = image.shape[:2]
     center = (w // 2, h // 2)
     M = cv2.getRotationMatrix2D(center, angle, 1.0)
-    rotated = cv2.warpAffine(image, M, (w, h), 
-                             flags=cv2.INTER_CUBIC, 
-                             borderMode=cv2.BORDER_REPLICATE)
-    return rotated
+    return cv2.warpAffine(image, M, (w, h), 
+                          flags=cv2.INTER_CUBIC, 
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def deskew_image(image, tolerance=0.2, max_side=1000):
+    """
+    Deskew the image if it has a minor rotation.
+    
+    Returns:
+        tuple: (image, estimated angle); the image is returned unchanged when the
+            angle is smaller than `tolerance` degrees
+    """
+    angle = estimate_skew_angle(image, max_side=max_side)
+    if abs(angle) < tolerance:
+        return image, angle
+    return rotate_image(image, angle), angle
 
 #CLAHE – Corrects uneven lighting
 def clahe_enhance(image):
@@ -40,19 +71,44 @@ def clahe_enhance(image):
     enhanced = cv2.cvtColor(merged, cv2.COLOR_LAB2BGR)
     return enhanced
 #Gamma – Corrects overall brightness
+@lru_cache(maxsize=32)
+def gamma_table(gamma):
+    """256-entry lookup table for gamma correction (computed once per gamma value)."""
+    invGamma = 1.0 / gamma
+    table = ((np.arange(256) / 255.0) ** invGamma * 255).astype("uint8")
+    table.setflags(write=False)
+    return table
+
 def gamma_correction(image, gamma=1.2):
     """Adjust overall brightness via gamma correction."""
-    invGamma = 1.0 / gamma
-    table = np.array([((i / 255.0) ** invGamma) * 255 
-                      for i in range(256)]).astype("uint8")
-    return cv2.LUT(image, table)
+    return cv2.LUT(image, gamma_table(gamma))
 
-def find_document_corners(image, min_area_ratio=0.3):
-    """Try to locate a rectangular contour that occupies at least `min_area_ratio` of the image."""
-    h, w = image.shape[:2]
-    img_area = h * w
+def pyramid_downscale(image, max_side):
+    """
+    Halve the image with cv2.pyrDown until its longer side is at most `max_side`.
+    
+    Returns:
+        tuple: (downscaled image, factor to multiply its coordinates by to get back
+            to the original resolution)
+    """
+    scale = 1
+    while max_side and max(image.shape[:2]) > max_side:
+        image = cv2.pyrDown(image)
+        scale *= 2
+    return image, scale
+
+def find_document_corners(image, min_area_ratio=0.3, max_side=None):
+    """
+    Try to locate a rectangular contour that occupies at least `min_area_ratio` of the image.
     
+    With `max_side` the edge and contour analysis runs on a pyramid-downscaled copy and
+    the corners are scaled back to full-resolution coordinates.
+    """
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray, scale = pyramid_downscale(gray, max_side)
+    h, w = gray.shape[:2]
+    img_area = h * w
+    
     gray = cv2.GaussianBlur(gray, (5, 5), 0)
     edges = cv2.Canny(gray, 50, 200)
 
@@ -73,7 +129,13 @@ def find_document_corners(image, min_area_ratio=0.3):
         approx = cv2.approxPolyDP(c, 0.02 * peri, True)
         
         if len(approx) == 4:
-            return approx.reshape((4, 2))
+            corners = approx.reshape((4, 2))
+            # pyrDown centres downscaled pixel x on source pixel 2x, the same integer
+            # convention as the contour points, so they map back by a plain multiplication
+            # (adding (scale - 1) / 2 measured worse). The corners are only as precise as the
+            # downscaled edges: 3-6 px (scale 4) and 6-13 px (scale 8) from full-resolution
+            # detection on the synthetic benchmark pages, with no consistent direction
+            return corners * scale if scale != 1 else corners
     return None
 #Order points – Orders the corner points of the document
 def order_points(pts):
@@ -89,9 +151,9 @@ def order_points(pts):
     
     return rect
 
-def dewarp_image(image, min_area_ratio=0.3):
+def dewarp_image(image, min_area_ratio=0.3, analysis_max_side=DEFAULT_ANALYSIS_MAX_SIDE):
     """Perform perspective transform if a 4-corner document is detected."""
-    corners = find_document_corners(image, min_area_ratio=min_area_ratio)
+    corners = find_document_corners(image, min_area_ratio=min_area_ratio, max_side=analysis_max_side)
     if corners is None:
         # No suitable rectangle found, return as-is
         return image
@@ -116,29 +178,125 @@ def dewarp_image(image, min_area_ratio=0.3):
     warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
     return warped
 
+class Preprocessor:
+    """
+    Reusable dewarp -> CLAHE -> gamma pipeline.
+    
+    The gamma lookup table and the CLAHE object are built once, and the LAB and
+    lightness buffers are kept per image size and reused, so repeated pages of the same
+    size only allocate the returned image. CLAHE is applied to the L channel in place
+    inside the LAB buffer (no split/merge). A Preprocessor is not thread-safe, use
+    `get_preprocessor` to get one for the current thread.
+    """
+    
+    def __init__(self, gamma=1.2, min_area_ratio=0.3, analysis_max_side=DEFAULT_ANALYSIS_MAX_SIDE,
+                 deskew=False, deskew_tolerance=0.2, clip_limit=2.0, tile_grid_size=(8, 8),
+                 max_buffer_sizes=4):
+        self.gamma = gamma
+        self.min_area_ratio = min_area_ratio
+        self.analysis_max_side = analysis_max_side
+        self.deskew = deskew
+        self.deskew_tolerance = deskew_tolerance
+        self.gamma_lut = gamma_table(gamma)
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+        self.max_buffer_sizes = max_buffer_sizes
+        self._buffers = {}
+    
+    def _buffers_for(self, shape):
+        buffers = self._buffers.get(shape)
+        if buffers is None:
+            if len(self._buffers) >= self.max_buffer_sizes:
+                self._buffers.pop(next(iter(self._buffers)))
+            h, w = shape[:2]
+            buffers = {
+                'lab': np.empty((h, w, 3), dtype=np.uint8),
+                'lightness': np.empty((h, w), dtype=np.uint8),
+                'enhanced': np.empty((h, w), dtype=np.uint8)
+            }
+            self._buffers[shape] = buffers
+        return buffers
+    
+    def enhance(self, image):
+        """CLAHE on the lightness channel followed by gamma correction, into a new array."""
+        buffers = self._buffers_for(image.shape)
+        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB, dst=buffers['lab'])
+        lightness = cv2.extractChannel(lab, 0, dst=buffers['lightness'])
+        enhanced = self.clahe.apply(lightness, dst=buffers['enhanced'])
+        cv2.insertChannel(enhanced, lab, 0)
+        result = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        return result
+    
+    def process(self, image, info=None):
+        """
+        Run the full pipeline on a BGR image and return the preprocessed image.
+        
+        If `info` is a dict, the estimated skew angle and whether the page was rotated
+        are added to it (only when deskewing is enabled).
+        """
+        with span('preprocess.dewarp'):
+            dewarped = dewarp_image(image, min_area_ratio=self.min_area_ratio,
+                                    analysis_max_side=self.analysis_max_side)
+        
+        if self.deskew:
+            with span('preprocess.deskew'):
+                deskewed, angle = deskew_image(dewarped, tolerance=self.deskew_tolerance)
+            if info is not None:
+                info['skew_angle'] = angle
+                info['deskewed'] = deskewed is not dewarped
+            dewarped = deskewed
+        
+        with span('preprocess.clahe'):
+            result = self.enhance(dewarped)
+        
+        with span('preprocess.gamma'):
+            # In place: result is a fresh array owned by the caller
+            cv2.LUT(result, self.gamma_lut, dst=result)
+        return result
+
+_local = threading.local()
+
+def get_preprocessor(gamma=1.2, min_area_ratio=0.3, analysis_max_side=DEFAULT_ANALYSIS_MAX_SIDE,
+                     deskew=False, deskew_tolerance=0.2):
+    """Return this thread's Preprocessor for the given parameters, creating it on first use."""
+    preprocessors = getattr(_local, 'preprocessors', None)
+    if preprocessors is None:
+        preprocessors = _local.preprocessors = {}
+    key = (gamma, min_area_ratio, analysis_max_side, deskew, deskew_tolerance)
+    preprocessor = preprocessors.get(key)
+    if preprocessor is None:
+        preprocessor = preprocessors[key] = Preprocessor(gamma, min_area_ratio, analysis_max_side,
+                                                         deskew, deskew_tolerance)
+    return preprocessor
+
 # Add new function for command-line usage without modifying existing code
-def preprocess_image(input_path, output_path):
-    """Process an image through the full preprocessing pipeline and save the result."""
+def preprocess_image(input_path, output_path, gamma=1.2, min_area_ratio=0.3,
+                     analysis_max_side=DEFAULT_ANALYSIS_MAX_SIDE, deskew=False, deskew_tolerance=0.2,
+                     info=None):
+    """
+    Process an image through the full preprocessing pipeline and save the result.
+    
+    `analysis_max_side` is the longest side used for document corner detection
+    (0 analyses the full-resolution image). With `deskew` small rotations are
+    corrected after dewarping, and the estimated angle is added to `info`.
+    """
     # Make sure output directory exists
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     # Load image
-    image = cv2.imread(input_path)
+    with span('preprocess.read'):
+        image = cv2.imread(input_path)
     if image is None:
         raise ValueError(f"Could not read image from {input_path}")
+    record_image(image, 'input')
     
-    # Apply preprocessing steps (similar to debug_preprocessing)
-    # Step 1: Dewarp
-    dewarped = dewarp_image(image, min_area_ratio=0.3)
-    
-    # Step 2: CLAHE
-    clahe_result = clahe_enhance(dewarped)
-    
-    # Step 3: Gamma correction
-    final_result = gamma_correction(clahe_result, gamma=1.2)
+    # Apply preprocessing steps: dewarp, CLAHE, gamma correction
+    preprocessor = get_preprocessor(gamma, min_area_ratio, analysis_max_side, deskew, deskew_tolerance)
+    final_result = preprocessor.process(image, info)
+    record_image(final_result, 'preprocessed')
     
     # Save the result
-    cv2.imwrite(output_path, final_result)
+    with span('preprocess.write'):
+        cv2.imwrite(output_path, final_result)
     print(f"Processed image saved to {output_path}")
     
     return final_result
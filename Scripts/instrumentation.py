@@ -0,0 +1,193 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds (seconds) of the span duration histogram buckets
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Upper bounds (megapixels) of the input image size histogram buckets
+IMAGE_MEGAPIXEL_BUCKETS = (0.5, 1, 2, 4, 8, 12, 24, 48)
+
+
+def current_rss_bytes():
+    """Return the resident set size of this process in bytes (best effort)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Return the peak resident set size of this process in bytes (best effort)."""
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    except Exception:
+        return 0
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Trace:
+    """Timings and attributes collected while processing one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+
+    def to_dict(self):
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 4),
+            'spans': {name: round(seconds, 4) for name, seconds in totals.items()},
+            'peak_rss_bytes': peak_rss_bytes(),
+            **self.attributes
+        }
+
+
+_current_trace = ContextVar('current_trace', default=None)
+_lock = threading.Lock()
+_span_histograms = {}
+_image_histogram = _Histogram(IMAGE_MEGAPIXEL_BUCKETS)
+
+
+class Span:
+    """A running timer; `end()` records it like the `span` context manager does."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def end(self):
+        if self.seconds is not None:
+            return self.seconds
+        self.seconds = time.perf_counter() - self.start
+        with _lock:
+            histogram = _span_histograms.get(self.name)
+            if histogram is None:
+                histogram = _span_histograms[self.name] = _Histogram(SPAN_BUCKETS)
+            histogram.observe(self.seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((self.name, self.seconds))
+        return self.seconds
+
+
+def start_span(name):
+    """Start timing a step that does not fit in a single with-block."""
+    return Span(name)
+
+
+@contextmanager
+def span(name):
+    """Time a block, adding it to the span histograms and to the current trace."""
+    timer = Span(name)
+    try:
+        yield timer
+    finally:
+        timer.end()
+
+
+@contextmanager
+def trace_request():
+    """Collect the spans of everything run inside the block into a new Trace."""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record_image(image, label='input'):
+    """Record the dimensions of an image array on the current trace and in the metrics."""
+    if image is None:
+        return
+    height, width = image.shape[:2]
+    record_image_size(width, height, label)
+
+
+def record_image_size(width, height, label='input'):
+    """Like `record_image`, for images that were decoded in another process."""
+    with _lock:
+        if label == 'input':
+            _image_histogram.observe(width * height / 1e6)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes[f'{label}_image'] = {'width': int(width), 'height': int(height)}
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels.items()) + '}'
+
+
+def _render_histogram(lines, name, histogram, labels=None):
+    labels = labels or {}
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f'{name}_bucket{_labels(dict(labels, le=bound))} {count}')
+    lines.append(f'{name}_bucket{_labels(dict(labels, le="+Inf"))} {histogram.count}')
+    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+
+def render_prometheus(extra_metrics=()):
+    """
+    Render all collected metrics in the Prometheus text exposition format.
+
+    Args:
+        extra_metrics: Iterable of (name, type, help, [(labels dict, value), ...]) for
+            metrics owned elsewhere (job queue, result cache, model registry)
+    """
+    lines = [
+        '# HELP pipeline_span_seconds Duration of instrumented pipeline steps.',
+        '# TYPE pipeline_span_seconds histogram'
+    ]
+    with _lock:
+        for name in sorted(_span_histograms):
+            _render_histogram(lines, 'pipeline_span_seconds', _span_histograms[name], {'span': name})
+        lines.append('# HELP pipeline_input_image_megapixels Size of processed input images.')
+        lines.append('# TYPE pipeline_input_image_megapixels histogram')
+        _render_histogram(lines, 'pipeline_input_image_megapixels', _image_histogram)
+
+    lines.append('# HELP process_resident_memory_bytes Resident memory of this process.')
+    lines.append('# TYPE process_resident_memory_bytes gauge')
+    lines.append(f'process_resident_memory_bytes {current_rss_bytes()}')
+    lines.append('# HELP process_peak_resident_memory_bytes Peak resident memory of this process.')
+    lines.append('# TYPE process_peak_resident_memory_bytes gauge')
+    lines.append(f'process_peak_resident_memory_bytes {peak_rss_bytes()}')
+
+    for name, metric_type, help_text, samples in extra_metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
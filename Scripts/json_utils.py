@@ -0,0 +1,14 @@
+import numpy as np
+
+
+def to_builtin_types(obj):
+    """Convert NumPy values nested in model results to plain, JSON serializable Python types."""
+    if isinstance(obj, dict):
+        return {k: to_builtin_types(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_builtin_types(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
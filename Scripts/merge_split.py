@@ -2,8 +2,14 @@ import json
 import os
 import numpy as np
 from shapely.geometry import Polygon, Point, box
+from Scripts.box_overlap import box_overlap_matrix
+from Scripts.merge_tables import CellTable, TextTable, RowBandIndex
+from Scripts.instrumentation import span, start_span
 import re
 
+# Visualization file written next to the merged JSON (<base_name>_combined_with_spanning.json)
+VISUALIZATION_SUFFIX = "_visualization_with_spanning.jpg"
+
 def load_json_file(file_path):
     """Load JSON data from file"""
     print(f"[DEBUG] Loading JSON file from: {file_path}")
@@ -157,7 +163,7 @@ def split_text_for_cells(text_item, overlapping_cells):
     if len(overlapping_cells) > 1:
         # Sort cells from left to right (eller top-til-bund, afhængig af forventet tekstflow for spændende celler)
         # For nu, lad os beholde sortering fra venstre mod højre. Kan justeres hvis nødvendigt.
-        overlapping_cells.sort(key=lambda c: c['polygon'].bounds[0])
+        overlapping_cells.sort(key=lambda c: c['cell_data'].bounds[0])
         
         # Calculate approximate characters per cell
         # Denne simple fordeling kan være naiv for komplekse layouts, men er et udgangspunkt.
@@ -200,7 +206,8 @@ def split_text_for_cells(text_item, overlapping_cells):
         'overlap': overlapping_cells[0].get('overlap', 0)
     }]
 
-def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5, min_overlap_for_spanning=0.1):
+def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5, min_overlap_for_spanning=0.1,
+                        extra_metadata=None):
     """
     Merge cell detection with OCR text recognition, handling text that spans multiple cells
     
@@ -210,50 +217,53 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
         output_path (str): Path to save the combined results
         overlap_threshold (float): Threshold for text-cell overlap percentage
         min_overlap_for_spanning (float): Minimum overlap to consider a cell for spanning text
+        extra_metadata (dict): Extra entries for the metadata block (e.g. preprocessing skew angle)
     """
-    cells = cell_data.get('boxes', [])
-    text_items = extract_text_items(ocr_data)
+    with span('merge.extract_text'):
+        text_items = extract_text_items(ocr_data)
     
-    print(f"Found {len(cells)} cells and {len(text_items)} text items")
+    # Celler og tekster lægges i kolonner (NumPy) én gang pr. dokument og genbruges for hver tekst
+    cells = CellTable.from_boxes(cell_data.get('boxes', []))
+    texts = TextTable(text_items)
+    band_index = RowBandIndex(cells) # Celler sorteret efter y-center + række/kolonne-gitter
+    print(f"Found {len(cell_data.get('boxes', []))} cells and {len(text_items)} text items")
     
-    cell_polygons = []
-    for i, cell in enumerate(cells):
-        try:
-            polygon = cell_to_polygon(cell)
-            cell_polygons.append({
-                'id': i,
-                'polygon': polygon,
-                'cell_info': cell,
-                'text_items': [],
-                'combined_text': "",
-                'confidence': 0.0
-            })
-        except Exception as e:
-            print(f"Error processing cell {i}: {e}")
+    matching_span = start_span('merge.overlap_matching')
+    # Axis-aligned text boxes get all their cell overlaps from one vectorized pass;
+    # rotated or irregular quads fall back to Shapely through the spatial index
+    overlap_matrix = box_overlap_matrix(texts.rect_boxes, cells.bounds)
     
     unassigned_text = []
     assigned_text_ids = set()
     spanning_text_assignments = []
     
     for i, text_item in enumerate(text_items):
-        if 'text_region' not in text_item or not text_item.get('text', '').strip(): # Spring over hvis ingen text_region eller tom tekst
+        if not texts.usable[i]: # Spring over hvis ingen text_region eller tom tekst
             continue
             
         try:
-            text_polygon = text_region_to_polygon(text_item['text_region'])
-            if not text_polygon:
-                continue
+            # Overlap med hver kandidat-celle beregnes én gang og genbruges nedenfor;
+            # Shapely-polygonen bygges kun for tekster der ikke er akseparallelle rektangler
+            if texts.rect_rows[i] >= 0:
+                overlap_row = overlap_matrix[texts.rect_rows[i]]
+                cell_overlaps = {int(idx): float(overlap_row[idx]) for idx in np.flatnonzero(overlap_row)}
+            else:
+                text_polygon = text_region_to_polygon(text_item['text_region'])
+                if not text_polygon:
+                    continue
+                cell_overlaps = cells.overlaps(text_polygon)
             
-            text_width, text_height = get_text_dimensions(text_item['text_region'])
+            text_width, text_height = texts.sizes[i]
             
-            overlapping_cells_with_details = [] # Skal indeholde dicts med 'cell_data', 'overlap', 'polygon'
-            for cell_poly_data in cell_polygons:
-                overlap = get_overlap_percentage(text_polygon, cell_poly_data['polygon'])
+            overlapping_cells_with_details = [] # Skal indeholde dicts med 'cell_data' (CellRow) og 'overlap'
+            # Med en tærskel på 0 er alle celler kandidater, ellers kun dem indekset fandt
+            candidate_idxs = range(len(cells)) if min_overlap_for_spanning <= 0 else sorted(cell_overlaps)
+            for cell_idx in candidate_idxs:
+                overlap = cell_overlaps.get(cell_idx, 0.0)
                 if overlap >= min_overlap_for_spanning: # Brug min_overlap_for_spanning her for at samle kandidater
                     overlapping_cells_with_details.append({
-                        'cell_data': cell_poly_data, 
-                        'overlap': overlap,
-                        'polygon': cell_poly_data['polygon'] # Bruges til sortering i split_text_for_cells
+                        'cell_data': cells[cell_idx],
+                        'overlap': overlap
                     })
             
             # Brug den modificerede should_split_text
@@ -271,9 +281,9 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
                     split_texts_for_span_item = []
 
                     for assignment in split_assignments:
-                        # 'cell' fra split_assignments er 'cell_data' objektet
+                        # 'cell' fra split_assignments er CellRow for cellen
                         target_cell_data = assignment['cell'] 
-                        target_cell_data['text_items'].append({
+                        target_cell_data.text_items.append({
                             'id': i, # ID for det oprindelige text_item
                             'text': assignment['text'],
                             'confidence': assignment['confidence'],
@@ -283,7 +293,7 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
                             'original_text': original_text_for_span_item
                         })
                         assigned_this_item = True
-                        cells_assigned_to_ids.append(target_cell_data['id'])
+                        cells_assigned_to_ids.append(target_cell_data.id)
                         split_texts_for_span_item.append(assignment['text'])
                     
                     if assigned_this_item:
@@ -304,14 +314,14 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
             best_single_cell = None
             highest_overlap_for_single_assignment = 0.0
             
-            for cell_data_for_single in cell_polygons: # Iterer over de oprindelige cell_polygons
-                overlap_for_single = get_overlap_percentage(text_polygon, cell_data_for_single['polygon'])
+            for cell_idx in sorted(cell_overlaps): # Samme rækkefølge som tabellen, så uafgjorte vælges ens
+                overlap_for_single = cell_overlaps[cell_idx]
                 if overlap_for_single > highest_overlap_for_single_assignment:
                     highest_overlap_for_single_assignment = overlap_for_single
-                    best_single_cell = cell_data_for_single
+                    best_single_cell = cells[cell_idx]
             
             if best_single_cell and highest_overlap_for_single_assignment >= overlap_threshold:
-                best_single_cell['text_items'].append({
+                best_single_cell.text_items.append({
                     'id': i,
                     'text': text_item.get('text', ''),
                     'confidence': text_item.get('confidence', 0.0),
@@ -324,25 +334,16 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
                 # Forsøg på positionel tildeling for u-tildelt tekst (hvis den er lang nok)
                 # Her bruges should_split_text med cells_overlapped_count = 0 for at tjekke tekstlængde
                 if should_split_text(text_item, 0): 
-                    text_center = get_text_center(text_item['text_region'])
-                    y_position = text_center[1]
+                    y_position = texts.centers[i, 1]
                     y_tolerance = text_height * 2 
                     
-                    row_cells_for_positional = [] # Skal være en liste af dicts som overlapping_cells_with_details
-                    for cell_poly_data_pos in cell_polygons:
-                        cell_bounds = cell_poly_data_pos['polygon'].bounds
-                        cell_y_center = (cell_bounds[1] + cell_bounds[3]) / 2
-                        if abs(cell_y_center - y_position) <= y_tolerance:
-                            row_cells_for_positional.append({
-                                'cell_data': cell_poly_data_pos,
-                                'polygon': cell_poly_data_pos['polygon'],
-                                'overlap': 0 # Ingen direkte overlap
-                            })
+                    # Celler på samme række findes med bisect i rækkeindekset, allerede sorteret fra venstre mod højre
+                    row_cells_for_positional = [
+                        {'cell_data': cells[row], 'overlap': 0} # Ingen direkte overlap
+                        for row in band_index.cells_near_y(y_position, y_tolerance)
+                    ]
                     
                     if row_cells_for_positional: # Kun hvis der er celler på samme række
-                        # Sorter fra venstre mod højre
-                        row_cells_for_positional.sort(key=lambda c: c['polygon'].bounds[0])
-                        
                         positional_split_assignments = split_text_for_cells(text_item, row_cells_for_positional)
                         
                         if positional_split_assignments:
@@ -353,7 +354,7 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
 
                             for assignment in positional_split_assignments:
                                 target_cell_data_pos = assignment['cell']
-                                target_cell_data_pos['text_items'].append({
+                                target_cell_data_pos.text_items.append({
                                     'id': i,
                                     'text': assignment['text'],
                                     'confidence': assignment['confidence'],
@@ -364,7 +365,7 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
                                     'is_positional_assignment': True
                                 })
                                 assigned_this_item_positionally = True
-                                pos_cells_assigned_to_ids.append(target_cell_data_pos['id'])
+                                pos_cells_assigned_to_ids.append(target_cell_data_pos.id)
                                 pos_split_texts.append(assignment['text'])
 
                             if assigned_this_item_positionally:
@@ -393,25 +394,28 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
             import traceback
             traceback.print_exc() # Print fuld traceback for fejlfinding
     
+    matching_span.end()
+    
     # Process each cell to combine text
-    for cell_data in cell_polygons:
-        if cell_data['text_items']:
-            cell_data['text_items'].sort(key=lambda x: get_text_center(x['text_region'])[1])
-            texts = [item['text'] for item in cell_data['text_items'] if item.get('text')] # Tjek om 'text' eksisterer
-            confidences = [item['confidence'] for item in cell_data['text_items'] if isinstance(item.get('confidence'), (int,float)) and item['confidence'] > 0]
-            cell_data['combined_text'] = " ".join(texts).strip()
-            cell_data['confidence'] = sum(confidences) / len(confidences) if confidences else 0.0
+    for cell in cells:
+        if cell.text_items:
+            cell.text_items.sort(key=lambda x: texts.centers[x['id'], 1])
+            cell_texts = [item['text'] for item in cell.text_items if item.get('text')] # Tjek om 'text' eksisterer
+            confidences = [item['confidence'] for item in cell.text_items if isinstance(item.get('confidence'), (int,float)) and item['confidence'] > 0]
+            cells.texts[cell.index] = " ".join(cell_texts).strip()
+            cells.confidences[cell.index] = sum(confidences) / len(confidences) if confidences else 0.0
     
     # Prepare output data
     output_data = {
-        'image_path': cell_data.get('input_path', ocr_data.get('input_path', '')), # Fejl her, cell_data er sidste i loop
+        'image_path': '',
         'cells_with_text': [
             {
-                'cell_id': c['id'],
-                'coordinates': c['cell_info']['coordinate'],
-                'text': c['combined_text'],
-                'confidence': c['confidence'],
-                'cell_score': c['cell_info'].get('score', 0.0),
+                'cell_id': c.id,
+                'coordinates': c.cell_info['coordinate'],
+                **band_index.grid_position(c.index),
+                'text': c.combined_text,
+                'confidence': c.confidence,
+                'cell_score': c.cell_info.get('score', 0.0),
                 'component_texts': [
                     {
                         'text': item['text'],
@@ -420,16 +424,17 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
                         'is_split': item.get('is_split', False),
                         'original_text': item.get('original_text', item['text']) if item.get('is_split', False) else None,
                         'is_positional_assignment': item.get('is_positional_assignment', False)
-                    } for item in c['text_items']
+                    } for item in c.text_items
                 ]
-            } for c in cell_polygons if c['combined_text']
+            } for c in cells if c.combined_text
         ],
         'empty_cells': [
             {
-                'cell_id': c['id'],
-                'coordinates': c['cell_info']['coordinate'],
-                'cell_score': c['cell_info'].get('score', 0.0)
-            } for c in cell_polygons if not c['combined_text']
+                'cell_id': c.id,
+                'coordinates': c.cell_info['coordinate'],
+                **band_index.grid_position(c.index),
+                'cell_score': c.cell_info.get('score', 0.0)
+            } for c in cells if not c.combined_text
         ],
         'unassigned_text': [ # Sikrer at unassigned_text har de korrekte nøgler
             {
@@ -441,25 +446,102 @@ def merge_cell_and_text(cell_data, ocr_data, output_path, overlap_threshold=0.5,
         ],
         'spanning_text': spanning_text_assignments,
         'metadata': {
-            'total_cells': len(cells),
+            'total_cells': len(cell_data.get('boxes', [])),
             'total_text_items': len(text_items), # Antal oprindelige tekst items
             'assigned_text_items': len(assigned_text_ids), # Antal *oprindelige* tekst items der blev tildelt (enten som helhed eller splittet)
-            'cells_with_text': len([c for c in cell_polygons if c['combined_text']]),
-            'empty_cells': len([c for c in cell_polygons if not c['combined_text']]),
+            'cells_with_text': len([t for t in cells.texts if t]),
+            'empty_cells': len([t for t in cells.texts if not t]),
             'unassigned_text': len(unassigned_text), # Antal *oprindelige* tekst items der forblev u-tildelt
-            'spanning_text_items': len(spanning_text_assignments) # Antal *oprindelige* tekst items der blev identificeret som spændende
+            'spanning_text_items': len(spanning_text_assignments), # Antal *oprindelige* tekst items der blev identificeret som spændende
+            **(extra_metadata or {})
         }
     }
-    # Rettelse for image_path i output_data
-    if cell_data: # Check om cell_data er tilgængelig (dvs. der var celler)
+    # Billedstien kommer fra OCR-resultatet når der er celler (som før, hvor cell_data var sidste celle i loopet)
+    if len(cells):
+         output_data['image_path'] = ocr_data.get('input_path', '')
+    elif cell_data: # Ingen gyldige celler: brug celle-detektionens sti
          output_data['image_path'] = cell_data.get('input_path', ocr_data.get('input_path', ''))
     elif ocr_data:
          output_data['image_path'] = ocr_data.get('input_path', '')
-    else:
-         output_data['image_path'] = ''
 
 
-    save_json_file(output_data, output_path)
+    with span('merge.write_json'):
+        save_json_file(output_data, output_path)
+    
+    return output_data
+
+def cell_text_document(cell_data, cell_texts, output_path, extra_metadata=None):
+    """
+    Build the merged document from text that was read per cell (cell-guided OCR)
+    
+    Every text line already belongs to the cell it was cropped from, so no overlap
+    matching is needed; the result has the same structure as merge_cell_and_text.
+    
+    Args:
+        cell_data (dict): JSON data from cell detection
+        cell_texts (list): One list of {'text', 'confidence', 'text_region'} per cell
+        output_path (str): Path to save the combined results
+        extra_metadata (dict): Extra entries for the metadata block
+    """
+    cells = cell_data.get('boxes', [])
+    table = CellTable.from_boxes(cells)
+    band_index = RowBandIndex(table)
+    row_of_id = table.row_of_id()
+    cells_with_text = []
+    empty_cells = []
+    for i, (cell, lines) in enumerate(zip(cells, cell_texts)):
+        grid_position = band_index.grid_position(row_of_id[i]) if i in row_of_id else {}
+        text = " ".join(line['text'] for line in lines if line.get('text')).strip()
+        if not text:
+            empty_cells.append({
+                'cell_id': i,
+                'coordinates': cell['coordinate'],
+                **grid_position,
+                'cell_score': cell.get('score', 0.0)
+            })
+            continue
+        confidences = [line['confidence'] for line in lines if line.get('confidence', 0) > 0]
+        cells_with_text.append({
+            'cell_id': i,
+            'coordinates': cell['coordinate'],
+            **grid_position,
+            'text': text,
+            'confidence': sum(confidences) / len(confidences) if confidences else 0.0,
+            'cell_score': cell.get('score', 0.0),
+            'component_texts': [
+                {
+                    'text': line['text'],
+                    'confidence': line['confidence'],
+                    'text_region': line['text_region'],
+                    'is_split': False,
+                    'original_text': None,
+                    'is_positional_assignment': False
+                } for line in lines
+            ]
+        })
+    
+    text_items = sum(len(lines) for lines in cell_texts)
+    output_data = {
+        'image_path': cell_data.get('input_path', ''),
+        'cells_with_text': cells_with_text,
+        'empty_cells': empty_cells,
+        'unassigned_text': [], # Al tekst er læst inde i en celle
+        'spanning_text': [],
+        'metadata': {
+            'total_cells': len(cells),
+            'total_text_items': text_items,
+            'assigned_text_items': text_items,
+            'cells_with_text': len(cells_with_text),
+            'empty_cells': len(empty_cells),
+            'unassigned_text': 0,
+            'spanning_text_items': 0,
+            'ocr_mode': 'cells',
+            **(extra_metadata or {})
+        }
+    }
+    
+    with span('merge.write_json'):
+        save_json_file(output_data, output_path)
     
     return output_data
 
@@ -508,6 +590,39 @@ def process_document(cell_json_path, ocr_json_path, output_dir="combined_results
         print(f"Error loading OCR data: {e}")
         return None
     
+    return process_document_data(
+        cell_data_loaded,
+        ocr_data_loaded,
+        base_name,
+        output_dir=output_dir,
+        image_path=image_path,
+        overlap_threshold=overlap_threshold,
+        min_overlap_for_spanning=min_overlap_for_spanning
+    )
+
+def process_document_data(cell_data_loaded, ocr_data_loaded, base_name, output_dir="combined_results",
+                          image_path=None, overlap_threshold=0.5, min_overlap_for_spanning=0.1,
+                          extra_metadata=None, render=True):
+    """
+    Combine cell detection and OCR results that are already in memory
+    
+    Args:
+        cell_data_loaded (dict): Cell detection result (same structure as _res.json)
+        ocr_data_loaded (list|dict): OCR result (same structure as res_0.json)
+        base_name (str): Base name for the output files, e.g. 'processed_scan_res'
+        output_dir (str): Directory to save outputs
+        image_path (str): Path to original image (for visualization)
+        overlap_threshold (float): Threshold for text-cell overlap percentage
+        min_overlap_for_spanning (float): Minimum overlap to consider a cell for spanning text
+        extra_metadata (dict): Extra entries for the metadata block
+        render (bool): Draw the visualization now; otherwise only its path is set and
+            render_visualization draws it later
+        
+    Returns:
+        dict: Merged data structure with additional paths for visualization
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    
     # Derive image path if not provided
     current_image_path = image_path # Brug et nyt variabelnavn
     if not current_image_path:
@@ -523,28 +638,64 @@ def process_document(cell_json_path, ocr_json_path, output_dir="combined_results
         ocr_data_loaded, 
         output_json_path, 
         overlap_threshold,
-        min_overlap_for_spanning
+        min_overlap_for_spanning,
+        extra_metadata
     )
     
     if not merged_data:
         print("Failed to merge cell and text data")
         return None
     
+    return _add_visualization(merged_data, cell_data_loaded, ocr_data_loaded, base_name, output_dir,
+                              current_image_path, output_json_path, render)
+
+def process_cell_text_data(cell_data_loaded, cell_texts, base_name, output_dir="combined_results",
+                           image_path=None, extra_metadata=None, render=True):
+    """
+    Write the document for text read per cell (see cell_text_document) and its visualization
+    
+    Args:
+        cell_data_loaded (dict): Cell detection result (same structure as _res.json)
+        cell_texts (list): One list of text lines per cell, from recognize_cells
+        base_name (str): Base name for the output files, e.g. 'processed_scan_res'
+        output_dir (str): Directory to save outputs
+        image_path (str): Path to original image (for visualization)
+        extra_metadata (dict): Extra entries for the metadata block
+        render (bool): Draw the visualization now, or leave it to render_visualization
+        
+    Returns:
+        dict: Merged data structure with additional paths for visualization
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    current_image_path = image_path or cell_data_loaded.get('input_path', '')
+    output_json_path = os.path.join(output_dir, f"{base_name}_combined_with_spanning.json")
+    merged_data = cell_text_document(cell_data_loaded, cell_texts, output_json_path, extra_metadata)
+    return _add_visualization(merged_data, cell_data_loaded, None, base_name, output_dir,
+                              current_image_path, output_json_path, render)
+
+def _add_visualization(merged_data, cell_data_loaded, ocr_data_loaded, base_name, output_dir,
+                       current_image_path, output_json_path, render=True):
+    """Create the visualization (or only reserve its path) and add 'output_paths' to the merged data"""
     # Create visualization
     visualization_path = None
     try:
         if current_image_path and os.path.exists(current_image_path):
-            vis_path = os.path.join(output_dir, f"{base_name}_visualization_with_spanning.jpg")
-            visualization_path = create_visualization_with_spanning(
-                cell_data_loaded, ocr_data_loaded, merged_data, vis_path, current_image_path
-            )
-            
-            if visualization_path:
-                print(f"Created visualization at: {visualization_path}")
-                # Add the path to merged data for reference
-                merged_data['visualization_path'] = visualization_path
+            vis_path = os.path.join(output_dir, f"{base_name}{VISUALIZATION_SUFFIX}")
+            if not render:
+                # Tegnes først når den hentes (render_visualization)
+                visualization_path = vis_path
             else:
-                print(f"Failed to create visualization at: {vis_path}")
+                with span('merge.visualization'):
+                    visualization_path = create_visualization_with_spanning(
+                        cell_data_loaded, ocr_data_loaded, merged_data, vis_path, current_image_path
+                    )
+                
+                if visualization_path:
+                    print(f"Created visualization at: {visualization_path}")
+                    # Add the path to merged data for reference
+                    merged_data['visualization_path'] = visualization_path
+                else:
+                    print(f"Failed to create visualization at: {vis_path}")
         else:
             print(f"Skipping visualization: valid image path not available")
     except Exception as e:
@@ -555,7 +706,8 @@ def process_document(cell_json_path, ocr_json_path, output_dir="combined_results
     # Add paths to the output data
     merged_data['output_paths'] = {
         'json': output_json_path,
-        'visualization': visualization_path
+        'visualization': visualization_path,
+        'image': current_image_path
     }
     
     print(f"Processing complete for {base_name}")
@@ -564,8 +716,28 @@ def process_document(cell_json_path, ocr_json_path, output_dir="combined_results
     
     return merged_data
 
-def create_visualization_with_spanning(cell_data_vis, ocr_data_vis, merged_data, output_path, original_image_path_vis): # Ændret param navne
-    """Create an enhanced visualization of the merged data, highlighting spanning text"""
+def render_visualization(json_path, output_path, max_side=None):
+    """
+    Draw the visualization of a merged JSON file that was written without one
+    
+    The image is the one recorded as 'image_path' in the document.
+    
+    Args:
+        json_path (str): Merged JSON file (_combined_with_spanning.json)
+        output_path (str): Where to write the visualization
+        max_side (int): Downscale so the longest side is at most this (None = full size)
+        
+    Returns:
+        str: output_path, or None if the image could not be read or written
+    """
+    merged_data = load_json_file(json_path)
+    with span('merge.visualization'):
+        return create_visualization_with_spanning(None, None, merged_data, output_path,
+                                                  merged_data.get('image_path', ''), max_side)
+
+def create_visualization_with_spanning(cell_data_vis, ocr_data_vis, merged_data, output_path, original_image_path_vis,
+                                       max_side=None): # Ændret param navne
+    """Create an enhanced visualization of the merged data, highlighting spanning text (downscaled to max_side if given)"""
     import cv2
     
     # Ensure the output directory exists
@@ -623,21 +795,15 @@ def create_visualization_with_spanning(cell_data_vis, ocr_data_vis, merged_data,
     
     # Highlight spanning text with yellow lines connecting split parts
     if 'spanning_text' in merged_data:
+        cells = CellTable.from_document(merged_data)
+        row_of_id = cells.row_of_id()
         for span_item in merged_data['spanning_text']:
             # Get all cells this text spans
             cell_ids = span_item['assigned_to_cells']
             
-            # Find cell centers
-            centers = []
-            for cell_id in cell_ids:
-                # Find the cell with this ID
-                for cell_obj in merged_data['cells_with_text']: # Brug 'cell_obj' for at undgå navnekonflikt
-                    if cell_obj['cell_id'] == cell_id:
-                        coords = cell_obj['coordinates']
-                        center_x = (coords[0] + coords[2]) // 2
-                        center_y = (coords[1] + coords[3]) // 2
-                        centers.append((int(center_x), int(center_y)))
-                        break
+            # Find cell centers (cell id -> række i tabellen i stedet for at søge alle celler igennem)
+            centers = [tuple(int(v) for v in np.floor(cells.centers[row_of_id[cell_id]]))
+                       for cell_id in cell_ids if cell_id in row_of_id]
             
             # Draw lines connecting cells with this spanning text
             if len(centers) > 1:
@@ -657,6 +823,11 @@ def create_visualization_with_spanning(cell_data_vis, ocr_data_vis, merged_data,
                 cv2.putText(visualization, display_text, (mid_x - 50, label_y), 
                             cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 200, 200), 2) # Mørkere gul/orange
     
+    # Preview: tegnes i fuld størrelse og skaleres ned bagefter
+    if max_side and max(visualization.shape[:2]) > max_side:
+        scale = max_side / max(visualization.shape[:2])
+        visualization = cv2.resize(visualization, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
     # Save visualization
     try:
         print(f"Saving visualization to: {output_path}")
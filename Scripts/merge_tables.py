@@ -0,0 +1,311 @@
+import bisect
+
+import numpy as np
+from shapely.geometry import box
+from shapely.strtree import STRtree
+
+from Scripts.box_overlap import region_to_box
+
+
+class CellRow:
+    """View of one row of a `CellTable`; reads and writes go to the table's columns."""
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def id(self):
+        return int(self.table.ids[self.index])
+
+    @property
+    def bounds(self):
+        return self.table.bounds[self.index]
+
+    @property
+    def center(self):
+        return self.table.centers[self.index]
+
+    @property
+    def cell_info(self):
+        return self.table.cells[self.index]
+
+    @property
+    def polygon(self):
+        return self.table.polygon(self.index)
+
+    @property
+    def text_items(self):
+        return self.table.text_items[self.index]
+
+    @property
+    def combined_text(self):
+        return self.table.texts[self.index]
+
+    @property
+    def confidence(self):
+        return float(self.table.confidences[self.index])
+
+
+class CellTable:
+    """
+    The detected cells of one document as NumPy columns.
+
+    Built once per document from the cell detection boxes: `bounds` (x1, y1, x2, y2),
+    `centers`, `sizes` and `scores` are (N, ...) float arrays, `ids` the position of
+    each cell in the detection result. Text assigned during merging is kept per row
+    in `text_items`, `texts` and `confidences`. Shapely polygons and the STRtree are
+    only built if a text needs an exact (non-rectangular) intersection.
+    """
+
+    def __init__(self, cells, ids, bounds, scores):
+        self.cells = cells
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.centers = (self.bounds[:, :2] + self.bounds[:, 2:]) / 2
+        self.sizes = self.bounds[:, 2:] - self.bounds[:, :2]
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.text_items = [[] for _ in cells]
+        self.texts = [''] * len(cells)
+        self.confidences = np.zeros(len(cells), dtype=np.float64)
+        self._polygons = None
+        self._index = None
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        """Build the table from cell detection boxes ({'coordinate': [x1, y1, x2, y2], 'score'})."""
+        cells, ids, bounds, scores = [], [], [], []
+        for i, cell in enumerate(boxes):
+            try:
+                x1, y1, x2, y2 = (float(v) for v in cell['coordinate'])
+            except Exception as e:
+                print(f"Error processing cell {i}: {e}")
+                continue
+            cells.append(cell)
+            ids.append(i)
+            bounds.append((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)))
+            scores.append(cell.get('score', 0.0))
+        return cls(cells, ids, bounds, scores)
+
+    @classmethod
+    def from_document(cls, merged_data):
+        """Build the table from the cells of a merged document (with and without text)."""
+        cells = list(merged_data.get('cells_with_text', [])) + list(merged_data.get('empty_cells', []))
+        table = cls(cells, [c['cell_id'] for c in cells], [c['coordinates'] for c in cells],
+                    [c.get('cell_score', 0.0) for c in cells])
+        table.texts = [c.get('text', '') for c in cells]
+        return table
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __getitem__(self, index):
+        return CellRow(self, index)
+
+    def __iter__(self):
+        return (CellRow(self, i) for i in range(len(self.cells)))
+
+    def polygon(self, index):
+        if self._polygons is None:
+            self._polygons = [box(*b) for b in self.bounds]
+        return self._polygons[index]
+
+    def overlaps(self, text_polygon):
+        """
+        Overlap percentage of a (rotated or irregular) text polygon with each cell it touches.
+
+        Returns:
+            dict: Row -> overlap percentage (rows not listed overlap 0.0)
+        """
+        if not len(self.cells):
+            return {}
+        if self._index is None:
+            self._index = STRtree([self.polygon(i) for i in range(len(self.cells))])
+        overlaps = {}
+        for idx in self._index.query(text_polygon):
+            cell_polygon = self.polygon(int(idx))
+            if text_polygon.intersects(cell_polygon):
+                overlap = text_polygon.intersection(cell_polygon).area / text_polygon.area
+                if overlap > 0.0:
+                    overlaps[int(idx)] = overlap
+        return overlaps
+
+    def row_of_id(self):
+        """Mapping cell id -> row."""
+        return {int(cell_id): row for row, cell_id in enumerate(self.ids)}
+
+
+# Cell edges closer than this fraction of the median cell height belong to the same grid line
+GRID_TOLERANCE = 0.5
+
+
+def _grid_lines(edges, tolerance):
+    """Cluster sorted edge positions into grid lines; returns the first position of each line."""
+    lines = []
+    for edge in edges:
+        if not lines or edge - last > tolerance:
+            lines.append(edge)
+        last = edge
+    return lines
+
+
+class RowBandIndex:
+    """
+    Cells of a `CellTable` sorted by y-center, and the row/column grid they form.
+
+    Built once per page. `cells_near_y` finds the cells whose center is within a
+    tolerance of a y position with two bisections, so the positional split costs
+    O(log n + k) per text instead of a scan over all cells. The grid is
+    reconstructed from the cell edges: top edges within `GRID_TOLERANCE` of the
+    median cell height form one row line, left edges likewise one column line.
+    `grid_rows`, `grid_cols`, `row_spans` and `col_spans` hold each cell's
+    0-based position and how many grid lines it spans.
+    """
+
+    def __init__(self, cells, grid_tolerance=GRID_TOLERANCE):
+        self.cells = cells
+        self.order = np.argsort(cells.centers[:, 1], kind='stable')
+        self.y_centers = cells.centers[self.order, 1].tolist()
+
+        tolerance = grid_tolerance * float(np.median(cells.sizes[:, 1])) if len(cells) else 0.0
+        self.grid_rows, self.row_spans = self._grid(cells.bounds[:, 1], cells.bounds[:, 3], tolerance)
+        self.grid_cols, self.col_spans = self._grid(cells.bounds[:, 0], cells.bounds[:, 2], tolerance)
+
+    @staticmethod
+    def _grid(starts, ends, tolerance):
+        lines = _grid_lines(np.sort(starts).tolist(), tolerance)
+        positions = np.zeros(len(starts), dtype=np.int64)
+        spans = np.ones(len(starts), dtype=np.int64)
+        for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            first = bisect.bisect_right(lines, start) - 1
+            # Grid lines that start before the far edge (less the tolerance) are spanned
+            last = bisect.bisect_left(lines, end - tolerance)
+            positions[i] = first
+            spans[i] = max(last - first, 1)
+        return positions, spans
+
+    def cells_near_y(self, y, tolerance):
+        """
+        Rows of the cells whose y-center is within `tolerance` of `y`, left to right.
+
+        Cells with the same left edge stay in table order.
+        """
+        y_centers = self.y_centers
+        lo = bisect.bisect_left(y_centers, y - tolerance)
+        hi = bisect.bisect_right(y_centers, y + tolerance)
+        # The bisection bounds are rounded differently than |center - y|, so the band
+        # edges are re-checked with the exact test
+        while lo > 0 and abs(y_centers[lo - 1] - y) <= tolerance:
+            lo -= 1
+        while hi < len(y_centers) and abs(y_centers[hi] - y) <= tolerance:
+            hi += 1
+        rows = [int(row) for row, center in zip(self.order[lo:hi], y_centers[lo:hi])
+                if abs(center - y) <= tolerance]
+        return sorted(rows, key=lambda row: (self.cells.bounds[row, 0], row))
+
+    def grid_position(self, row):
+        """{'row', 'col', 'row_span', 'col_span'} of a cell, for the merged JSON."""
+        return {
+            'row': int(self.grid_rows[row]),
+            'col': int(self.grid_cols[row]),
+            'row_span': int(self.row_spans[row]),
+            'col_span': int(self.col_spans[row])
+        }
+
+
+class TextRow:
+    """View of one row of a `TextTable`."""
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def item(self):
+        return self.table.items[self.index]
+
+    @property
+    def text(self):
+        return self.table.texts[self.index]
+
+    @property
+    def confidence(self):
+        return self.table.confidences[self.index]
+
+    @property
+    def text_region(self):
+        return self.table.items[self.index]['text_region']
+
+    @property
+    def center(self):
+        return self.table.centers[self.index]
+
+    @property
+    def size(self):
+        return self.table.sizes[self.index]
+
+    @property
+    def rect(self):
+        """(x1, y1, x2, y2) if the region is an axis-aligned rectangle, otherwise None."""
+        row = self.table.rect_rows[self.index]
+        return None if row < 0 else self.table.rect_boxes[row]
+
+
+class TextTable:
+    """
+    The OCR text items of one document as NumPy columns.
+
+    `centers` (mean of the region points, as get_text_center) and `sizes` (width,
+    height of the point extent, as get_text_dimensions) are computed once per text.
+    Texts with an axis-aligned rectangular region also get a row in `rect_boxes`
+    (`rect_rows` maps text row -> box row, -1 for other shapes), so their overlaps
+    with all cells come from one vectorized `box_overlap_matrix` call. `usable` marks
+    texts with a region and non-blank text; rows without readable points have NaN
+    geometry.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        count = len(items)
+        self.texts = [item.get('text', '') for item in items]
+        self.confidences = [item.get('confidence', 0.0) for item in items]
+        self.usable = np.zeros(count, dtype=bool)
+        self.centers = np.full((count, 2), np.nan)
+        self.sizes = np.full((count, 2), np.nan)
+        self.rect_rows = np.full(count, -1, dtype=np.int64)
+        rect_boxes = []
+        by_length = {}
+        for i, item in enumerate(items):
+            if 'text_region' not in item or not self.texts[i].strip():
+                continue
+            self.usable[i] = True
+            region = item['text_region']
+            try:
+                points = [(float(p[0]), float(p[1])) for p in region]
+            except (TypeError, ValueError, IndexError):
+                continue
+            if points:
+                by_length.setdefault(len(points), ([], []))
+                by_length[len(points)][0].append(i)
+                by_length[len(points)][1].append(points)
+            rect = region_to_box(region)
+            if rect is not None:
+                self.rect_rows[i] = len(rect_boxes)
+                rect_boxes.append(rect)
+        # Regions with the same number of points are reduced together
+        for rows, points in by_length.values():
+            points = np.asarray(points, dtype=np.float64)
+            self.centers[rows] = points.sum(axis=1) / points.shape[1]
+            self.sizes[rows] = points.max(axis=1) - points.min(axis=1)
+        self.rect_boxes = np.asarray(rect_boxes, dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return TextRow(self, index)
+
@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+
+from Scripts.instrumentation import current_rss_bytes
+
+
+class ModelHandle:
+    """A loaded model together with the lock that serializes calls into it."""
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self.model
+
+    def __exit__(self, exc_type, exc, tb):
+        self.lock.release()
+        return False
+
+
+class ModelRegistry:
+    """
+    Process-wide registry that loads each model once and hands out shared handles.
+
+    Models are registered by name with a loader function and are only built the
+    first time they are requested (or when `warm_up` is called). Using a handle as
+    a context manager holds the model's lock, since neither Paddle predictors nor
+    the EasyOCR reader are safe to call from several threads at once.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._warmers = {}
+        self._handles = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, loader, warmer=None):
+        """
+        Register a model loader.
+
+        Args:
+            name (str): Name used to look the model up
+            loader (callable): Zero-argument function that builds the model
+            warmer (callable): Optional function called once with the fresh model
+                to run a dummy inference before the first real request
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._warmers[name] = warmer
+            self._load_locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """Return the `ModelHandle` for `name`, loading the model on first use."""
+        handle = self._handles.get(name)
+        if handle is not None:
+            return handle
+
+        if name not in self._loaders:
+            raise KeyError(f"No model registered under the name '{name}'")
+
+        # Per-model lock so that two slow models can load in parallel
+        with self._load_locks[name]:
+            handle = self._handles.get(name)
+            if handle is not None:
+                return handle
+
+            print(f"Loading model '{name}'...")
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            model = self._loaders[name]()
+            load_seconds = time.perf_counter() - start
+
+            warm_up_seconds = None
+            warmer = self._warmers.get(name)
+            if warmer is not None:
+                start = time.perf_counter()
+                try:
+                    warmer(model)
+                    warm_up_seconds = time.perf_counter() - start
+                except Exception as e:
+                    print(f"Warm-up of model '{name}' failed: {e}")
+
+            rss_after = current_rss_bytes()
+            handle = ModelHandle(name, model)
+            self._stats[name] = {
+                'load_seconds': load_seconds,
+                'warm_up_seconds': warm_up_seconds,
+                'rss_delta_bytes': max(rss_after - rss_before, 0),
+                'loaded_at': time.time(),
+                'pid': os.getpid()
+            }
+            self._handles[name] = handle
+            print(f"Loaded model '{name}' in {load_seconds:.2f}s")
+            return handle
+
+    def warm_up(self, names=None):
+        """Load (and warm) the given models, or every registered model."""
+        for name in (names or list(self._loaders)):
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Could not warm up model '{name}': {e}")
+
+    def is_loaded(self, name):
+        return name in self._handles
+
+    def stats(self):
+        """Return load time and memory statistics for every registered model."""
+        return {
+            name: dict(self._stats.get(name, {}), loaded=name in self._handles)
+            for name in self._loaders
+        }
+
+
+# Shared registry for this worker process
+registry = ModelRegistry()
+
+CELL_DETECTION_MODEL = 'cell_detection'
+STRUCTURE_MODEL = 'pp_structure'
+TEXT_RECOGNITION_MODEL = 'text_recognition'
+IQA_MODEL = 'image_quality'
+
+
+def _load_cell_detection():
+    from paddlex import create_model
+    return create_model(model_name="RT-DETR-L_wired_table_cell_det")
+
+
+def _load_pp_structure():
+    from paddleocr import PPStructure
+    return PPStructure(show_log=False)
+
+
+def _load_text_recognition():
+    from paddleocr import PaddleOCR
+    # Same detection/recognition models as PP-Structure, used on cell crops
+    return PaddleOCR(show_log=False, use_angle_cls=False)
+
+
+def _load_image_quality():
+    from Scripts.IQA import ImageQualityAssessor
+    return ImageQualityAssessor()
+
+
+def _blank_page():
+    import numpy as np
+    return np.full((64, 64, 3), 255, dtype=np.uint8)
+
+
+def _warm_cell_detection(model):
+    list(model.predict(_blank_page(), threshold=0.3, batch_size=1))
+
+
+def _warm_pp_structure(model):
+    model(_blank_page())
+
+
+def _warm_text_recognition(model):
+    model.ocr([_blank_page()], det=False, cls=False)
+
+
+def _warm_image_quality(assessor):
+    assessor.reader.readtext(_blank_page(), detail=1)
+
+
+registry.register(CELL_DETECTION_MODEL, _load_cell_detection, _warm_cell_detection)
+registry.register(STRUCTURE_MODEL, _load_pp_structure, _warm_pp_structure)
+registry.register(TEXT_RECOGNITION_MODEL, _load_text_recognition, _warm_text_recognition)
+registry.register(IQA_MODEL, _load_image_quality, _warm_image_quality)
@@ -0,0 +1,159 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from Scripts.image_preprocess import get_preprocessor, DEFAULT_ANALYSIS_MAX_SIDE
+from Scripts.instrumentation import span, record_image_size
+
+# Process pools by (name, workers), e.g. ('preprocess', 8) or ('ocr', 2)
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def _init_worker(opencv_threads):
+    # Each worker gets its share of the cores, so N workers x OpenCV's own thread
+    # pool do not oversubscribe the machine
+    cv2.setNumThreads(opencv_threads)
+
+
+def get_pool(workers=None, name='preprocess'):
+    """
+    Return the shared process pool `name` with `workers` processes, creating it on first use.
+
+    Each worker count gets its own pool, so asking for another size never shuts down a
+    pool that other callers may still be submitting to.
+    """
+    workers = max(int(workers or os.cpu_count() or 1), 1)
+    with _pool_lock:
+        pool = _pools.get((name, workers))
+        if pool is None:
+            opencv_threads = max((os.cpu_count() or 1) // workers, 1)
+            # spawn: forking a server process that holds model threads is not safe
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(opencv_threads,))
+            _pools[(name, workers)] = pool
+        return pool
+
+
+def shutdown_pool():
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=True)
+        _pools.clear()
+
+
+atexit.register(shutdown_pool)
+
+
+def to_shared_memory(image):
+    """Copy an array into a new shared memory block; the receiver unlinks it."""
+    block = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+    np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[...] = image
+    descriptor = (block.name, image.shape, image.dtype.str)
+    block.close()
+    return descriptor
+
+
+def from_shared_memory(descriptor):
+    """Copy an array out of a shared memory block and unlink the block."""
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _preprocess_in_worker(source, output_path, params):
+    """Preprocess one page in a pool worker; the result goes back through shared memory."""
+    kind, value = source
+    preprocessor = get_preprocessor(**params)
+    info = {}
+    if kind == 'shm':
+        # Work on the parent's buffer directly; the result is always a new array
+        name, input_shape, dtype = value
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            image = np.ndarray(input_shape, dtype=np.dtype(dtype), buffer=block.buf)
+            result = preprocessor.process(image, info)
+            del image
+        finally:
+            block.close()
+            block.unlink()
+    else:
+        image = cv2.imread(value)
+        if image is None:
+            raise ValueError(f"Could not read image from {value}")
+        input_shape = image.shape
+        result = preprocessor.process(image, info)
+    if output_path:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, result)
+    return to_shared_memory(result), input_shape, info
+
+
+def preprocess_many(inputs, output_paths=None, gamma=1.2, min_area_ratio=0.3,
+                    analysis_max_side=DEFAULT_ANALYSIS_MAX_SIDE, deskew=False, deskew_tolerance=0.2,
+                    workers=None, infos=None):
+    """
+    Preprocess several pages in parallel on a process pool.
+
+    Pages are decoded in the workers when given as paths, and decoded images and
+    results are passed through shared memory blocks rather than pickled.
+
+    Args:
+        inputs (list): Image file paths or BGR arrays
+        output_paths (list): Optional paths to write each preprocessed image to
+        gamma (float): Gamma correction value
+        min_area_ratio (float): Minimum document area for dewarping
+        analysis_max_side (int): Longest side used for corner detection
+        deskew (bool): Correct small rotations after dewarping
+        deskew_tolerance (float): Smallest angle (degrees) that is corrected
+        workers (int): Worker processes (default: one per CPU)
+        infos (list): Optional list of dicts, one per input, that receive the
+            preprocessing metadata (skew angle)
+
+    Returns:
+        list: The preprocessed image for each input, or the exception raised for it
+    """
+    params = {'gamma': gamma, 'min_area_ratio': min_area_ratio, 'analysis_max_side': analysis_max_side,
+              'deskew': deskew, 'deskew_tolerance': deskew_tolerance}
+    output_paths = output_paths or [None] * len(inputs)
+    pool = get_pool(workers)
+
+    with span('preprocess.pool'):
+        futures = []
+        for source, output_path in zip(inputs, output_paths):
+            if isinstance(source, np.ndarray):
+                source = ('shm', to_shared_memory(source))
+            else:
+                source = ('path', source)
+            futures.append((source, pool.submit(_preprocess_in_worker, source, output_path, params)))
+
+        results = []
+        for i, (source, future) in enumerate(futures):
+            try:
+                descriptor, input_shape, info = future.result()
+                results.append(from_shared_memory(descriptor))
+                if infos is not None:
+                    infos[i].update(info)
+                record_image_size(input_shape[1], input_shape[0], 'input')
+            except Exception as e:
+                if source[0] == 'shm':
+                    # The worker may have failed before taking ownership of the input block
+                    try:
+                        block = shared_memory.SharedMemory(name=source[1][0])
+                        block.close()
+                        block.unlink()
+                    except FileNotFoundError:
+                        pass
+                results.append(e)
+    return results
@@ -0,0 +1,207 @@
+import copy
+
+import numpy as np
+
+# Default tile size and overlap (pixels) for tiled PP-Structure runs
+DEFAULT_TILE_SIZE = 1600
+DEFAULT_TILE_OVERLAP = 200
+
+# A box within this many pixels of an inner tile edge is treated as cut by the seam
+SEAM_MARGIN = 4
+
+# A text line is a duplicate when it lies inside another one, give or take this
+# fraction of the line height
+DUPLICATE_TOLERANCE = 0.25
+
+
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    step = max(tile_size - overlap, 1)
+    starts = list(range(0, length - tile_size, step))
+    # The last tile ends on the page edge, so it overlaps its neighbour by at least `overlap`
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_grid(width, height, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_TILE_OVERLAP):
+    """
+    Split a page into overlapping tiles.
+
+    Returns:
+        list: (x1, y1, x2, y2) tiles, row by row, covering the whole page
+    """
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in _tile_starts(height, tile_size, overlap)
+            for x in _tile_starts(width, tile_size, overlap)]
+
+
+def offset_region(region, dx, dy):
+    """
+    Copy of a PP-Structure region moved from tile to page coordinates.
+
+    The region bbox and the text_region points of its text lines are page
+    coordinates in PP-Structure output; table cell boxes are relative to the
+    table crop and stay as they are.
+    """
+    region = copy.deepcopy(region)
+    x1, y1, x2, y2 = region['bbox']
+    region['bbox'] = [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
+    for line in region.get('res') or []:
+        if isinstance(line, dict) and line.get('text_region'):
+            line['text_region'] = [[x + dx, y + dy] for x, y in line['text_region']]
+    return region
+
+
+def _line_box(line):
+    points = np.asarray(line['text_region'], dtype=np.float64).reshape(-1, 2)
+    return (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+
+def _area(box):
+    return max(box[2] - box[0], 0) * max(box[3] - box[1], 0)
+
+
+def _intersection(a, b):
+    return _area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+
+
+def _inside(inner, outer, tolerance):
+    return (inner[0] >= outer[0] - tolerance and inner[1] >= outer[1] - tolerance
+            and inner[2] <= outer[2] + tolerance and inner[3] <= outer[3] + tolerance)
+
+
+def _union_box(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _seam_cut(box, tile, width, height, margin=SEAM_MARGIN):
+    """True if the box touches an edge of its tile that is not a page edge."""
+    tx1, ty1, tx2, ty2 = tile
+    return ((tx1 > 0 and box[0] - tx1 <= margin) or (ty1 > 0 and box[1] - ty1 <= margin)
+            or (tx2 < width and tx2 - box[2] <= margin) or (ty2 < height and ty2 - box[3] <= margin))
+
+
+def _stitch_text(left_text, right_text, left_box, right_box):
+    """
+    Join the two halves of a text line cut by a vertical seam.
+
+    The halves share the characters in the tile overlap. Their number is estimated
+    from how much of the right box lies over the left one; the longest suffix/prefix
+    match close to that estimate is dropped, otherwise the estimate itself is used.
+    """
+    width = right_box[2] - right_box[0]
+    if not right_text or width <= 0:
+        return left_text
+    covered = min(max((left_box[2] - right_box[0]) / width, 0.0), 1.0)
+    expected = int(round(covered * len(right_text)))
+    tolerance = max(2, expected // 2)
+    for k in range(min(len(left_text), len(right_text)), 1, -1):
+        if abs(k - expected) <= tolerance and left_text.endswith(right_text[:k]):
+            return left_text + right_text[k:]
+    return left_text + right_text[expected:]
+
+
+def _merge_lines(lines):
+    """De-duplicate and stitch the text lines of region fragments from neighbouring tiles."""
+    merged = []
+    plain = []
+    for line in sorted((l for l in lines if isinstance(l, dict) and l.get('text_region')),
+                       key=lambda l: _line_box(l)[0]):
+        box = _line_box(line)
+        for i, (kept, kept_box) in enumerate(merged):
+            y_overlap = min(box[3], kept_box[3]) - max(box[1], kept_box[1])
+            if y_overlap < 0.5 * min(box[3] - box[1], kept_box[3] - kept_box[1]) or box[0] > kept_box[2]:
+                continue
+            tolerance = DUPLICATE_TOLERANCE * min(box[3] - box[1], kept_box[3] - kept_box[1])
+            if _inside(box, kept_box, tolerance):
+                break  # Same line read twice in the overlap
+            if _inside(kept_box, box, tolerance):
+                merged[i] = (line, box)
+                break
+            # Cut by the seam: the halves overlap horizontally
+            union = _union_box(kept_box, box)
+            left_text, right_text = kept.get('text', ''), line.get('text', '')
+            text = _stitch_text(left_text, right_text, kept_box, box)
+            lengths = max(len(left_text) + len(right_text), 1)
+            confidence = (kept.get('confidence', 0.0) * len(left_text)
+                          + line.get('confidence', 0.0) * len(right_text)) / lengths
+            x1, y1, x2, y2 = (float(v) for v in union)
+            merged[i] = (dict(kept, text=text, confidence=confidence,
+                              text_region=[[x1, y1], [x2, y1], [x2, y2], [x1, y2]]), union)
+            break
+        else:
+            merged.append((line, box))
+
+    # Lines without geometry can only be de-duplicated by their content
+    for line in lines:
+        if not (isinstance(line, dict) and line.get('text_region')) and line not in plain:
+            plain.append(line)
+    merged.sort(key=lambda item: (item[1][1], item[1][0]))
+    return [line for line, _ in merged] + plain
+
+
+def _merge_fragments(fragments):
+    """Merge the copies and pieces of one region read in several tiles into a single region."""
+    # A copy that is not cut by a seam, otherwise the largest piece
+    largest = min(fragments, key=lambda f: (f['cut'], -_area(f['box'])))
+    region = copy.deepcopy(largest['region'])
+    box = largest['box']
+    for fragment in fragments:
+        box = _union_box(box, fragment['box'])
+    region['bbox'] = [int(v) for v in box]
+    if all(isinstance(f['region'].get('res'), list) for f in fragments):
+        region['res'] = _merge_lines([line for f in fragments for line in f['region']['res']])
+    # Other region types (tables) keep the content of that copy
+    return region
+
+
+def merge_tile_regions(tile_results, width, height):
+    """
+    Combine the PP-Structure regions of overlapping tiles into one page result.
+
+    Regions from different tiles that intersect are copies or pieces of the same
+    region: they are merged into one, dropping text lines read twice in the overlap
+    and stitching lines cut by a seam. Tables keep the copy that is not cut by a
+    seam, or the largest piece.
+
+    Args:
+        tile_results (list): ((x1, y1, x2, y2) tile, regions in tile coordinates) pairs
+        width (int): Page width
+        height (int): Page height
+
+    Returns:
+        list: Regions in page coordinates, in the res_0.json structure, top to bottom
+    """
+    candidates = []
+    for index, (tile, regions) in enumerate(tile_results):
+        for region in regions:
+            region = offset_region(region, tile[0], tile[1])
+            box = tuple(float(v) for v in region['bbox'])
+            candidates.append({'region': region, 'box': box, 'tile': index,
+                               'cut': _seam_cut(box, tile, width, height)})
+
+    # Layout regions of one page do not overlap, so regions from different tiles that
+    # intersect are copies or pieces of the same region
+    groups = list(range(len(candidates)))
+
+    def find(i):
+        while groups[i] != i:
+            groups[i] = groups[groups[i]]
+            i = groups[i]
+        return i
+
+    for i, a in enumerate(candidates):
+        for j in range(i + 1, len(candidates)):
+            b = candidates[j]
+            if (a['tile'] != b['tile'] and a['region'].get('type') == b['region'].get('type')
+                    and _intersection(a['box'], b['box']) > 0):
+                groups[find(j)] = find(i)
+
+    fragments = {}
+    for i, candidate in enumerate(candidates):
+        fragments.setdefault(find(i), []).append(candidate)
+    regions = [pieces[0]['region'] if len(pieces) == 1 else _merge_fragments(pieces)
+               for pieces in fragments.values()]
+    regions.sort(key=lambda r: (r['bbox'][1], r['bbox'][0]))
+    return regions
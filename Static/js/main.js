@@ -2,6 +2,8 @@
 let currentJsonData = null;
 let currentOriginalPath = null;
 let currentOutputImage = null;
+// Edit version of the current document, sent with each save so edits from another tab are detected
+let currentEditVersion = null;
 
 // Track edited items
 const editedItems = new Set();
@@ -79,6 +81,8 @@ document.getElementById('uploadForm').addEventListener('submit', async (e) => {
     e.preventDefault();
     
     const formData = new FormData(e.target);
+    // Only ask for the statistics and URLs, the cells are streamed in afterwards
+    formData.append('response', 'metadata');
     const spinner = document.getElementById('spinner');
     
     try {
@@ -89,11 +93,17 @@ document.getElementById('uploadForm').addEventListener('submit', async (e) => {
                 body: formData
             });
 
-            const data = await response.json();
+            let data = await response.json();
+
+            // Processing runs as a background job, poll until it has finished
+            if (data.status === 'queued') {
+                data = await waitForJob(data.job_id);
+            }
 
         if (data.status === 'success') {
             // Store current processing results
-            currentJsonData = data.json_data;
+            currentJsonData = data.json_data || null;
+            currentEditVersion = currentJsonData ? (currentJsonData.edit_version || 0) : null;
             currentOriginalPath = data.original_path;
             currentOutputImage = data.output_image;
             
@@ -104,7 +114,9 @@ document.getElementById('uploadForm').addEventListener('submit', async (e) => {
             
             // Display processed image with legend
             document.getElementById('processedImageContainer').innerHTML = `
-                <img src="${data.output_image}" class="img-fluid" alt="Analysis Visualization">
+                <a href="${data.output_image}" target="_blank">
+                    <img src="${data.output_image_preview || data.output_image}" class="img-fluid" alt="Analysis Visualization">
+                </a>
                 <div class="visualization-legend mt-3">
                     <h6>Visualization Legend</h6>
                     <div class="d-flex align-items-center mb-2">
@@ -130,8 +142,13 @@ document.getElementById('uploadForm').addEventListener('submit', async (e) => {
                 </div>
             `;
             
-            // Display JSON data
-            displayJsonData(data.json_data);
+            // Display JSON data, rendering the cells as they arrive when it was not embedded
+            if (data.json_data) {
+                displayJsonData(data.json_data);
+            } else {
+                currentJsonData = await streamJsonData(data.stream_url);
+                currentEditVersion = currentJsonData.edit_version || 0;
+            }
             
             // Show save results button
             document.getElementById('saveResultsBtn').classList.remove('d-none');
@@ -145,9 +162,23 @@ document.getElementById('uploadForm').addEventListener('submit', async (e) => {
     }
 });
 
-function displayJsonData(data) {
-    // Display metadata
-    const metadata = Object.entries(data.metadata)
+// Poll a processing job until it succeeds or fails and return its result
+async function waitForJob(jobId, intervalMs = 1000) {
+    while (true) {
+        const response = await fetch(`/jobs/${jobId}/result`);
+        const data = await response.json();
+        
+        if (response.status === 202) {
+            console.log(`Job ${jobId} progress: ${Math.round((data.progress || 0) * 100)}%`, data.stages);
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+            continue;
+        }
+        return data;
+    }
+}
+
+function renderMetadata(metadata) {
+    return Object.entries(metadata)
         .map(([key, value]) => `
             <div class="col-md-4 mb-3">
                 <div class="card h-100">
@@ -158,9 +189,10 @@ function displayJsonData(data) {
                 </div>
             </div>
         `).join('');
-    
-    // Display cells with text
-    const cellsWithText = data.cells_with_text.map(cell => `
+}
+
+function renderCellCard(cell) {
+    return `
         <div class="card h-100 text-item" data-type="cell" data-id="${cell.cell_id}">
             <div class="card-header d-flex justify-content-between align-items-center">
                 <span>Cell #${cell.cell_id}</span>
@@ -179,10 +211,11 @@ function displayJsonData(data) {
                 <button class="btn btn-sm btn-outline-secondary btn-revert d-none">Revert</button>
             </div>
         </div>
-    `).join('');
-    
-    // Display unassigned text
-    const unassignedText = data.unassigned_text.map(text => `
+    `;
+}
+
+function renderTextCard(text) {
+    return `
         <div class="card h-100 text-item" data-type="text" data-id="${text.text_id}">
             <div class="card-header d-flex justify-content-between align-items-center">
                 <span>Text #${text.text_id}</span>
@@ -200,38 +233,115 @@ function displayJsonData(data) {
                 <button class="btn btn-sm btn-outline-secondary btn-revert d-none">Revert</button>
             </div>
         </div>
-    `).join('');
-    
-    // Combine all sections, placing cells directly into the #textResults grid
+    `;
+}
+
+function renderResultsHeader(metadata) {
     document.getElementById('textResults').innerHTML = `
         <div class="col-12 mb-4" style="grid-column: 1 / -1;">
             <h4 class="mb-3">Document Statistics</h4>
             <div class="row">
-                ${metadata}
+                ${renderMetadata(metadata)}
             </div>
         </div>
         <div class="col-12" style="grid-column: 1 / -1;">
             <h4 class="mb-3">Cells with Text</h4>
         </div>
-        ${cellsWithText}
-        
-        ${unassignedText.length > 0 ? `
-            <div class="col-12 mt-4" style="grid-column: 1 / -1;">
-                <h4 class="mb-3">Unassigned Text</h4>
-            </div>
-            ${unassignedText}
-        ` : ''}
     `;
+}
+
+function unassignedTextHeading() {
+    return `
+        <div class="col-12 mt-4" style="grid-column: 1 / -1;">
+            <h4 class="mb-3">Unassigned Text</h4>
+        </div>
+    `;
+}
+
+// Append rendered cards to #textResults and add the edit/revert listeners
+function appendResultCards(html) {
+    const template = document.createElement('template');
+    template.innerHTML = html;
     
-    // Add event listeners to edit buttons
-    document.querySelectorAll('.btn-edit').forEach(btn => {
+    template.content.querySelectorAll('.btn-edit').forEach(btn => {
         btn.addEventListener('click', handleEditClick);
     });
-    
-    // Add event listeners to revert buttons
-    document.querySelectorAll('.btn-revert').forEach(btn => {
+    template.content.querySelectorAll('.btn-revert').forEach(btn => {
         btn.addEventListener('click', handleRevertClick);
     });
+    document.getElementById('textResults').appendChild(template.content);
+}
+
+function displayJsonData(data) {
+    renderResultsHeader(data.metadata);
+    appendResultCards(data.cells_with_text.map(renderCellCard).join(''));
+    if (data.unassigned_text.length > 0) {
+        appendResultCards(unassignedTextHeading() + data.unassigned_text.map(renderTextCard).join(''));
+    }
+}
+
+// Fetch a merged document as NDJSON and render the cards as the lines arrive.
+// Returns the reassembled document (same shape as json_data).
+async function streamJsonData(url) {
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`Failed to load results (${response.status})`);
+    }
+    
+    const data = {cells_with_text: [], unassigned_text: []};
+    const editVersion = response.headers.get('X-Edit-Version');
+    if (editVersion !== null) {
+        data.edit_version = parseInt(editVersion, 10);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let complete = false;
+    
+    const handleLine = (line, pending) => {
+        if (!line.trim()) {
+            return;
+        }
+        const message = JSON.parse(line);
+        if (message.type === 'header') {
+            delete message.type;
+            Object.assign(data, message);
+            renderResultsHeader(data.metadata || {});
+        } else if (message.type === 'cell') {
+            data.cells_with_text.push(message.item);
+            pending.push(renderCellCard(message.item));
+        } else if (message.type === 'text') {
+            if (data.unassigned_text.length === 0) {
+                pending.push(unassignedTextHeading());
+            }
+            data.unassigned_text.push(message.item);
+            pending.push(renderTextCard(message.item));
+        } else if (message.type === 'end') {
+            complete = true;
+        }
+    };
+    
+    while (true) {
+        const {value, done} = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), {stream: !done});
+        const lines = buffer.split('\n');
+        buffer = done ? '' : lines.pop();
+        
+        // One DOM update per network chunk
+        const pending = [];
+        lines.forEach(line => handleLine(line, pending));
+        if (pending.length > 0) {
+            appendResultCards(pending.join(''));
+        }
+        if (done) {
+            break;
+        }
+    }
+    
+    if (!complete) {
+        throw new Error('Results stream ended early');
+    }
+    return data;
 }
 
 function handleEditClick() {
@@ -326,6 +436,9 @@ function saveTextChange(card, newText) {
         cells_with_text: [],
         unassigned_text: []
     };
+    if (currentEditVersion !== null) {
+        changes.version = currentEditVersion;
+    }
 
     if (itemType === 'cell') {
         changes.cells_with_text.push({
@@ -446,6 +559,12 @@ function saveTextChange(card, newText) {
             });
         })
         .then(response => {
+            if (response.status === 409) {
+                // Saved from another tab in the meantime
+                return response.json().then(data => {
+                    throw new Error(data.error || 'Document was changed by another editor');
+                });
+            }
             if (!response.ok) {
                 throw new Error(`Server returned ${response.status}: ${response.statusText}`);
             }
@@ -457,6 +576,9 @@ function saveTextChange(card, newText) {
             
             if (data.success) {
                 console.log('Changes saved successfully!', data);
+                if (data.version !== undefined) {
+                    currentEditVersion = data.version;
+                }
                 
                 // Add visual indicator that the change was saved
                 const saveIndicator = document.createElement('div');
@@ -542,20 +664,38 @@ function saveDocumentToDatabase(documentName) {
     });
 }
 
-function loadDocumentsList() {
+function loadDocumentsList(cursor = null) {
     const tableBody = document.getElementById('documentsTableBody');
-    tableBody.innerHTML = '<tr><td colspan="4" class="text-center">Loading documents...</td></tr>';
+    if (!cursor) {
+        tableBody.innerHTML = '<tr><td colspan="4" class="text-center">Loading documents...</td></tr>';
+    }
     
-    fetch('/get_documents')
+    // The server returns one page at a time; "Load more" fetches the next page
+    const params = new URLSearchParams({
+        limit: 50,
+        fields: 'id,document_name,created_at,text_count'
+    });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    
+    fetch(`/get_documents?${params}`)
         .then(response => response.json())
         .then(data => {
             if (data.success && data.documents) {
-                if (data.documents.length === 0) {
+                if (!cursor && data.documents.length === 0) {
                     tableBody.innerHTML = '<tr><td colspan="4" class="text-center">No documents found</td></tr>';
                     return;
                 }
                 
-                tableBody.innerHTML = '';
+                if (!cursor) {
+                    tableBody.innerHTML = '';
+                }
+                const loadMoreRow = document.getElementById('loadMoreDocumentsRow');
+                if (loadMoreRow) {
+                    loadMoreRow.remove();
+                }
+                
                 data.documents.forEach(doc => {
                     const row = document.createElement('tr');
                     row.innerHTML = `
@@ -568,16 +708,23 @@ function loadDocumentsList() {
                             </button>
                         </td>
                     `;
+                    row.querySelector('.view-document').addEventListener('click', function() {
+                        viewDocument(this.dataset.documentId);
+                    });
                     tableBody.appendChild(row);
                 });
                 
-                // Add event listeners to view buttons
-                document.querySelectorAll('.view-document').forEach(btn => {
-                    btn.addEventListener('click', function() {
-                        const documentId = this.dataset.documentId;
-                        viewDocument(documentId);
-                    });
-                });
+                if (data.has_more) {
+                    const row = document.createElement('tr');
+                    row.id = 'loadMoreDocumentsRow';
+                    row.innerHTML = `
+                        <td colspan="4" class="text-center">
+                            <button class="btn btn-sm btn-outline-secondary">Load more</button>
+                        </td>
+                    `;
+                    row.querySelector('button').addEventListener('click', () => loadDocumentsList(data.next_cursor));
+                    tableBody.appendChild(row);
+                }
             } else {
                 tableBody.innerHTML = `<tr><td colspan="4" class="text-center text-danger">Error: ${data.error || 'Failed to load documents'}</td></tr>`;
             }
@@ -5,9 +5,11 @@ import sys
 project_root = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(project_root)
 
-from server.server import app
-
 if __name__ == '__main__':
+    # Imported here, not at the top: spawned pool workers re-import this file as
+    # __mp_main__ and must not set up the server (database, job queue, models) again
+    from server.server import app
+
     print("Starting Flask server...")
     print(f"Project root: {project_root}")
     app.run(port=8000, host='0.0.0.0')
\ No newline at end of file
@@ -1,20 +1,166 @@
 import os
+import base64
 import sqlite3
+import threading
 import uuid
 import json
 from datetime import datetime
 
+# Applied to every new connection. WAL lets readers run while a save is in progress,
+# and synchronous=NORMAL is durable in WAL mode without an fsync per transaction.
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',  # 16 MB page cache
+    'PRAGMA busy_timeout=5000'
+)
+
+# Schema migrations, applied in order by initialize_db. PRAGMA user_version records the
+# last applied version, so every migration runs exactly once per database file.
+SCHEMA_MIGRATIONS = [
+    (1, (
+        # get_document and the text counts filter ocr_text_item by document_id
+        'CREATE INDEX IF NOT EXISTS idx_ocr_text_item_document_id ON ocr_text_item (document_id)',
+        # Stored per-document text count so the listing no longer joins ocr_text_item
+        'ALTER TABLE ocr_document ADD COLUMN text_count INTEGER NOT NULL DEFAULT 0',
+        '''UPDATE ocr_document SET text_count = (
+            SELECT COUNT(*) FROM ocr_text_item t WHERE t.document_id = ocr_document.id
+        )''',
+        # Covers every listed column in created_at order, so the listing is an index-only scan
+        '''CREATE INDEX IF NOT EXISTS idx_ocr_document_listing ON ocr_document (
+            created_at, id, document_name, filename, image_path, original_image_path, text_count
+        )'''
+    )),
+    (2, (
+        # Stored flag for the has-edits filter of the document listing
+        'ALTER TABLE ocr_document ADD COLUMN has_edits INTEGER NOT NULL DEFAULT 0',
+        '''UPDATE ocr_document SET has_edits = EXISTS (
+            SELECT 1 FROM ocr_text_item t WHERE t.document_id = ocr_document.id AND t.edited = 1
+        )''',
+        'DROP INDEX IF EXISTS idx_ocr_document_listing',
+        '''CREATE INDEX IF NOT EXISTS idx_ocr_document_listing ON ocr_document (
+            created_at, id, document_name, filename, image_path, original_image_path, text_count, has_edits
+        )'''
+    )),
+    (3, (
+        # Full-text index over the saved OCR text. External content table: the text is
+        # stored once in ocr_text_item and save_document adds each new row to the index.
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS ocr_text_fts USING fts5(
+            text, content='ocr_text_item', content_rowid='id', tokenize='unicode61'
+        )''',
+        "INSERT INTO ocr_text_fts (ocr_text_fts) VALUES ('rebuild')"
+    )),
+    (4, (
+        # Index of the merge and split outputs, so find_json and save_edits can look a
+        # result up by upload name, base prefix or job id instead of listing the directory
+        '''CREATE TABLE IF NOT EXISTS result_file (
+            json_filename TEXT PRIMARY KEY,
+            base_prefix TEXT NOT NULL,
+            upload_filename TEXT,
+            job_id TEXT,
+            json_path TEXT NOT NULL,
+            visualization_path TEXT,
+            created_at TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_result_file_base_prefix ON result_file (base_prefix)',
+        'CREATE INDEX IF NOT EXISTS idx_result_file_upload_filename ON result_file (upload_filename)',
+        'CREATE INDEX IF NOT EXISTS idx_result_file_job_id ON result_file (job_id)',
+        'CREATE INDEX IF NOT EXISTS idx_result_file_listing ON result_file (created_at, json_filename)'
+    )),
+]
+
+# Schema version that introduces the FTS5 search index
+SEARCH_INDEX_VERSION = 3
+
+# Columns returned by get_all_documents (all covered by idx_ocr_document_listing)
+DOCUMENT_LIST_COLUMNS = ('id', 'document_name', 'filename', 'created_at', 'image_path',
+                         'original_image_path', 'text_count', 'has_edits')
+
+RESULT_FILE_COLUMNS = ('json_filename', 'base_prefix', 'upload_filename', 'job_id', 'json_path',
+                       'visualization_path', 'created_at')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(created_at, document_id):
+    """Opaque keyset cursor for the (created_at, id) position of a listed row"""
+    raw = json.dumps([created_at, document_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, raising ValueError if it is malformed"""
+    try:
+        created_at, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    return created_at, document_id
+
+def result_base_prefix(json_filename):
+    """Base prefix of a merged result file, e.g. processed_scan for processed_scan_res_combined_with_spanning.json"""
+    if '_res_' in json_filename:
+        return json_filename.split('_res_')[0]
+    return os.path.splitext(json_filename)[0]
+
+def fts5_available(conn):
+    """Check whether this SQLite build supports FTS5"""
+    try:
+        conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)')
+        conn.execute('DROP TABLE IF EXISTS temp.fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def build_match_query(query):
+    """
+    Turn free text into a safe FTS5 MATCH expression.
+    
+    Every whitespace separated term is quoted, so input such as invoice numbers
+    ("INV-2023/45") is matched literally instead of being parsed as FTS5 syntax.
+    A trailing * keeps prefix matching.
+    """
+    terms = []
+    for term in (query or '').split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*').replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
 class Database:
     def __init__(self, db_path='results.db'):
         self.db_path = db_path
+        self._local = threading.local()
         self.initialize_db()
         
     def get_connection(self):
-        """Get a database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """
+        Get this thread's database connection, opening it on first use
+        
+        The connection lives in a thread-local, so it goes away with its thread.
+        Request threads close it explicitly with close_connection when the
+        request ends.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
         return conn
         
+    def close_connection(self):
+        """Close this thread's connection, if it has one (e.g. at the end of a request)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        
     def initialize_db(self):
         """Initialize database tables if they don't exist"""
         conn = self.get_connection()
@@ -47,61 +193,95 @@ class Database:
         ''')
         
         conn.commit()
-        conn.close()
+        
+        self.migrate(conn)
+        
+    def migrate(self, conn):
+        """Apply the schema migrations this database has not seen yet"""
+        current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for version, statements in SCHEMA_MIGRATIONS:
+            if version <= current_version:
+                continue
+            if version == SEARCH_INDEX_VERSION and not fts5_available(conn):
+                # Recorded as applied so later migrations still run; rebuild_search_index
+                # creates the index once SQLite has FTS5
+                print("Warning: SQLite was built without FTS5, full-text search is disabled")
+                statements = ()
+            print(f"Migrating database {self.db_path} to schema version {version}")
+            with conn:
+                # sqlite3 only opens a transaction implicitly before DML, so CREATE and ALTER
+                # would autocommit; the explicit BEGIN rolls a failed migration back completely
+                conn.execute('BEGIN')
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+        self.search_enabled = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'ocr_text_fts'"
+        ).fetchone() is not None
+        
+    def rebuild_search_index(self):
+        """Rebuild the full-text index from ocr_text_item (e.g. after rows were written directly)"""
+        conn = self.get_connection()
+        if not self.search_enabled and not fts5_available(conn):
+            raise RuntimeError('Full-text search is not available for this database')
+        with conn:
+            # Creates the index if the migration was skipped for lack of FTS5
+            for statement in dict(SCHEMA_MIGRATIONS)[SEARCH_INDEX_VERSION]:
+                conn.execute(statement)
+        self.search_enabled = True
+        conn.execute("INSERT INTO ocr_text_fts (ocr_text_fts) VALUES ('optimize')")
+        conn.commit()
         
     def save_document(self, document_name, filename, original_image_path, output_image_path, json_data):
         """Save a document and its text items to the database"""
         document_id = str(uuid.uuid4())
         created_at = datetime.now().isoformat()
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        # Collect all text items first so they are inserted with one executemany
+        rows = []
         
-        # Insert document
-        cursor.execute(
-            'INSERT INTO ocr_document (id, document_name, filename, created_at, image_path, original_image_path) VALUES (?, ?, ?, ?, ?, ?)',
-            (document_id, document_name, filename, created_at, output_image_path, original_image_path)
-        )
+        # Text items from cells_with_text
+        for cell in json_data.get('cells_with_text', []):
+            rows.append((
+                document_id,
+                cell['text'],
+                cell.get('confidence', 0.0),
+                0,  # Not handwritten by default
+                json.dumps({"cell_id": cell['cell_id'],
+                            **{key: cell[key] for key in ('row', 'col') if key in cell}}),
+                1 if cell.get('edited', False) else 0  # Track edited state
+            ))
+            
+        # Text items from unassigned_text
+        for text in json_data.get('unassigned_text', []):
+            rows.append((
+                document_id,
+                text['text'],
+                text.get('confidence', 0.0),
+                0,  # Not handwritten by default
+                json.dumps({"text_id": text['text_id']}),
+                1 if text.get('edited', False) else 0  # Track edited state
+            ))
         
-        # Insert text items from cells_with_text
-        if 'cells_with_text' in json_data:
-            for cell in json_data['cells_with_text']:
-                # Check if the item has been edited
-                is_edited = 1 if cell.get('edited', False) else 0
-                
-                cursor.execute(
-                    'INSERT INTO ocr_text_item (document_id, text, confidence, is_handwritten, text_region, edited) VALUES (?, ?, ?, ?, ?, ?)',
-                    (
-                        document_id, 
-                        cell['text'], 
-                        cell.get('confidence', 0.0),
-                        0,  # Not handwritten by default
-                        json.dumps({"cell_id": cell['cell_id']}),
-                        is_edited   # Track edited state
-                    )
-                )
-                
-        # Insert text items from unassigned_text
-        if 'unassigned_text' in json_data:
-            for text in json_data['unassigned_text']:
-                # Check if the item has been edited
-                is_edited = 1 if text.get('edited', False) else 0
-                
-                cursor.execute(
-                    'INSERT INTO ocr_text_item (document_id, text, confidence, is_handwritten, text_region, edited) VALUES (?, ?, ?, ?, ?, ?)',
-                    (
-                        document_id, 
-                        text['text'], 
-                        text.get('confidence', 0.0),
-                        0,  # Not handwritten by default
-                        json.dumps({"text_id": text['text_id']}),
-                        is_edited   # Track edited state
-                    )
+        conn = self.get_connection()
+        # Document and text items are written in a single transaction
+        with conn:
+            conn.execute(
+                'INSERT INTO ocr_document (id, document_name, filename, created_at, image_path, original_image_path, text_count, has_edits) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (document_id, document_name, filename, created_at, output_image_path, original_image_path,
+                 len(rows), 1 if any(row[5] for row in rows) else 0)
+            )
+            conn.executemany(
+                'INSERT INTO ocr_text_item (document_id, text, confidence, is_handwritten, text_region, edited) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            if self.search_enabled:
+                # Keep the full-text index in sync within the same transaction
+                conn.execute(
+                    'INSERT INTO ocr_text_fts (rowid, text) SELECT id, text FROM ocr_text_item WHERE document_id = ?',
+                    (document_id,)
                 )
         
-        conn.commit()
-        conn.close()
-        
         return document_id
         
     def get_all_documents(self):
@@ -109,19 +289,222 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT d.*, COUNT(t.id) as text_count 
-            FROM ocr_document d
-            LEFT JOIN ocr_text_item t ON d.id = t.document_id
-            GROUP BY d.id
-            ORDER BY d.created_at DESC
+        # text_count is stored on the document, so this reads only idx_ocr_document_listing
+        cursor.execute(f'''
+            SELECT {', '.join(DOCUMENT_LIST_COLUMNS)}
+            FROM ocr_document
+            ORDER BY created_at DESC, id DESC
         ''')
         
         documents = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
         return documents
         
+    def list_documents(self, limit=DEFAULT_PAGE_SIZE, cursor=None, name=None, date_from=None,
+                       date_to=None, has_edits=None, fields=None):
+        """
+        Get one page of documents, newest first, using keyset pagination
+        
+        Args:
+            limit (int): Page size (capped at MAX_PAGE_SIZE)
+            cursor (str): next_cursor of the previous page
+            name (str): Only documents whose name contains this substring
+            date_from (str): Only documents created at or after this ISO date/time
+            date_to (str): Only documents created at or before this ISO date/time
+                (a plain date includes the whole day)
+            has_edits (bool): Only documents with (True) or without (False) edited text
+            fields (list): Columns to return, defaults to all of DOCUMENT_LIST_COLUMNS
+            
+        Returns:
+            dict: {'documents': [...], 'next_cursor': str or None, 'has_more': bool}
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        fields = list(fields) if fields else list(DOCUMENT_LIST_COLUMNS)
+        unknown = [f for f in fields if f not in DOCUMENT_LIST_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        
+        conditions = []
+        params = []
+        if cursor:
+            # Row-value comparison lets SQLite seek straight to the cursor in the index
+            conditions.append('(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+        if name:
+            escaped = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("document_name LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+        if date_from:
+            conditions.append('created_at >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('created_at <= ?')
+            params.append(date_to + 'T23:59:59.999999' if len(date_to) == 10 else date_to)
+        if has_edits is not None:
+            conditions.append('has_edits = ?')
+            params.append(1 if has_edits else 0)
+        
+        # id and created_at are always read for the cursor, even if not projected
+        columns = list(dict.fromkeys(['id', 'created_at'] + fields))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self.get_connection().execute(
+            f"SELECT {', '.join(columns)} FROM ocr_document {where} "
+            f"ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None
+        return {
+            'documents': [{f: row[f] for f in fields} for row in rows],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }
+        
+    def search(self, query, limit=20, offset=0):
+        """
+        Full-text search over saved OCR text, best matches first
+        
+        Args:
+            query (str): Search terms; all terms must match, a trailing * matches a prefix
+            limit (int): Page size (capped at MAX_PAGE_SIZE)
+            offset (int): Number of results to skip
+            
+        Returns:
+            dict: {'results': [...], 'has_more': bool} where each result has the document
+                id/name/created_at, the text item id and text, and a snippet with the
+                matches wrapped in <mark></mark>
+        """
+        if not self.search_enabled:
+            raise RuntimeError('Full-text search is not available for this database')
+        match = build_match_query(query)
+        if not match:
+            return {'results': [], 'has_more': False}
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+        
+        rows = self.get_connection().execute('''
+            SELECT t.document_id, d.document_name, d.created_at, t.id AS text_item_id, t.text,
+                   snippet(ocr_text_fts, 0, '<mark>', '</mark>', '...', 16) AS snippet,
+                   bm25(ocr_text_fts) AS score
+            FROM ocr_text_fts
+            JOIN ocr_text_item t ON t.id = ocr_text_fts.rowid
+            JOIN ocr_document d ON d.id = t.document_id
+            WHERE ocr_text_fts MATCH ?
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        ''', (match, limit + 1, offset)).fetchall()
+        
+        return {
+            'results': [dict(row) for row in rows[:limit]],
+            'has_more': len(rows) > limit
+        }
+        
+    def register_result_file(self, json_path, visualization_path=None, upload_filename=None, job_id=None):
+        """Add or refresh the index entry of a merge and split result file"""
+        json_filename = os.path.basename(json_path)
+        conn = self.get_connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO result_file (json_filename, base_prefix, upload_filename, job_id,
+                                         json_path, visualization_path, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (json_filename) DO UPDATE SET
+                    upload_filename = COALESCE(excluded.upload_filename, upload_filename),
+                    job_id = COALESCE(excluded.job_id, job_id),
+                    json_path = excluded.json_path,
+                    visualization_path = COALESCE(excluded.visualization_path, visualization_path),
+                    created_at = excluded.created_at
+            ''', (json_filename, result_base_prefix(json_filename), upload_filename, job_id,
+                  json_path, visualization_path, datetime.now().isoformat()))
+        
+    def index_result_files(self, json_dir, only_if_empty=True):
+        """
+        Add existing result files in json_dir to the index
+        
+        Args:
+            json_dir (str): The merge and split output directory
+            only_if_empty (bool): Skip the directory scan if the index already has entries
+            
+        Returns:
+            int: Number of files added
+        """
+        conn = self.get_connection()
+        if only_if_empty and conn.execute('SELECT 1 FROM result_file LIMIT 1').fetchone():
+            return 0
+        if not os.path.isdir(json_dir):
+            return 0
+        
+        rows = []
+        for entry in os.scandir(json_dir):
+            if not entry.name.endswith('_combined_with_spanning.json'):
+                continue
+            viz_path = entry.path.replace('_combined_with_spanning.json', '_visualization_with_spanning.jpg')
+            rows.append((entry.name, result_base_prefix(entry.name), entry.path,
+                         viz_path if os.path.exists(viz_path) else None,
+                         datetime.fromtimestamp(entry.stat().st_mtime).isoformat()))
+        with conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO result_file (json_filename, base_prefix, json_path,
+                                                   visualization_path, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+        print(f"Indexed {len(rows)} result files from {json_dir}")
+        return len(rows)
+        
+    def find_result_files(self, key, limit=20):
+        """
+        Look up result files by JSON filename, upload filename, job id or base prefix
+        
+        Exact matches come first, followed by files whose base prefix starts with key.
+        Every condition is answered from an index, so the lookup does not depend on
+        the number of processed documents.
+        
+        Returns:
+            list: Result file dicts (RESULT_FILE_COLUMNS), best match first
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        rows = self.get_connection().execute(f'''
+            SELECT {', '.join(RESULT_FILE_COLUMNS)} FROM result_file
+            WHERE json_filename = ? OR upload_filename = ? OR job_id = ?
+               OR (base_prefix >= ? AND base_prefix < ?)
+            ORDER BY created_at DESC LIMIT ?
+        ''', (key, key, key, key, key + '\U0010ffff', limit)).fetchall()
+        
+        results = [dict(row) for row in rows]
+        # Stable sort: exact matches before prefix matches, newest first within each
+        results.sort(key=lambda r: key not in (r['json_filename'], r['upload_filename'],
+                                               r['job_id'], r['base_prefix']))
+        return results
+        
+    def list_result_files(self, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        Get one page of indexed result files, newest first
+        
+        Returns:
+            dict: {'files': [...], 'next_cursor': str or None, 'has_more': bool}
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = ''
+        params = []
+        if cursor:
+            where = 'WHERE (created_at, json_filename) < (?, ?)'
+            params.extend(decode_cursor(cursor))
+        rows = self.get_connection().execute(
+            f"SELECT {', '.join(RESULT_FILE_COLUMNS)} FROM result_file {where} "
+            f"ORDER BY created_at DESC, json_filename DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'files': [dict(row) for row in rows],
+            'next_cursor': encode_cursor(rows[-1]['created_at'], rows[-1]['json_filename']) if has_more else None,
+            'has_more': has_more
+        }
+        
     def get_document(self, document_id):
         """Get a document and its text items by ID"""
         conn = self.get_connection()
@@ -131,7 +514,6 @@ class Database:
         cursor.execute('SELECT * FROM ocr_document WHERE id = ?', (document_id,))
         document_row = cursor.fetchone()
         if not document_row:
-            conn.close()
             return None
             
         document = dict(document_row)
@@ -140,5 +522,22 @@ class Database:
         cursor.execute('SELECT * FROM ocr_text_item WHERE document_id = ?', (document_id,))
         document['text_items'] = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
-        return document 
\ No newline at end of file
+        return document 
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument('command', choices=['migrate', 'rebuild-search', 'index-results'])
+    parser.add_argument('--db', default='results.db', help="Path to the SQLite database")
+    parser.add_argument('--output-dir', default=os.path.join('output', 'merge and split'),
+                        help="Merge and split output directory (index-results)")
+    args = parser.parse_args()
+    
+    # Opening the database applies any pending migrations
+    database = Database(args.db)
+    if args.command == 'rebuild-search':
+        database.rebuild_search_index()
+        print(f"Rebuilt full-text search index for {args.db}")
+    elif args.command == 'index-results':
+        database.index_result_files(args.output_dir, only_if_empty=False)
@@ -0,0 +1,286 @@
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Item lists that can be edited, with the id field of their items
+EDITABLE_LISTS = (('cells_with_text', 'cell_id'), ('unassigned_text', 'text_id'))
+
+
+class EditConflictError(Exception):
+    """The edit was made against an older version of the document."""
+
+    def __init__(self, expected_version, current_version):
+        super().__init__(
+            f"Document was changed by another editor (you have version {expected_version}, "
+            f"the current version is {current_version}). Reload it before saving again."
+        )
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class EditableDocument:
+    """
+    A merged result file held in memory while it is being edited.
+
+    Cells and unassigned texts are indexed by id, so applying an edit is a dict
+    lookup. Each accepted save is appended to <file>.patches (one JSON line) instead
+    of rewriting the file; the log is folded back into the JSON file by `compact`.
+    The first line of the log records the size and mtime of the JSON file it
+    applies to, so a log left behind for a file that was since reprocessed is ignored.
+    """
+
+    def __init__(self, json_path):
+        self.json_path = json_path
+        self.log_path = json_path + '.patches'
+        self.lock = threading.Lock()
+        self.pending = 0
+        # Set once the store has evicted and compacted it; edits must go to a fresh copy
+        self.retired = False
+        self._load()
+
+    def _load(self):
+        with open(self.json_path, 'r', encoding='utf-8') as f:
+            self.data = json.load(f)
+        self.signature = _file_signature(self.json_path)
+        self.version = self.data.get('edit_version', 0)
+        self.index = {
+            key: {item[id_field]: item for item in self.data.get(key, [])}
+            for key, id_field in EDITABLE_LISTS
+        }
+        self._replay_log()
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            lines = [line for line in f if line.strip()]
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if header.get('base') != self.signature:
+            print(f"Discarding stale edit log {self.log_path}")
+            os.remove(self.log_path)
+            return
+        for line in lines[1:]:
+            try:
+                patch = json.loads(line)
+            except ValueError:
+                # A torn last line from a crash mid-append
+                break
+            self._apply_patch(patch)
+            self.version = patch['version']
+            self.pending += 1
+        print(f"Replayed {self.pending} edits from {self.log_path}")
+
+    def _apply_patch(self, patch):
+        for key, _ in EDITABLE_LISTS:
+            items = self.index[key]
+            for item_id, text in patch.get(key, []):
+                item = items.get(item_id)
+                if item is not None:
+                    item['text'] = text
+                    item['edited'] = True
+
+    def _append_to_log(self, patch):
+        new_log = not os.path.exists(self.log_path)
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            if new_log:
+                f.write(json.dumps({'base': self.signature}) + '\n')
+            f.write(json.dumps(patch, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def apply(self, changes, expected_version=None):
+        """
+        Apply a /save_edits request body.
+
+        Args:
+            changes (dict): {'cells_with_text': [{'cell_id', 'text'}], 'unassigned_text': [{'text_id', 'text'}]}
+            expected_version (int): Version the editor last saw; None skips the check
+
+        Returns:
+            dict: {'edited': {list name: [ids]}, 'missing': {list name: [ids]}, 'version': int},
+                or None if the document was retired (load it from the store again)
+
+        Raises:
+            EditConflictError: If expected_version is not the current version
+        """
+        with self.lock:
+            if self.retired:
+                return None
+            if expected_version is not None and expected_version != self.version:
+                raise EditConflictError(expected_version, self.version)
+
+            patch = {}
+            edited = {}
+            missing = {}
+            for key, id_field in EDITABLE_LISTS:
+                items = self.index[key]
+                for change in changes.get(key) or []:
+                    item_id = change.get(id_field)
+                    new_text = change.get('text')
+                    if item_id is None or new_text is None:
+                        continue
+                    item = items.get(item_id)
+                    if item is None:
+                        missing.setdefault(key, []).append(item_id)
+                    elif item.get('text', '') != new_text:
+                        patch.setdefault(key, []).append([item_id, new_text])
+                        edited.setdefault(key, []).append(item_id)
+
+            if patch:
+                patch['version'] = self.version + 1
+                self._append_to_log(patch)
+                self._apply_patch(patch)
+                self.version = patch['version']
+                self.pending += 1
+            return {'edited': edited, 'missing': missing, 'version': self.version}
+
+    def snapshot(self):
+        """Copy of the current document (including unsaved edits) that is safe to serialize."""
+        with self.lock:
+            data = dict(self.data, edit_version=self.version)
+            for key, _ in EDITABLE_LISTS:
+                if key in data:
+                    data[key] = [dict(item) for item in data[key]]
+            return data
+
+    def compact(self):
+        """Write the edited document back to the JSON file and drop the patch log."""
+        with self.lock:
+            if not self.pending:
+                return False
+            self.data['edit_version'] = self.version
+            tmp_path = f'{self.json_path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.json_path)
+            self.signature = _file_signature(self.json_path)
+            try:
+                os.remove(self.log_path)
+            except OSError:
+                pass
+            self.pending = 0
+            return True
+
+    def is_stale(self):
+        """True if the JSON file was replaced on disk (e.g. the page was processed again)."""
+        # Under the lock: compact() replaces the file before it records the new signature
+        with self.lock:
+            try:
+                return _file_signature(self.json_path) != self.signature
+            except OSError:
+                return True
+
+
+class DocumentStore:
+    """
+    LRU cache of `EditableDocument`s for /save_edits.
+
+    A document is compacted after `compact_every` saves, when it is evicted and when
+    the process exits, so the JSON file on disk is never more than `compact_every`
+    saves behind the patch log. An evicted document stays reachable until its
+    compaction has finished and is then retired, so the file and log are only ever
+    read and written through one in-memory copy.
+    """
+
+    def __init__(self, max_documents=32, compact_every=50):
+        self.max_documents = max_documents
+        self.compact_every = compact_every
+        self._documents = OrderedDict()
+        # Evicted documents stay here, as (document, compactions running), until their
+        # compaction has finished, so a get() in the meantime reuses them instead of
+        # reading the file and log mid-compaction
+        self._evicting = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, json_path):
+        # Caller holds self._lock
+        document = self._documents.get(json_path)
+        if document is None and json_path in self._evicting:
+            document = self._evicting[json_path][0]
+        return document
+
+    def get(self, json_path):
+        """Return the in-memory document for json_path, loading it on first use."""
+        json_path = os.path.abspath(json_path)
+        with self._lock:
+            document = self._lookup(json_path)
+            if document is not None and document.is_stale():
+                # Replaced on disk; the pending edits were for the old content
+                self._documents.pop(json_path, None)
+                document = None
+            if document is None:
+                document = EditableDocument(json_path)
+            self._documents[json_path] = document
+            self._documents.move_to_end(json_path)
+            evicted = []
+            while len(self._documents) > self.max_documents:
+                old_path, old_document = self._documents.popitem(last=False)
+                running = self._evicting.get(old_path, (None, 0))
+                self._evicting[old_path] = (old_document, running[1] + 1 if running[0] is old_document else 1)
+                evicted.append(old_document)
+        for old_document in evicted:
+            try:
+                old_document.compact()
+            finally:
+                self._finish_eviction(old_document)
+        return document
+
+    def _finish_eviction(self, document):
+        with self._lock:
+            path = document.json_path
+            entry = self._evicting.get(path)
+            if entry is not None and entry[0] is document:
+                if entry[1] > 1:
+                    # Evicted again while compacting; the last compaction finishes the eviction
+                    self._evicting[path] = (document, entry[1] - 1)
+                    return
+                del self._evicting[path]
+            if self._documents.get(path) is not document:
+                # Unreachable now, so the next get() loads the compacted file instead
+                with document.lock:
+                    document.retired = True
+
+    def peek(self, json_path):
+        """Return the document if it is loaded and still current, without loading it."""
+        with self._lock:
+            document = self._lookup(os.path.abspath(json_path))
+        if document is None or document.is_stale():
+            return None
+        return document
+
+    def apply(self, json_path, changes, expected_version=None):
+        """Apply edits to json_path, compacting every `compact_every` saves."""
+        result = None
+        while result is None:
+            # A document retired between get() and apply() is loaded again
+            document = self.get(json_path)
+            result = document.apply(changes, expected_version)
+        if document.pending >= self.compact_every:
+            document.compact()
+        return result
+
+    def compact_all(self):
+        with self._lock:
+            documents = list(self._documents.values())
+        for document in documents:
+            try:
+                document.compact()
+            except Exception as e:
+                print(f"Failed to compact {document.json_path}: {e}")
+
+
+def create_store(max_documents=32, compact_every=50):
+    """Create a store whose pending edits are written back when the process exits."""
+    store = DocumentStore(max_documents=max_documents, compact_every=compact_every)
+    atexit.register(store.compact_all)
+    return store
@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the job queue is at capacity."""
+
+
+class Job:
+    """State of a single queued processing job."""
+
+    def __init__(self, stages, payload, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.payload = payload
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.stages = OrderedDict(
+            (name, {'status': 'pending', 'started_at': None, 'finished_at': None})
+            for name in stages
+        )
+
+    def to_dict(self):
+        """Status payload for the /jobs/<id> endpoint (without the result)."""
+        completed = sum(1 for s in self.stages.values() if s['status'] == 'done')
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'progress': completed / len(self.stages) if self.stages else 1.0,
+            'stages': {name: dict(info) for name, info in self.stages.items()},
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """
+    Bounded job queue served by a fixed pool of worker threads.
+
+    Each job runs `run_job(payload, stage)` where `stage(name)` is a context manager
+    that records per-stage progress and holds a per-stage semaphore, so e.g. only one
+    worker at a time can be inside cell detection while others preprocess.
+    """
+
+    def __init__(self, run_job, stages, max_workers=2, max_queued=16,
+                 stage_concurrency=None, max_finished_jobs=1000):
+        self.run_job = run_job
+        self.stage_names = list(stages)
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        stage_concurrency = stage_concurrency or {}
+        self._stage_semaphores = {
+            name: threading.BoundedSemaphore(stage_concurrency.get(name, max_workers))
+            for name in self.stage_names
+        }
+        self._workers = []
+        self._started = False
+
+    def start(self):
+        """Start the worker threads (idempotent)."""
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._started = True
+
+    def submit(self, payload, job_id=None):
+        """
+        Queue a job and return it, raising QueueFullError when at capacity.
+
+        job_id can be given when the payload needs to know its own id.
+        """
+        self.start()
+        job = Job(self.stage_names, payload, job_id)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise QueueFullError('Job queue is full, try again later')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            'workers': self.max_workers,
+            'queued': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'running': statuses.count('running'),
+            'succeeded': statuses.count('succeeded'),
+            'failed': statuses.count('failed')
+        }
+
+    def _stage_tracker(self, job):
+        @contextmanager
+        def stage(name):
+            info = job.stages.setdefault(name, {'status': 'pending', 'started_at': None, 'finished_at': None})
+            semaphore = self._stage_semaphores.get(name)
+            info['status'] = 'waiting'
+            if semaphore is not None:
+                semaphore.acquire()
+            try:
+                info['status'] = 'running'
+                info['started_at'] = time.time()
+                yield
+                info['status'] = 'done'
+            except Exception:
+                info['status'] = 'failed'
+                raise
+            finally:
+                info['finished_at'] = time.time()
+                if semaphore is not None:
+                    semaphore.release()
+        return stage
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.status = 'running'
+                job.started_at = time.time()
+                job.result = self.run_job(job.payload, self._stage_tracker(job))
+                job.status = 'succeeded'
+            except Exception as e:
+                print(f"Error in job {job.id}: {str(e)}")
+                traceback.print_exc()
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                job.finished_at = time.time()
+                job.payload = None
+                self._queue.task_done()
+                self._evict_finished()
+
+    def _evict_finished(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items()
+                        if job.status in ('succeeded', 'failed')]
+            for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+                del self._jobs[job_id]
+
+
+def parse_stage_concurrency(value):
+    """Parse a 'stage=n,stage=n' string (e.g. from an env var) into a dict."""
+    concurrency = {}
+    for part in (value or '').split(','):
+        if '=' not in part:
+            continue
+        name, count = part.split('=', 1)
+        try:
+            concurrency[name.strip()] = max(int(count), 1)
+        except ValueError:
+            print(f"Ignoring invalid stage concurrency setting: {part}")
+    return concurrency
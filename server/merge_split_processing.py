@@ -1,5 +1,5 @@
 import os
-from Scripts.merge_split import process_document
+from Scripts.merge_split import process_document, process_document_data, process_cell_text_data
 
 def merge_split_processing(cell_json_path, ocr_json_path, preprocessed_image_path):
     """
@@ -70,4 +70,76 @@ def merge_split_processing(cell_json_path, ocr_json_path, preprocessed_image_pat
             
     except Exception as e:
         print(f"Error in merge and split processing: {str(e)}")
-        raise 
\ No newline at end of file
+        raise 
+
+def merge_split_from_data(cell_data, ocr_data, preprocessed_image_path, base_name,
+                          overlap_threshold=0.5, min_overlap_for_spanning=0.1, extra_metadata=None,
+                          render=False):
+    """
+    Merge in-memory cell detection and OCR results without reading intermediate JSON files.
+    
+    Args:
+        cell_data (dict): Cell detection result (same structure as _res.json)
+        ocr_data (list|dict): OCR result (same structure as res_0.json)
+        preprocessed_image_path (str): Path to the preprocessed image for visualization
+        base_name (str): Base name for the output files, e.g. 'processed_scan_res'
+        overlap_threshold (float): Threshold for text-cell overlap
+        min_overlap_for_spanning (float): Threshold for identifying spanning text
+        extra_metadata (dict): Added to the document metadata (e.g. the skew angle)
+        render (bool): Draw the visualization now; by default it is rendered when it is
+            first requested (see server/visualizations.py)
+        
+    Returns:
+        dict: Merged data including 'output_paths' with the JSON and visualization paths
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = os.path.join(project_root, 'output', 'merge and split')
+    
+    merged_data = process_document_data(
+        cell_data,
+        ocr_data,
+        base_name,
+        output_dir=output_dir,
+        image_path=preprocessed_image_path,
+        overlap_threshold=overlap_threshold,
+        min_overlap_for_spanning=min_overlap_for_spanning,
+        extra_metadata=extra_metadata,
+        render=render
+    )
+    
+    if not merged_data or 'output_paths' not in merged_data:
+        raise RuntimeError("Merge and split processing did not return expected output paths")
+    return merged_data
+
+def cell_text_from_data(cell_data, cell_texts, preprocessed_image_path, base_name, extra_metadata=None,
+                        render=False):
+    """
+    Write the merged document for cell-guided OCR, where the text was read per cell.
+    
+    Args:
+        cell_data (dict): Cell detection result (same structure as _res.json)
+        cell_texts (list): One list of text lines per cell, from recognize_cells
+        preprocessed_image_path (str): Path to the preprocessed image for visualization
+        base_name (str): Base name for the output files, e.g. 'processed_scan_res'
+        extra_metadata (dict): Added to the document metadata (e.g. the skew angle)
+        render (bool): Draw the visualization now instead of on first request
+        
+    Returns:
+        dict: Merged data including 'output_paths' with the JSON and visualization paths
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = os.path.join(project_root, 'output', 'merge and split')
+    
+    merged_data = process_cell_text_data(
+        cell_data,
+        cell_texts,
+        base_name,
+        output_dir=output_dir,
+        image_path=preprocessed_image_path,
+        extra_metadata=extra_metadata,
+        render=render
+    )
+    
+    if not merged_data or 'output_paths' not in merged_data:
+        raise RuntimeError("Cell text processing did not return expected output paths")
+    return merged_data
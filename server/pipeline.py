@@ -0,0 +1,543 @@
+import json
+import os
+import cv2
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from Scripts.image_preprocess import preprocess_image, DEFAULT_ANALYSIS_MAX_SIDE
+from Scripts.preprocess_pool import preprocess_many
+from Scripts.cell_processing import detect_cells, detect_cells_batch, save_cell_detection
+from Scripts.ai_processing import run_structure, run_structure_batch, run_structure_tiled, save_structure_output
+from Scripts.tiled_ocr import DEFAULT_TILE_OVERLAP
+from Scripts.cell_ocr import recognize_cells
+from server.merge_split_processing import merge_split_from_data, cell_text_from_data
+from server.result_sink import AsyncResultSink
+from server.result_cache import ResultCache, cache_key, hash_file
+from Scripts.instrumentation import span, trace_request
+
+# Stage names in the order they run
+PIPELINE_STAGES = ['preprocess', 'cell_detection', 'ocr', 'merge_split']
+
+# Keys process_document_data adds to the merged result that are not part of the JSON file
+_RESULT_ONLY_KEYS = ('output_paths', 'visualization_path')
+
+# Intermediate outputs (cell detection JSON/image, PP-Structure res_0.json) are only
+# written when PERSIST_STAGE_OUTPUTS=1, and then in the background
+stage_output_sink = AsyncResultSink(enabled=os.environ.get('PERSIST_STAGE_OUTPUTS', '0') == '1')
+
+# 'structure': PP-Structure on the page, then text is matched to the cells (merge/split).
+# 'cells': only the text inside the detected cells is read, from one crop per cell.
+OCR_MODES = ('structure', 'cells')
+
+# Parameters that influence the results; they are part of every cache key
+PIPELINE_PARAMS = {
+    'gamma': 1.2,
+    'min_area_ratio': 0.3,
+    # Longest side of the downscaled copy used for document corner detection (0 = full size)
+    'analysis_max_side': int(os.environ.get('PREPROCESS_ANALYSIS_MAX_SIDE', DEFAULT_ANALYSIS_MAX_SIDE)),
+    # Correct small rotations after dewarping; angles below the tolerance (degrees) are left alone
+    'deskew': os.environ.get('PREPROCESS_DESKEW', '0') == '1',
+    'deskew_tolerance': float(os.environ.get('PREPROCESS_DESKEW_TOLERANCE', 0.2)),
+    'detection_threshold': 0.3,
+    'ocr_mode': os.environ.get('OCR_MODE', 'structure'),
+    # Pages with a side longer than this run PP-Structure on overlapping tiles (0 = never)
+    'ocr_tile_size': int(os.environ.get('OCR_TILE_SIZE', 0)),
+    'ocr_tile_overlap': int(os.environ.get('OCR_TILE_OVERLAP', DEFAULT_TILE_OVERLAP)),
+    'overlap_threshold': 0.5,
+    'min_overlap_for_spanning': 0.1
+}
+
+if PIPELINE_PARAMS['ocr_mode'] not in OCR_MODES:
+    raise ValueError(f"OCR_MODE must be one of {', '.join(OCR_MODES)}")
+
+# Worker processes for preprocessing batch uploads (0 = threads in this process)
+PREPROCESS_PROCESSES = int(os.environ.get('PREPROCESS_PROCESSES', 0))
+
+# Worker processes for the tiles of tiled OCR, each with its own PP-Structure (0 = shared model)
+OCR_TILE_WORKERS = int(os.environ.get('OCR_TILE_WORKERS', 0))
+
+_project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+result_cache = ResultCache(
+    os.environ.get('RESULT_CACHE_DIR', os.path.join(_project_root, 'output', 'cache')),
+    max_bytes=int(float(os.environ.get('RESULT_CACHE_MAX_MB', 512)) * 1024 * 1024),
+    enabled=os.environ.get('RESULT_CACHE', '1') == '1'
+)
+
+
+@contextmanager
+def _no_stage_tracking(name):
+    yield
+
+
+def _timed_stages(stage):
+    """Wrap a stage tracker so each stage is also recorded as a 'stage.<name>' span."""
+    @contextmanager
+    def timed(name):
+        with stage(name), span(f'stage.{name}'):
+            yield
+    return timed
+
+
+def pipeline_cache_keys(image_key, params):
+    """Cache key per stage; each key only covers the inputs that stage depends on."""
+    preprocess = cache_key('preprocess', image_key, params['gamma'], params['min_area_ratio'],
+                           params['analysis_max_side'], params['deskew'], params['deskew_tolerance'])
+    cells = cache_key('cells', preprocess, params['detection_threshold'])
+    if params['ocr_mode'] == 'cells':
+        # Text per cell depends on the cell boxes
+        ocr = cache_key('cell_ocr', cells)
+    else:
+        ocr = cache_key('ocr', preprocess, params['ocr_tile_size'], params['ocr_tile_overlap'])
+    merge = cache_key('merge', cells, ocr, params['overlap_threshold'], params['min_overlap_for_spanning'])
+    return {'preprocess': preprocess, 'cells': cells, 'ocr': ocr, 'merge': merge}
+
+
+def _load_json_document(json_path):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Reads a merged document back for a cached merge result. The server replaces it with a
+# loader that goes through the edit store, so edits saved since processing are included.
+_document_loader = _load_json_document
+
+
+def set_document_loader(loader):
+    """Set the function (json_path -> document) used to read cached merge results."""
+    global _document_loader
+    _document_loader = loader
+
+
+def _merge_cache_entry(merged_data):
+    # Only the paths and statistics are cached; the cells are read from the (possibly
+    # edited) JSON file on a hit
+    return {'output_paths': merged_data['output_paths'], 'metadata': merged_data.get('metadata', {})}
+
+
+def _cached_merge(keys):
+    """Return the merged document of a cached merge result if its output files still exist."""
+    entry = result_cache.get('merge', keys['merge'])
+    if entry is None:
+        return None
+    paths = entry.get('output_paths', {})
+    # The visualization is rendered on first request, so the page it is drawn on is enough
+    drawable = any(path and os.path.exists(path) for path in (paths.get('visualization'), paths.get('image')))
+    if paths.get('json') and os.path.exists(paths['json']) and paths.get('visualization') and drawable:
+        try:
+            return dict(_document_loader(paths['json']), output_paths=paths)
+        except (OSError, ValueError) as e:
+            print(f"Could not read cached merge result {paths['json']}: {e}")
+    result_cache.invalidate('merge', keys['merge'])
+    return None
+
+
+# Output files carry the start of their stage's cache key, so runs with other parameters
+# write next to them instead of over files that older cache entries still point to
+_KEY_PREFIX_LENGTH = 12
+
+
+def _preprocessed_path(output_root, filename, keys):
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(output_root, 'preprocessed',
+                        f"processed_{stem}_{keys['preprocess'][:_KEY_PREFIX_LENGTH]}{ext}")
+
+
+def _merged_base_name(filename, keys):
+    return f"processed_{filename.split('.')[0]}_{keys['merge'][:_KEY_PREFIX_LENGTH]}_res"
+
+
+def _preprocess_kwargs(params):
+    return {name: params[name] for name in
+            ('gamma', 'min_area_ratio', 'analysis_max_side', 'deskew', 'deskew_tolerance')}
+
+
+def _cached_preprocess(keys, need_image=True):
+    """Return (image or None, path, info) of an earlier preprocessed image, or None on a miss."""
+    entry = result_cache.get('preprocess', keys['preprocess'])
+    if entry and os.path.exists(entry['path']):
+        if not need_image:
+            return None, entry['path'], entry.get('info', {})
+        image = cv2.imread(entry['path'])
+        if image is not None:
+            return image, entry['path'], entry.get('info', {})
+    return None
+
+
+def _preprocess(filepath, filename, output_root, keys, params, need_image=True):
+    """
+    Preprocess an upload, reusing an earlier preprocessed image of the same content.
+
+    Returns:
+        tuple: (image or None when not needed and cached, preprocessed_path, info), where
+            info holds preprocessing metadata such as the skew angle
+    """
+    cached = _cached_preprocess(keys, need_image)
+    if cached is not None:
+        return cached
+
+    preprocessed_path = _preprocessed_path(output_root, filename, keys)
+    info = {}
+    image = preprocess_image(filepath, preprocessed_path, info=info, **_preprocess_kwargs(params))
+    result_cache.put('preprocess', keys['preprocess'], {'path': preprocessed_path, 'info': info})
+    return image, preprocessed_path, info
+
+
+def _use_tiled_ocr(image, params):
+    tile_size = params['ocr_tile_size']
+    return bool(tile_size) and max(image.shape[:2]) > tile_size
+
+
+def _run_structure(image, params):
+    """PP-Structure on the whole page, or on tiles for pages larger than ocr_tile_size."""
+    if _use_tiled_ocr(image, params):
+        return run_structure_tiled(image, params['ocr_tile_size'], params['ocr_tile_overlap'],
+                                   workers=OCR_TILE_WORKERS)
+    return run_structure(image)
+
+
+def _merge_page(filename, preprocessed_path, cell_data, regions, keys, params, preprocess_info=None):
+    """Build the merged document; in 'cells' mode `regions` is the text per cell."""
+    base_name = _merged_base_name(filename, keys)
+    if params['ocr_mode'] == 'cells':
+        merged_data = cell_text_from_data(cell_data, regions, preprocessed_path, base_name,
+                                          extra_metadata=preprocess_info)
+        result_cache.put('merge', keys['merge'], _merge_cache_entry(merged_data))
+        return merged_data
+
+    ocr_data = {'input_path': preprocessed_path, 'results': regions}
+    merged_data = merge_split_from_data(
+        cell_data, ocr_data, preprocessed_path, base_name,
+        overlap_threshold=params['overlap_threshold'],
+        min_overlap_for_spanning=params['min_overlap_for_spanning'],
+        extra_metadata=preprocess_info
+    )
+    result_cache.put('merge', keys['merge'], _merge_cache_entry(merged_data))
+    return merged_data
+
+
+def run_document_pipeline(filepath, filename, output_root, stage=None, image_key=None, params=None,
+                          timing=False):
+    """
+    Run preprocess -> cell detection -> PP-Structure -> merge/split on an uploaded image.
+
+    Stage results are cached by image content and parameters, so a stage only runs
+    when one of its inputs changed.
+
+    Args:
+        filepath (str): Path to the uploaded image
+        filename (str): Secure filename of the upload (used for output names and URLs)
+        output_root (str): Root output directory
+        stage (callable): Optional context manager factory called with each stage name,
+            used by the job queue to report progress and limit per-stage concurrency
+        image_key (str): SHA-256 of the image bytes, computed from the file if omitted
+        params (dict): Overrides for PIPELINE_PARAMS
+        timing (bool): Add a 'timing' block with per-step durations, image size and peak RSS
+
+    Returns:
+        dict: Response payload with the image URLs, edit URL and merged JSON data
+    """
+    with trace_request() as trace, span('pipeline.total'):
+        payload = _run_document_stages(filepath, filename, output_root,
+                                       _timed_stages(stage or _no_stage_tracking), image_key, params)
+    if timing:
+        payload = dict(payload, timing=trace.to_dict())
+    return payload
+
+
+def _run_document_stages(filepath, filename, output_root, stage, image_key, params):
+    params = dict(PIPELINE_PARAMS, **(params or {}))
+    keys = pipeline_cache_keys(image_key or hash_file(filepath), params)
+
+    merged_data = _cached_merge(keys)
+    if merged_data is not None:
+        # Same image and parameters as an earlier run, every stage is skipped
+        for name in PIPELINE_STAGES:
+            with stage(name):
+                pass
+        return build_result_payload(filename, merged_data)
+
+    cell_data = result_cache.get('cells', keys['cells'])
+    regions = result_cache.get('ocr', keys['ocr'])
+
+    # Step 1: Process the image (kept in memory for the next stages)
+    with stage('preprocess'):
+        preprocessed_image, preprocessed_path, preprocess_info = _preprocess(
+            filepath, filename, output_root, keys, params,
+            need_image=cell_data is None or regions is None
+        )
+
+    # Step 2: Cell Detection
+    with stage('cell_detection'):
+        if cell_data is None:
+            cell_data, cell_res = detect_cells(preprocessed_image, input_path=preprocessed_path,
+                                               threshold=params['detection_threshold'])
+            result_cache.put('cells', keys['cells'], cell_data)
+            if cell_res is not None:
+                stage_output_sink.submit(save_cell_detection, cell_res, output_root)
+
+    # Step 3: AI Model Processing
+    with stage('ocr'):
+        if regions is None and params['ocr_mode'] == 'cells':
+            regions = recognize_cells(preprocessed_image, cell_data)
+            result_cache.put('ocr', keys['ocr'], regions)
+        elif regions is None:
+            regions, structure_res = _run_structure(preprocessed_image, params)
+            result_cache.put('ocr', keys['ocr'], regions)
+            stage_output_sink.submit(save_structure_output, structure_res, preprocessed_image,
+                                     preprocessed_path, os.path.join(output_root, 'ai-model'))
+
+    # Step 4: Merge and Split Processing
+    with stage('merge_split'):
+        merged_data = _merge_page(filename, preprocessed_path, cell_data, regions, keys, params,
+                                  preprocess_info)
+
+    return build_result_payload(filename, merged_data)
+
+
+def build_result_payload(filename, merged_data):
+    """Build the /process_image response for a merged document."""
+    merged_json_path = merged_data['output_paths']['json']
+    merged_viz_path = merged_data['output_paths']['visualization']
+    if not merged_viz_path:
+        raise RuntimeError('Failed to generate visualization')
+
+    # The merged data is already in memory, no need to read the JSON file back
+    json_data = {k: v for k, v in merged_data.items() if k not in _RESULT_ONLY_KEYS}
+
+    # Construct the edit URL
+    json_filename = os.path.basename(merged_json_path)
+    edit_url = f'/edit_results/{json_filename}'
+
+    # Get the visualization filename
+    viz_filename = os.path.basename(merged_viz_path)
+
+    return {
+        'status': 'success',
+        'original_path': f'/uploads/{filename}',
+        # Rendered when first requested (server/visualizations.py)
+        'output_image': f'/output/merge and split/{viz_filename}',
+        'output_image_preview': f'/output/merge and split/{viz_filename}?size=preview',
+        'edit_url': edit_url,
+        'json_url': f'/json/{json_filename}',
+        'stream_url': f'/json/{json_filename}?format=ndjson',
+        'json_data': json_data  # Include the JSON data directly in the response
+    }
+
+
+def _preprocess_pages(pages, output_root, params, thread_pool, processes=0):
+    """
+    Preprocess a chunk of batch pages, returning (image, path, info) or an exception per page.
+
+    With `processes` the cache misses go to the shared-memory process pool
+    (`preprocess_many`), otherwise every page runs `_preprocess` on the thread pool.
+    """
+    need_image = [page['cell_data'] is None or page['regions'] is None for page in pages]
+    if not processes:
+        futures = [
+            thread_pool.submit(_preprocess, page['filepath'], page['filename'], output_root,
+                               page['keys'], params, need)
+            for page, need in zip(pages, need_image)
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    results = [None] * len(pages)
+    misses = []
+    for i, (page, need) in enumerate(zip(pages, need_image)):
+        try:
+            results[i] = _cached_preprocess(page['keys'], need)
+        except Exception as e:
+            results[i] = e
+        if results[i] is None:
+            misses.append(i)
+
+    output_paths = [_preprocessed_path(output_root, pages[i]['filename'], pages[i]['keys']) for i in misses]
+    infos = [{} for _ in misses]
+    images = preprocess_many(
+        [pages[i]['filepath'] for i in misses], output_paths, infos=infos,
+        workers=processes, **_preprocess_kwargs(params)
+    ) if misses else []
+    for i, path, image, info in zip(misses, output_paths, images, infos):
+        if isinstance(image, Exception):
+            results[i] = image
+            continue
+        result_cache.put('preprocess', pages[i]['keys']['preprocess'], {'path': path, 'info': info})
+        results[i] = (image, path, info)
+    return results
+
+
+def _run_or_isolate(batch_func, single_func, pages):
+    """
+    Run a model on a whole batch of pages; if the batch fails, rerun page by page so
+    one bad page only fails itself. Returns a result or an exception per page.
+    """
+    try:
+        return batch_func(pages)
+    except Exception as e:
+        print(f"Batch inference failed ({str(e)}), retrying page by page")
+    results = []
+    for page in pages:
+        try:
+            results.append(single_func(page))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def run_batch_pipeline(uploads, output_root, batch_size=4, preprocess_workers=4, merge_workers=4,
+                       params=None, preprocess_processes=None):
+    """
+    Process several uploaded pages, yielding each page's result as soon as it is done.
+
+    Pages are handled in chunks of `batch_size`: the chunk is preprocessed in parallel,
+    cell detection and PP-Structure run once per chunk, and merge/split fans out per
+    page on a thread pool while the next chunk goes through the models. Pages (or
+    stages of pages) found in the result cache skip the corresponding work.
+
+    Args:
+        uploads (list): (filepath, filename) or (filepath, filename, image_key) tuples
+        output_root (str): Root output directory
+        batch_size (int): Pages per model batch
+        preprocess_workers (int): Threads used for preprocessing
+        merge_workers (int): Threads used for merge/split
+        params (dict): Overrides for PIPELINE_PARAMS
+        preprocess_processes (int): Preprocess on this many worker processes instead of
+            threads (default PREPROCESS_PROCESSES, 0 uses the thread pool)
+
+    Yields:
+        dict: Per-page payload with 'index' and 'filename', plus the /process_image
+            result on success or 'status': 'error' and 'error' on failure
+    """
+    batch_size = max(int(batch_size), 1)
+    params = dict(PIPELINE_PARAMS, **(params or {}))
+    if preprocess_processes is None:
+        preprocess_processes = PREPROCESS_PROCESSES
+
+    def page_error(index, filename, error):
+        return {'index': index, 'filename': filename, 'status': 'error', 'error': str(error)}
+
+    def page_result(index, filename, merged_data):
+        return dict(build_result_payload(filename, merged_data), index=index, filename=filename)
+
+    def finished_merges(pending, wait_for_all=False):
+        futures = as_completed(list(pending)) if wait_for_all else [f for f in list(pending) if f.done()]
+        for future in futures:
+            index, filename = pending.pop(future)
+            try:
+                yield page_result(index, filename, future.result())
+            except Exception as e:
+                yield page_error(index, filename, e)
+
+    with ThreadPoolExecutor(max_workers=preprocess_workers) as preprocess_pool, \
+            ThreadPoolExecutor(max_workers=merge_workers) as merge_pool:
+        pending_merges = {}
+
+        for start in range(0, len(uploads), batch_size):
+            # page: dict with index, filename, keys, cached stage results, image and path
+            pages = []
+            for index, upload in enumerate(uploads[start:start + batch_size], start=start):
+                filepath, filename = upload[0], upload[1]
+                try:
+                    image_key = upload[2] if len(upload) > 2 and upload[2] else hash_file(filepath)
+                    keys = pipeline_cache_keys(image_key, params)
+                    merged_data = _cached_merge(keys)
+                    if merged_data is not None:
+                        yield page_result(index, filename, merged_data)
+                        continue
+                except Exception as e:
+                    yield page_error(index, filename, e)
+                    continue
+                pages.append({
+                    'index': index, 'filename': filename, 'filepath': filepath, 'keys': keys,
+                    'cell_data': result_cache.get('cells', keys['cells']),
+                    'regions': result_cache.get('ocr', keys['ocr'])
+                })
+
+            # Preprocess the chunk in parallel (OpenCV releases the GIL)
+            ready_pages = []
+            for page, result in zip(pages, _preprocess_pages(pages, output_root, params, preprocess_pool,
+                                                             preprocess_processes)):
+                if isinstance(result, Exception):
+                    yield page_error(page['index'], page['filename'], result)
+                    continue
+                page['image'], page['path'], page['preprocess_info'] = result
+                ready_pages.append(page)
+
+            # Cell detection and OCR in model-level batches, only for cache misses
+            detect_pages = [p for p in ready_pages if p['cell_data'] is None]
+            cell_results = _run_or_isolate(
+                lambda batch: detect_cells_batch([p['image'] for p in batch], [p['path'] for p in batch],
+                                                 threshold=params['detection_threshold'],
+                                                 batch_size=batch_size),
+                lambda page: detect_cells(page['image'], input_path=page['path'],
+                                          threshold=params['detection_threshold']),
+                detect_pages
+            ) if detect_pages else []
+            failed = {}
+            for page, result in zip(detect_pages, cell_results):
+                if isinstance(result, Exception):
+                    failed[page['index']] = result
+                    continue
+                page['cell_data'], cell_res = result
+                result_cache.put('cells', page['keys']['cells'], page['cell_data'])
+                if cell_res is not None:
+                    stage_output_sink.submit(save_cell_detection, cell_res, output_root)
+
+            if params['ocr_mode'] == 'cells':
+                # Text is read from the crops of the cells found above, page by page
+                for page in ready_pages:
+                    if page['regions'] is not None or page['cell_data'] is None:
+                        continue
+                    try:
+                        page['regions'] = recognize_cells(page['image'], page['cell_data'])
+                        result_cache.put('ocr', page['keys']['ocr'], page['regions'])
+                    except Exception as e:
+                        failed.setdefault(page['index'], e)
+                ocr_pages, structure_results = [], []
+            else:
+                # Pages over the tile size run tiled, one at a time
+                ocr_pages = [p for p in ready_pages
+                             if p['regions'] is None and not _use_tiled_ocr(p['image'], params)]
+                structure_results = list(_run_or_isolate(
+                    lambda batch: run_structure_batch([p['image'] for p in batch]),
+                    lambda page: run_structure(page['image']),
+                    ocr_pages
+                )) if ocr_pages else []
+                tiled_pages = [p for p in ready_pages
+                               if p['regions'] is None and _use_tiled_ocr(p['image'], params)]
+                for page in tiled_pages:
+                    try:
+                        structure_results.append(_run_structure(page['image'], params))
+                    except Exception as e:
+                        structure_results.append(e)
+                ocr_pages += tiled_pages
+
+            for page, result in zip(ocr_pages, structure_results):
+                if isinstance(result, Exception):
+                    failed.setdefault(page['index'], result)
+                    continue
+                page['regions'], structure_res = result
+                result_cache.put('ocr', page['keys']['ocr'], page['regions'])
+                stage_output_sink.submit(save_structure_output, structure_res, page['image'],
+                                         page['path'], os.path.join(output_root, 'ai-model'))
+
+            for page in ready_pages:
+                if page['index'] in failed or page['cell_data'] is None or page['regions'] is None:
+                    yield page_error(page['index'], page['filename'],
+                                     failed.get(page['index'], 'Model inference returned no result'))
+                    continue
+                # Merge/split fans out per page
+                future = merge_pool.submit(_merge_page, page['filename'], page['path'], page['cell_data'],
+                                           page['regions'], page['keys'], params, page['preprocess_info'])
+                pending_merges[future] = (page['index'], page['filename'])
+                page['image'] = None
+
+            # Stream pages whose merge already finished while the next chunk is processed
+            yield from finished_merges(pending_merges)
+
+        yield from finished_merges(pending_merges, wait_for_all=True)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def hash_bytes(data):
+    """SHA-256 hex digest of raw bytes (used to content-address uploaded images)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    """Combine hashes and parameters into a single stable key."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded, content-addressed on-disk cache of stage results.
+
+    Entries are JSON files stored as <cache_dir>/<stage>/<key[:2]>/<key>.json. An
+    in-memory LRU index of every entry is built once at start-up, so lookups, hits and
+    evictions never have to list the cache directory.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> size, least recently used first
+        self._total_bytes = 0
+        self._counters = {}
+        self._evictions = 0
+        if enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_index()
+
+    def _load_index(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._total_bytes += size
+
+    def _path(self, stage, key):
+        return os.path.join(self.cache_dir, stage, key[:2], f'{key}.json')
+
+    def _count(self, stage, outcome):
+        counters = self._counters.setdefault(stage, {'hits': 0, 'misses': 0})
+        counters[outcome] += 1
+
+    def get(self, stage, key):
+        """Return the cached value for (stage, key), or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._path(stage, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._count(stage, 'misses')
+                if path in self._entries:
+                    self._total_bytes -= self._entries.pop(path)
+            return None
+
+        with self._lock:
+            self._count(stage, 'hits')
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        try:
+            os.utime(path)  # keeps the LRU order across restarts
+        except OSError:
+            pass
+        return value
+
+    def invalidate(self, stage, key):
+        """Drop an entry, e.g. when the files it points to no longer exist."""
+        path = self._path(stage, key)
+        with self._lock:
+            if path in self._entries:
+                self._total_bytes -= self._entries.pop(path)
+            # The lookup was counted as a hit, but the entry turned out to be unusable
+            counters = self._counters.get(stage)
+            if counters and counters['hits'] > 0:
+                counters['hits'] -= 1
+                counters['misses'] += 1
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def put(self, stage, key, value):
+        """Store a JSON serializable value and evict least recently used entries if needed."""
+        if not self.enabled:
+            return
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            if path in self._entries:
+                self._total_bytes -= self._entries.pop(path)
+            self._entries[path] = size
+            self._total_bytes += size
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                self._evictions += 1
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stages = {stage: dict(counts) for stage, counts in self._counters.items()}
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self._evictions,
+                'hits': sum(c['hits'] for c in stages.values()),
+                'misses': sum(c['misses'] for c in stages.values()),
+                'stages': stages
+            }
@@ -0,0 +1,55 @@
+import queue
+import threading
+import traceback
+
+
+class AsyncResultSink:
+    """
+    Background writer for intermediate stage outputs.
+
+    The pipeline hands stage results from one stage to the next in memory; when
+    persistence is enabled, writing them to disk (cell detection JSON/image,
+    PP-Structure res_0.json and visualization) is queued here so it never sits on
+    the request path.
+    """
+
+    def __init__(self, enabled=True, max_pending=64):
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) to run on the writer thread (no-op when disabled)."""
+        if not self.enabled:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            # Persistence is best effort, never block a request on it
+            print(f"Result sink is full, dropping write: {getattr(func, '__name__', func)}")
+            return False
+        return True
+
+    def flush(self):
+        """Block until every queued write has finished."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='result-sink', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print(f"Error writing stage output in {getattr(func, '__name__', func)}: {str(e)}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,45 @@
+import json
+
+# Lists of a merged document that are streamed one item per line, with the line type
+STREAMED_LISTS = (('cells_with_text', 'cell'), ('unassigned_text', 'text'))
+
+
+def _line(obj):
+    return json.dumps(obj, ensure_ascii=False) + '\n'
+
+
+def iter_document_ndjson(json_data):
+    """
+    Yield a merged document as NDJSON lines.
+
+    The first line ({"type": "header", ...}) holds every top-level field except the
+    item lists (metadata, image_path). It is followed by one line per cell
+    ({"type": "cell", "item": {...}}) and per unassigned text ({"type": "text",
+    "item": {...}}), and a final {"type": "end", ...} line with the item counts, so
+    a client can tell a complete stream from a dropped connection.
+    """
+    list_keys = [key for key, _ in STREAMED_LISTS]
+    header = {key: value for key, value in json_data.items() if key not in list_keys}
+    yield _line(dict(header, type='header'))
+
+    counts = {}
+    for key, item_type in STREAMED_LISTS:
+        items = json_data.get(key) or []
+        for item in items:
+            yield _line({'type': item_type, 'item': item})
+        counts[key] = len(items)
+    yield _line(dict(counts, type='end'))
+
+
+def metadata_only(result):
+    """
+    Drop the embedded json_data from a /process_image result.
+
+    The client gets the document statistics and the URLs and then fetches the cells
+    from json_url / stream_url, so the full document is never serialized into the
+    job result.
+    """
+    json_data = result.get('json_data') or {}
+    slim = {key: value for key, value in result.items() if key != 'json_data'}
+    slim['metadata'] = json_data.get('metadata', {})
+    return slim
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context
 import os
 from werkzeug.utils import secure_filename
 import traceback
@@ -7,20 +7,26 @@ import json
 import numpy as np
 import collections.abc
 import cv2
+import uuid
+import multiprocessing
 
 # Add the parent directory to Python path
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
 # Import Scripts
-from Scripts.image_preprocess import preprocess_image
-from Scripts.cell_processing import run_cell_detection
-from Scripts.ai_processing import ai_processing
-from Scripts.IQA import ImageQualityAssessor
+from Scripts.model_registry import registry, IQA_MODEL
+from Scripts.instrumentation import render_prometheus
 
 # Import local modules with proper package paths
-from server.merge_split_processing import merge_split_processing
-from server.database import Database
+from server.database import Database, DEFAULT_PAGE_SIZE
+from server.jobs import JobQueue, QueueFullError, parse_stage_concurrency
+from server.pipeline import (run_document_pipeline, run_batch_pipeline, result_cache, PIPELINE_STAGES,
+                             set_document_loader)
+from server.result_cache import hash_bytes
+from server.result_stream import iter_document_ndjson, metadata_only
+from server.edit_store import create_store, EditConflictError
+from server.visualizations import VisualizationCache, DEFAULT_PREVIEW_MAX_SIDE
 
 # Initialize database
 db = Database()
@@ -29,6 +35,11 @@ app = Flask(__name__,
             static_folder='../Static',
             template_folder='../template')
 
+@app.teardown_appcontext
+def close_db_connection(exception=None):
+    # Each request runs on its own thread; close its SQLite connection when it ends
+    db.close_connection()
+
 # Configure upload folder and create necessary directories
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, 'uploads')
@@ -53,6 +64,137 @@ for directory in directories:
     os.makedirs(directory, exist_ok=True)
     print(f"Ensured directory exists: {directory}")
 
+# Results written before the result file index existed are added once
+MERGE_OUTPUT_DIR = os.path.join(OUTPUT_ROOT, 'merge and split')
+db.index_result_files(MERGE_OUTPUT_DIR, only_if_empty=True)
+
+# Optionally load and warm the models at start-up instead of on the first request.
+# PRELOAD_MODELS=all loads every registered model, or give a comma separated list
+# of names (cell_detection, pp_structure, image_quality).
+# Preprocessing pool workers re-import the main module; only the server process loads models.
+preload_models = os.environ.get('PRELOAD_MODELS', '').strip()
+if preload_models and multiprocessing.parent_process() is None:
+    if preload_models.lower() == 'all':
+        registry.warm_up()
+    else:
+        registry.warm_up([name.strip() for name in preload_models.split(',') if name.strip()])
+
+def run_processing_job(payload, stage):
+    """Run the document pipeline for a queued /process_image upload."""
+    result = run_document_pipeline(payload['filepath'], payload['filename'], OUTPUT_ROOT,
+                                   stage=stage, image_key=payload['image_key'],
+                                   timing=payload.get('timing', False))
+    index_result(result, payload['filename'], payload.get('job_id'))
+    if payload.get('response') == 'metadata':
+        result = metadata_only(result)
+    return result
+
+def index_result(result, filename, job_id=None):
+    """Record the output files of a processed upload in the result file index."""
+    json_filename = os.path.basename(result['json_url'])
+    viz_filename = os.path.basename(result['output_image'])
+    db.register_result_file(os.path.join(MERGE_OUTPUT_DIR, json_filename),
+                            os.path.join(MERGE_OUTPUT_DIR, viz_filename),
+                            upload_filename=filename, job_id=job_id)
+
+def response_mode():
+    """
+    Read the response mode of a processing request.
+
+    'full' (default) embeds the merged JSON in the result, 'metadata' returns only
+    the document statistics and the json_url/stream_url to fetch the cells from.
+    """
+    mode = request.values.get('response', 'full').lower()
+    if mode not in ('full', 'metadata'):
+        raise ValueError("response must be 'full' or 'metadata'")
+    return mode
+
+# /assess_quality mode when the request does not pass one: 'tiered' skips EasyOCR when
+# resolution/blur/brightness already fail and samples the image otherwise, 'full' always
+# runs OCR on the whole image
+IQA_MODE = os.environ.get('IQA_MODE', 'tiered')
+
+def send_merged_json(json_path):
+    """
+    Send a merged JSON file as is, or as NDJSON (one line per cell and unassigned
+    text) with ?format=ndjson so the browser can render large documents incrementally.
+    Documents that are being edited are served from memory, including unsaved edits.
+    """
+    document = edit_store.peek(json_path)
+    json_data = document.snapshot() if document is not None else None
+    
+    if request.args.get('format') == 'ndjson':
+        if json_data is None:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                json_data = json.load(f)
+        response = Response(stream_with_context(iter_document_ndjson(json_data)),
+                            mimetype='application/x-ndjson')
+    elif json_data is not None:
+        response = jsonify(json_data)
+    else:
+        # The file is already JSON, no need to parse and re-serialize it
+        return send_file(json_path, mimetype='application/json')
+    response.headers['X-Edit-Version'] = str(json_data.get('edit_version', 0))
+    return response
+
+def save_upload(file):
+    """
+    Save an uploaded file under a content-addressed name.
+
+    The name is prefixed with the start of the SHA-256 of the image bytes, so two
+    different files called scan.jpg no longer overwrite each other's outputs.
+
+    Returns:
+        tuple: (filepath, filename, image_key)
+    """
+    data = file.read()
+    image_key = hash_bytes(data)
+    filename = f'{image_key[:12]}_{secure_filename(file.filename)}'
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(filepath):
+        with open(filepath, 'wb') as f:
+            f.write(data)
+    return filepath, filename, image_key
+
+# Bounded job queue for /process_image. JOB_STAGE_CONCURRENCY limits how many workers
+# can be inside a stage at once, e.g. "preprocess=4,cell_detection=1,ocr=1".
+job_queue = JobQueue(
+    run_processing_job,
+    PIPELINE_STAGES,
+    max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+    max_queued=int(os.environ.get('JOB_QUEUE_SIZE', 16)),
+    stage_concurrency=parse_stage_concurrency(
+        os.environ.get('JOB_STAGE_CONCURRENCY', 'cell_detection=1,ocr=1'))
+)
+
+# Documents being edited are kept in memory; saves go to an append-only patch log that
+# is written back to the JSON file every EDIT_COMPACT_EVERY saves
+edit_store = create_store(
+    max_documents=int(os.environ.get('EDIT_STORE_SIZE', 32)),
+    compact_every=int(os.environ.get('EDIT_COMPACT_EVERY', 50))
+)
+
+def load_merged_document(json_path):
+    """The merged document at json_path, including edits that are not compacted into the file yet"""
+    document = edit_store.peek(json_path)
+    if document is None and os.path.exists(json_path + '.patches'):
+        # Edits saved by an earlier process that were never compacted
+        document = edit_store.get(json_path)
+    if document is not None:
+        return document.snapshot()
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Cached /process_image results are read back through the edit store
+set_document_loader(load_merged_document)
+
+# Merge/split visualizations are drawn when first requested and then served from disk;
+# ?size=preview gives a copy downscaled to VISUALIZATION_PREVIEW_MAX_SIDE pixels
+visualizations = VisualizationCache(
+    MERGE_OUTPUT_DIR,
+    preview_max_side=int(os.environ.get('VISUALIZATION_PREVIEW_MAX_SIDE', DEFAULT_PREVIEW_MAX_SIDE))
+)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -66,7 +208,15 @@ def uploaded_file(filename):
 
 @app.route('/output/<path:filename>')
 def output_file(filename):
-    """Serve any file from the output directory."""
+    """Serve any file from the output directory, rendering merge/split visualizations on demand."""
+    directory, name = os.path.split(filename)
+    if directory == 'merge and split' and visualizations.is_visualization(name):
+        if request.args.get('size') == 'preview':
+            name = visualizations.preview_name(name)
+        path = visualizations.get(name)
+        if path is None:
+            return jsonify({'error': 'Visualization not available'}), 404
+        return send_file(path, mimetype='image/jpeg')
     return send_file(os.path.join(OUTPUT_ROOT, filename))
 
 @app.route('/json/<path:filename>')
@@ -77,10 +227,7 @@ def serve_json(filename):
         if not os.path.exists(json_path):
             return jsonify({'error': 'JSON file not found'}), 404
             
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        return jsonify(data)
+        return send_merged_json(json_path)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -96,56 +243,85 @@ def process_image():
         
     try:
         # Save the uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        
-        # Get base name without extension
-        base_name = os.path.splitext(filename)[0]
-        processed_filename = f'processed_{filename}'
-        
-        # Step 1: Process the image
-        preprocessed_path = os.path.join(OUTPUT_ROOT, 'preprocessed', processed_filename)
-        preprocess_image(filepath, preprocessed_path)
+        filepath, filename, image_key = save_upload(file)
         
-        # Step 2: Cell Detection
-        cell_json_path = run_cell_detection(preprocessed_path)
-        
-        # Step 3: AI Model Processing
-        ai_json_path = ai_processing(preprocessed_path)
-        
-        # Step 4: Merge and Split Processing
-        merged_json_path, merged_viz_path = merge_split_processing(
-            cell_json_path=cell_json_path,
-            ocr_json_path=ai_json_path,
-            preprocessed_image_path=preprocessed_path
-        )
-        
-        if not merged_viz_path or not os.path.exists(merged_viz_path):
-            return jsonify({'status': 'error', 'error': 'Failed to generate visualization'}), 500
-        
-        # Load the JSON data to include in the response
-        with open(merged_json_path, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
-        
-        # Construct the edit URL
-        json_filename = os.path.basename(merged_json_path)
-        edit_url = f'/edit_results/{json_filename}'
-        
-        # Get the visualization filename
-        viz_filename = os.path.basename(merged_viz_path)
+        # Queue the processing and return right away; the client polls /jobs/<id>
+        # ?timing=1 adds per-stage timings, image size and peak memory to the result
+        timing = request.values.get('timing', '0').lower() in ('1', 'true', 'yes')
+        # ?response=metadata leaves the merged JSON out of the result (fetch it from stream_url)
+        job_id = uuid.uuid4().hex
+        job = job_queue.submit({'filepath': filepath, 'filename': filename, 'image_key': image_key,
+                                'timing': timing, 'response': response_mode(), 'job_id': job_id},
+                               job_id=job_id)
         
         return jsonify({
-            'status': 'success',
-            'original_path': f'/uploads/{filename}',
-            'output_image': f'/output/merge and split/{viz_filename}',
-            'edit_url': edit_url,
-            'json_data': json_data  # Include the JSON data directly in the response
-        })
+            'status': 'queued',
+            'job_id': job.id,
+            'status_url': f'/jobs/{job.id}',
+            'result_url': f'/jobs/{job.id}/result'
+        }), 202
         
+    except QueueFullError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 429
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """
+    Process several pages in one request. Results are streamed back as NDJSON,
+    one line per page in the order the pages finish.
+    """
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'status': 'error', 'error': 'No files provided'}), 400
+        
+    try:
+        batch_size = int(request.form.get('batch_size', os.environ.get('BATCH_SIZE', 4)))
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'batch_size must be an integer'}), 400
+    try:
+        mode = response_mode()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+        
+    uploads = [save_upload(file) for file in files]
+        
+    def generate():
+        for page_result in run_batch_pipeline(uploads, OUTPUT_ROOT, batch_size=batch_size):
+            if page_result.get('status') == 'success':
+                index_result(page_result, page_result['filename'])
+                if mode == 'metadata':
+                    page_result = metadata_only(page_result)
+            yield json.dumps(convert_numpy_types(page_result), ensure_ascii=False) + '\n'
+            
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/jobs', methods=['GET'])
+def jobs_overview():
+    return jsonify(job_queue.stats())
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'error': 'Job not found'}), 404
+    if job.status == 'failed':
+        return jsonify({'status': 'error', 'error': job.error}), 500
+    if job.status != 'succeeded':
+        # Not finished yet, report progress instead of the result
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result)
+
 @app.route('/edit_results/<filename>')
 def edit_results(filename):
     try:
@@ -153,10 +329,7 @@ def edit_results(filename):
         if not os.path.exists(json_path):
             return jsonify({'error': 'File not found'}), 404
             
-        with open(json_path, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
-            
-        return jsonify(json_data)
+        return send_merged_json(json_path)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -188,116 +361,57 @@ def save_edits(filename):
             os.path.join(json_dir, 'combined_with_spanning.json')
         ]
         
-        # If none of the common patterns match, check all files in the directory
+        # If none of the common patterns match, look the base name up in the result file index
         json_path = None
         for path in possible_paths:
             if os.path.exists(path):
                 json_path = path
                 break
         
-        # If we still don't have a match, list the directory to help debug
         if not json_path:
-            # List all files in the directory to help debugging
-            if os.path.exists(json_dir):
-                files_in_dir = [f for f in os.listdir(json_dir) if f.endswith('.json')]
-                
-                # Check for partial matches in the directory
-                best_match = None
-                for file in files_in_dir:
-                    base_name = filename.split('_res_')[0]
-                    if base_name in file and file.endswith('_res_combined_with_spanning.json'):
-                        best_match = file
-                        break
-                
-                if best_match:
-                    json_path = os.path.join(json_dir, best_match)
-                    print(f"Found best match for {filename}: {best_match}")
-                else:
-                    error_msg = f"Could not find JSON file for {filename}. Available files in directory: {files_in_dir}"
-                    print(error_msg)
-                    return jsonify({'success': False, 'error': error_msg}), 404
-            else:
-                return jsonify({'success': False, 'error': f"Directory {json_dir} does not exist"}), 404
+            matches = [m for m in db.find_result_files(filename.split('_res_')[0], limit=5)
+                       if os.path.exists(m['json_path'])]
+            if not matches:
+                error_msg = f"Could not find JSON file for {filename}"
+                print(error_msg)
+                return jsonify({'success': False, 'error': error_msg}), 404
+            json_path = matches[0]['json_path']
+            print(f"Found best match for {filename}: {matches[0]['json_filename']}")
             
         print(f"Found JSON file at: {json_path}")
-            
-        # Load current data
+        
+        # The version the editor last saw, used to detect saves from another tab
+        expected_version = changes.get('version', request.headers.get('If-Match'))
+        if expected_version is not None:
+            try:
+                expected_version = int(str(expected_version).strip('"'))
+            except ValueError:
+                return jsonify({'success': False, 'error': 'version must be an integer'}), 400
+        
         try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                current_data = json.load(f)
+            result = edit_store.apply(json_path, changes, expected_version)
         except json.JSONDecodeError as e:
             return jsonify({'success': False, 'error': f'Invalid JSON file: {str(e)}'}), 500
+        except EditConflictError as e:
+            return jsonify({'success': False, 'error': str(e), 'version': e.current_version}), 409
         
-        # Track which items were edited
-        edited_cells = []
-        edited_texts = []
-            
-        # Update the data with changes
-        if 'cells_with_text' in changes and changes['cells_with_text']:
-            for change in changes['cells_with_text']:
-                cell_id = change.get('cell_id')
-                new_text = change.get('text')
-                
-                if cell_id is None or new_text is None:
-                    continue
-                    
-                # Find and update the cell in the current data
-                cells_updated = False
-                if 'cells_with_text' in current_data:
-                    for cell in current_data['cells_with_text']:
-                        if cell['cell_id'] == cell_id:
-                            # Check if the text actually changed
-                            if cell.get('text', '') != new_text:
-                                cell['text'] = new_text
-                                cell['edited'] = True
-                                edited_cells.append(cell_id)
-                            cells_updated = True
-                            break
-                
-                if not cells_updated:
-                    print(f"Warning: Could not find cell_id {cell_id} in the JSON data")
-                        
-        if 'unassigned_text' in changes and changes['unassigned_text']:
-            for change in changes['unassigned_text']:
-                text_id = change.get('text_id')
-                new_text = change.get('text')
-                
-                if text_id is None or new_text is None:
-                    continue
-                    
-                # Find and update the text in the current data
-                text_updated = False
-                if 'unassigned_text' in current_data:
-                    for text in current_data['unassigned_text']:
-                        if text['text_id'] == text_id:
-                            # Check if the text actually changed
-                            if text.get('text', '') != new_text:
-                                text['text'] = new_text
-                                text['edited'] = True
-                                edited_texts.append(text_id)
-                            text_updated = True
-                            break
-                
-                if not text_updated:
-                    print(f"Warning: Could not find text_id {text_id} in the JSON data")
+        for key, ids in result['missing'].items():
+            print(f"Warning: Could not find {key} ids {ids} in the JSON data")
+        
+        edited_cells = result['edited'].get('cells_with_text', [])
+        edited_texts = result['edited'].get('unassigned_text', [])
         
         # If no changes were made, still return success
         if not edited_cells and not edited_texts:
-            return jsonify({'success': True, 'message': 'No changes needed'})
-                        
-        # Save the updated data
-        try:
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(current_data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'Failed to write to JSON file: {str(e)}'}), 500
+            return jsonify({'success': True, 'message': 'No changes needed', 'version': result['version']})
             
-        print(f"Successfully saved changes to {json_path}")
+        print(f"Successfully saved changes to {json_path} (version {result['version']})")
             
         return jsonify({
             'success': True, 
             'edited_cells': edited_cells, 
             'edited_texts': edited_texts,
+            'version': result['version'],
             'message': 'Changes saved successfully'
         })
         
@@ -350,13 +464,62 @@ def save_results():
 
 @app.route('/get_documents', methods=['GET'])
 def get_documents():
+    """
+    List saved documents one page at a time, newest first.
+    
+    Query parameters: limit, cursor (next_cursor of the previous page), name (substring),
+    date_from, date_to, has_edits (true/false) and fields (comma separated columns).
+    """
+    try:
+        has_edits = request.args.get('has_edits')
+        fields = request.args.get('fields')
+        page = db.list_documents(
+            limit=int(request.args.get('limit', DEFAULT_PAGE_SIZE)),
+            cursor=request.args.get('cursor') or None,
+            name=request.args.get('name') or None,
+            date_from=request.args.get('date_from') or None,
+            date_to=request.args.get('date_to') or None,
+            has_edits=None if has_edits in (None, '') else has_edits.lower() in ('1', 'true', 'yes'),
+            fields=[f.strip() for f in fields.split(',') if f.strip()] if fields else None
+        )
+        return jsonify({
+            'success': True,
+            'documents': page['documents'],
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more']
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search', methods=['GET'])
+def search_documents():
+    """
+    Full-text search over saved OCR text, best matches first.
+    
+    Query parameters: q (search terms, a trailing * matches a prefix), limit and offset.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query (q)'}), 400
     try:
-        documents = db.get_all_documents()
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+        page = db.search(query, limit=limit, offset=offset)
         return jsonify({
             'success': True,
-            'documents': documents
+            'query': query,
+            'results': page['results'],
+            'offset': offset,
+            'has_more': page['has_more']
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -378,41 +541,80 @@ def get_document(document_id):
 @app.route('/find_json/<prefix>', methods=['GET'])
 def find_json(prefix):
     """
-    Find JSON files in the merge and split directory that match a given prefix.
+    Find the result JSON files for an upload name, base prefix (e.g. processed_scan) or job id.
     This helps the client determine the correct filename for saving edits.
     """
     try:
-        json_dir = os.path.join(OUTPUT_ROOT, 'merge and split')
-        if not os.path.exists(json_dir):
-            return jsonify({'success': False, 'error': f"Directory {json_dir} does not exist"}), 404
-            
-        # List all JSON files in the directory
-        files = [f for f in os.listdir(json_dir) if f.endswith('.json')]
-        
-        # Find files that match the given prefix
-        matching_files = [f for f in files if prefix in f]
+        matches = db.find_result_files(prefix, limit=int(request.args.get('limit', 20)))
+        matching_files = [m['json_filename'] for m in matches]
         
-        # If we have an exact match for the combined pattern, prioritize it
-        combined_pattern = f"{prefix}_res_combined_with_spanning.json"
-        if combined_pattern in files:
-            best_match = combined_pattern
-        elif matching_files:
-            # Otherwise, return the first match
-            best_match = matching_files[0]
-        else:
-            best_match = None
-            
         return jsonify({
             'success': True,
-            'files': files,
+            # Only the matches; the full listing is paginated at /result_files
+            'files': matching_files,
             'matching_files': matching_files,
-            'best_match': best_match
+            'best_match': matching_files[0] if matching_files else None,
+            'results': matches
         })
         
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         print(f"Error finding JSON files: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/result_files', methods=['GET'])
+def result_files():
+    """List indexed result files, newest first. Query parameters: limit, cursor."""
+    try:
+        page = db.list_result_files(
+            limit=int(request.args.get('limit', DEFAULT_PAGE_SIZE)),
+            cursor=request.args.get('cursor') or None
+        )
+        return jsonify(dict(page, success=True))
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose pipeline timings, memory, job queue, cache and model metrics for Prometheus."""
+    jobs = job_queue.stats()
+    cache = result_cache.stats()
+    models = registry.stats()
+    extra_metrics = [
+        ('job_queue_jobs', 'gauge', 'Jobs per state in the processing queue.',
+         [({'state': state}, jobs[state]) for state in ('queued', 'running', 'succeeded', 'failed')]),
+        ('job_queue_capacity', 'gauge', 'Maximum number of queued jobs.', [({}, jobs['queue_capacity'])]),
+        ('result_cache_requests_total', 'counter', 'Result cache lookups per stage and outcome.',
+         [({'stage': stage, 'result': outcome}, counts[outcome])
+          for stage, counts in cache['stages'].items() for outcome in ('hits', 'misses')]),
+        ('result_cache_bytes', 'gauge', 'Size of the result cache on disk.', [({}, cache['bytes'])]),
+        ('result_cache_evictions_total', 'counter', 'Entries evicted from the result cache.',
+         [({}, cache['evictions'])]),
+        ('model_load_seconds', 'gauge', 'Time spent loading each model.',
+         [({'model': name}, info['load_seconds']) for name, info in models.items() if 'load_seconds' in info]),
+        ('model_rss_delta_bytes', 'gauge', 'Resident memory added by loading each model.',
+         [({'model': name}, info['rss_delta_bytes']) for name, info in models.items() if 'rss_delta_bytes' in info])
+    ]
+    return Response(render_prometheus(extra_metrics), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Report hit/miss counts per stage and the size of the result cache."""
+    return jsonify({'success': True, 'cache': result_cache.stats()})
+
+@app.route('/model_stats', methods=['GET'])
+def model_stats():
+    """Report load time and memory use of the models loaded in this worker."""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'models': registry.stats()
+    })
+
 # Helper function to convert NumPy types to standard Python types
 def convert_numpy_types(obj):
     if isinstance(obj, np.bool_):
@@ -448,16 +650,19 @@ def assess_quality():
         if img_data is None:
              return jsonify({'status': 'error', 'error': 'Could not decode image data from upload'}), 400
 
-        # Run quality assessment with image data instead of path
-        assessor = ImageQualityAssessor()
-        # ! IMPORTANT: assess_image needs to be changed to accept data !
-        raw_results = assessor.assess_image(img_data) # Send NumPy array
+        # Run quality assessment with the shared assessor (EasyOCR is loaded once per process)
+        mode = request.values.get('mode', IQA_MODE).lower()
+        with registry.get(IQA_MODEL) as assessor:
+            raw_results = assessor.assess_image(img_data, mode=mode) # Send NumPy array
 
         # Convert NumPy types (this part is still necessary)
         cleaned_results = convert_numpy_types(raw_results)
 
         return jsonify(cleaned_results)
 
+    except ValueError as e:
+        # Unknown mode
+        return jsonify({'status': 'error', 'error': str(e)}), 400
     except Exception as e:
          # Log the error
          print(f"Error during quality assessment (direct data): {str(e)}")
@@ -0,0 +1,89 @@
+import os
+import threading
+import uuid
+
+from Scripts.merge_split import render_visualization, VISUALIZATION_SUFFIX
+
+# Suffix of the downscaled copy of a visualization
+PREVIEW_SUFFIX = '_visualization_with_spanning_preview.jpg'
+
+# Longest side of a preview in pixels
+DEFAULT_PREVIEW_MAX_SIDE = 1024
+
+
+class VisualizationCache:
+    """
+    Merge/split visualizations rendered when they are first requested.
+
+    The pipeline only reserves the path of a visualization; drawing it (reading the
+    page, drawing every cell, label and spanning line, encoding a full-size JPEG)
+    happens here, from the merged JSON next to it. Rendered files stay on disk and
+    are drawn again only when the JSON is newer, e.g. after edits were compacted
+    into it. Requests for the same file wait for one render instead of each
+    drawing it.
+    """
+
+    def __init__(self, output_dir, preview_max_side=DEFAULT_PREVIEW_MAX_SIDE):
+        self.output_dir = output_dir
+        self.preview_max_side = preview_max_side
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_visualization(filename):
+        return filename.endswith(VISUALIZATION_SUFFIX) or filename.endswith(PREVIEW_SUFFIX)
+
+    @staticmethod
+    def preview_name(filename):
+        """Filename of the preview of a full-size visualization."""
+        if not filename.endswith(VISUALIZATION_SUFFIX):
+            return filename
+        return filename[:-len(VISUALIZATION_SUFFIX)] + PREVIEW_SUFFIX
+
+    def json_path(self, filename):
+        """The merged JSON a visualization (full size or preview) is drawn from."""
+        suffix = PREVIEW_SUFFIX if filename.endswith(PREVIEW_SUFFIX) else VISUALIZATION_SUFFIX
+        return os.path.join(self.output_dir, filename[:-len(suffix)] + '_combined_with_spanning.json')
+
+    def _path_lock(self, path):
+        with self._lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    @staticmethod
+    def _is_current(path, json_path):
+        return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(json_path)
+
+    def get(self, filename):
+        """
+        Return the path of a visualization, rendering it first if needed.
+
+        Args:
+            filename (str): Visualization or preview filename in the output directory
+
+        Returns:
+            str: Path of the rendered file, or None if there is no merged JSON for it
+                or it could not be rendered
+        """
+        filename = os.path.basename(filename)
+        path = os.path.join(self.output_dir, filename)
+        json_path = self.json_path(filename)
+        if not os.path.exists(json_path):
+            # Not a merged document (or a visualization from before lazy rendering)
+            return path if os.path.exists(path) else None
+        if self._is_current(path, json_path):
+            return path
+
+        with self._path_lock(path):
+            if self._is_current(path, json_path):
+                return path
+            max_side = self.preview_max_side if filename.endswith(PREVIEW_SUFFIX) else None
+            # Written under a temporary name, so a reader never sees a half-written file
+            temp_path = f"{path[:-4]}.{uuid.uuid4().hex}.tmp.jpg"
+            try:
+                if not render_visualization(json_path, temp_path, max_side):
+                    return None
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return path